@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'LittleLemon.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from LittleLemonAPI.order_events import OrderEventStreams  # noqa: E402, needs the apps loaded
+
+application = OrderEventStreams(django_application)
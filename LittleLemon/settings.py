@@ -46,11 +46,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'LittleLemonAPI.db.replicas.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,9 +81,16 @@ WSGI_APPLICATION = 'LittleLemon.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# LittleLemonAPI.db.mysql is Django's MySQL backend with a per-process
+# connection pool (LittleLemonAPI/db/pool.py): requests check out an open
+# connection instead of paying a TCP and auth handshake each. max_size bounds
+# the connections per worker process, so keep max_size * workers below MySQL's
+# max_connections, and max_idle below its wait_timeout. CONN_HEALTH_CHECKS pings
+# a connection when it is handed out. Wait times are exported at /api/metrics;
+# `manage.py benchdbpool` compares pooled and unpooled connects.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'LittleLemonAPI.db.mysql',
         'NAME': 'little_lemon',
         'USER': 'django',
         'PASSWORD': '123456789A-h',
@@ -89,10 +98,125 @@ DATABASES = {
         'PORT': '3306',
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            'pool': {
+                'max_size': 10,
+                'timeout': 10,
+                'max_lifetime': 1800,
+                'max_idle': 300,
+            },
         },
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas (LittleLemonAPI/db/replicas.py): aliases in DATABASES, listed
+# in DATABASE_REPLICAS, e.g.
+#     DATABASES['replica1'] = {**DATABASES['default'], 'HOST': 'replica1', 'TEST': {'MIRROR': 'default'}}
+# GET/HEAD/OPTIONS requests read categories, menu items and orders from one of
+# them; a user who made a successful write is pinned to the primary for
+# REPLICA_PIN_SECONDS, and so are catalog reads after a catalog edit. Replicas
+# lagging more than REPLICA_MAX_LAG seconds (SHOW REPLICA STATUS, checked every
+# REPLICA_CHECK_INTERVAL seconds per process) or unreachable are skipped. The pin
+# lives in the default cache: use a backend shared by all workers.
+DATABASE_ROUTERS = ['LittleLemonAPI.db.replicas.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+REPLICA_MAX_LAG = 5
+REPLICA_CHECK_INTERVAL = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Alias in CACHES used for menu item / category GET responses, and how long an
+# entry lives. Entries are also keyed by a catalog version that MenuItem and
+# Category saves/deletes bump, so edits are visible immediately. The version
+# lives in the same cache: use a backend shared by all workers in production.
+CATALOG_CACHE = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+
+
+# Where carts live: 'database' (a CartItem row per line) or 'cache' (one record
+# per user in the CART_CACHE alias, written behind to CartItem at checkout and,
+# if CART_FLUSH_INTERVAL is a number of seconds, by the first cart change after
+# that interval, so an evicted cart loses at most that much). The cache mode
+# needs a backend shared by all workers and refuses LocMem or dummy caches.
+# Cache cart lines get their CartItem ids up front, from blocks of
+# CART_LINE_ID_BLOCK ids each worker reserves in the database.
+CART_STORE = 'database'
+CART_CACHE = 'default'
+CART_CACHE_TIMEOUT = 7 * 24 * 3600
+CART_FLUSH_INTERVAL = 60
+CART_LINE_ID_BLOCK = 1000
+
+# Idempotency-Key support for POST /api/orders/, POST /api/cart/menu-items and
+# PUT /api/orders/<id> (LittleLemonAPI/idempotency.py): responses are kept in
+# the IDEMPOTENCY_CACHE alias for IDEMPOTENCY_TTL seconds and replayed to
+# retries with the same user and key. A retry arriving while the original is
+# still running waits up to IDEMPOTENCY_WAIT seconds for it, then gets a 409;
+# the original's claim on the key lapses after IDEMPOTENCY_LOCK_TIMEOUT seconds
+# if its worker died. Use a backend shared by all workers in production.
+IDEMPOTENCY_CACHE = 'default'
+IDEMPOTENCY_TTL = 24 * 3600
+IDEMPOTENCY_WAIT = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# Queued checkout (LittleLemonAPI/checkout_queue.py): with CHECKOUT_QUEUE_ENABLED,
+# a POST /api/orders/ sent with `Prefer: respond-async` is only validated and
+# stored as a CheckoutJob, answered with 202 and the job's URL under
+# /api/orders/jobs/, and turned into an order by `manage.py runcheckoutworkers`
+# (which must be running). Past CHECKOUT_QUEUE_MAX_DEPTH queued jobs requests
+# get a 503 with Retry-After. A job whose worker died is requeued after
+# CHECKOUT_JOB_TIMEOUT seconds; that and any error other than a validation one
+# are retried up to CHECKOUT_JOB_MAX_ATTEMPTS runs, then the job fails. Queue depth and wait times are exported at
+# /api/metrics.
+CHECKOUT_QUEUE_ENABLED = False
+CHECKOUT_QUEUE_MAX_DEPTH = 1000
+CHECKOUT_JOB_TIMEOUT = 300
+CHECKOUT_JOB_MAX_ATTEMPTS = 3
+
+# Most lines accepted by one batch POST (a JSON list) to /api/cart/menu-items.
+CART_BATCH_MAX_LINES = 50
+
+# Most rows accepted by one POST (JSON list or CSV) to /api/menu-items/import.
+MENU_IMPORT_MAX_ROWS = 1000
+
+
+# Most ?search= matches the in-process title index (used when the database has no
+# FULLTEXT support, e.g. SQLite) hands to the database as a list of ids; broader
+# searches, and searches made while the index is rebuilt in the background, are
+# matched by the database with a regex scan of the titles instead.
+SEARCH_INDEX_MAX_IDS = 1000
+
+
+# Delivered orders dated more than this many days ago are moved to the archive
+# tables by `manage.py archiveorders` (run it from cron), which keeps the live
+# order tables and their indexes small. Archived orders stay readable at
+# /api/orders/<id> and in /api/orders?include_archived=1, and keep counting in
+# the daily sales rollups behind /api/analytics/sales. They are read-only: PUT,
+# PATCH and DELETE on one answer 409 Conflict.
+ORDER_ARCHIVE_AFTER_DAYS = 90
+
+# Checkouts and order deletes journal their changes to the daily sales rollups
+# instead of updating the rollup rows, which every checkout of a busy day would
+# otherwise queue on. `manage.py foldsales` (run it from cron, e.g. every
+# minute) folds the journal into the rollups, this many deltas per transaction;
+# /api/analytics/sales folds whatever is left before it answers. Order lines
+# deleted through the admin or a User or MenuItem cascade are journaled too,
+# with the category recorded on the line when it was sold.
+SALES_FOLD_BATCH_SIZE = 5000
+
+# Orders per query (plus one query for their items) when /api/orders/export
+# streams an export; bounds the memory an export holds at any time.
+ORDER_EXPORT_CHUNK_SIZE = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -137,7 +261,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'LittleLemonAPI.authentication.RoleJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -150,22 +274,91 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'LittleLemonAPI.throttling.AnonRateThrottle',
+        'LittleLemonAPI.throttling.UserRateThrottle',
+        'LittleLemonAPI.throttling.ScopedRateThrottle',
     ),
     'DEFAULT_THROTTLE_RATES': {
         'anon': '5/min',
         'user': '10/min',
+        # per endpoint, on top of 'user', for views that set throttle_scope
+        'orders': '10/min',
+        # polls of /api/orders/jobs/<id>, instead of 'user'
+        'checkout_jobs': '60/min',
     },
 }
 
+# Where throttle state lives (LittleLemonAPI/throttling.py). 'sqlite' keeps a
+# token bucket per client in the RATE_LIMIT_PATH file, shared by all worker
+# processes on this host; 'cache' keeps sliding-window counters in the
+# RATE_LIMIT_CACHE alias, for several hosts sharing a Redis/Memcached backend.
+# `manage.py checkratelimit` verifies the limit holds across processes.
+# RATE_LIMIT_ENABLED = False turns throttling off (`manage.py loadtest` does so
+# for the server it starts).
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_STORE = 'sqlite'
+RATE_LIMIT_PATH = BASE_DIR / 'ratelimit.sqlite3'
+RATE_LIMIT_CACHE = 'default'
+
+# Serve GETs on the menu item, category and order endpoints from the native
+# async views in LittleLemonAPI/async_views.py. Only meant for the ASGI entry
+# point; under WSGI every such request would pay an async_to_sync round trip.
+# Compare both modes with `manage.py benchasyncviews` before turning it on.
+ASYNC_READ_VIEWS = False
+
+# Server-Sent Events at /api/orders/<id>/events (LittleLemonAPI/order_events.py):
+# status, delivery crew, total and date of an order pushed to its customer, its
+# delivery crew and managers whenever OrderDetail's PUT/PATCH changes them.
+# Served by the ASGI entry point ahead of Django, so under WSGI the path is a
+# 404; clients send the usual Authorization header, and opening a stream counts
+# against the default throttles like GET /api/orders/<id>. An open stream holds
+# only the newest unsent event; a process takes ORDER_EVENTS_MAX_STREAMS of them
+# (503 beyond) and ORDER_EVENTS_MAX_USER_STREAMS per user (429 beyond). Streams
+# send a keep-alive comment every ORDER_EVENTS_HEARTBEAT seconds and end after
+# ORDER_EVENTS_MAX_AGE seconds or at token expiry, and EventSource reconnects
+# after ORDER_EVENTS_RETRY_MS. ORDER_EVENTS_TRANSPORT 'local' only reaches
+# streams in the process that handled the write; 'cache' relays events through
+# the ORDER_EVENTS_CACHE alias (Redis/Memcached shared by all processes and
+# hosts), polled every ORDER_EVENTS_POLL_INTERVAL seconds and kept for
+# ORDER_EVENTS_TTL seconds.
+ORDER_EVENTS_ENABLED = False
+ORDER_EVENTS_MAX_STREAMS = 10000
+ORDER_EVENTS_MAX_USER_STREAMS = 20
+ORDER_EVENTS_HEARTBEAT = 15
+ORDER_EVENTS_MAX_AGE = 600
+ORDER_EVENTS_RETRY_MS = 3000
+ORDER_EVENTS_TRANSPORT = 'local'
+ORDER_EVENTS_CACHE = 'default'
+ORDER_EVENTS_POLL_INTERVAL = 0.5
+ORDER_EVENTS_TTL = 60
+
+# Per-view request metrics (LittleLemonAPI/metrics.py): wall, SQL, serializer,
+# permission and throttle time, query count and response size as histograms per
+# URL name, served to managers at /api/metrics in Prometheus text format.
+# Without METRICS_DIR every worker process reports only its own requests; with
+# it each worker writes a snapshot there at most every METRICS_FLUSH_INTERVAL
+# seconds and the endpoint sums them all, deleting snapshots not rewritten for
+# METRICS_SNAPSHOT_MAX_AGE seconds (workers that exited). Timing covers the
+# repo's views and serializers through TimedViewMixin / TimedSerializerMixin.
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 10
+METRICS_SNAPSHOT_MAX_AGE = 24 * 3600
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    "TOKEN_OBTAIN_SERIALIZER": "LittleLemonAPI.tokens.RoleTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "LittleLemonAPI.tokens.RoleTokenRefreshSerializer",
 }
 
+# How long a user's role version and is_active flag may be served from the
+# cache before they are re-read from the database; bounds token staleness with
+# per-process caches.
+ROLE_VERSION_CACHE_TIMEOUT = 60
+
 DJOSER = {
     'USER_ID_FIELD': 'username',
     'LOGOUT_ON_PASSWORD_CHANGE': True,
@@ -0,0 +1,19 @@
+# Settings for `python manage.py test --settings=LittleLemon.test_settings`:
+# SQLite files instead of MySQL, with IMMEDIATE transactions standing in for
+# row locks so concurrent checkouts serialize, a second database playing a read
+# replica for the router tests, and throttling off.
+import tempfile
+from .settings import *
+
+
+def sqlite_database(name):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / ('%s.sqlite3' % name),
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        'TEST': {'NAME': str(Path(tempfile.gettempdir()) / ('littlelemon-test-%s.sqlite3' % name))},
+    }
+
+
+DATABASES = {'default': sqlite_database('default'), 'replica': sqlite_database('replica')}
+RATE_LIMIT_ENABLED = False
@@ -0,0 +1,57 @@
+import datetime
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from .sales import untracked_deletes
+
+ORDER_COLUMNS = ('id', 'user_id', 'delivery_crew_id', 'total', 'status', 'date', 'updated_at')
+ORDER_ITEM_COLUMNS = ('id', 'order_id', 'menuitem_id', 'quantity', 'unit_price', 'price', 'category_id')
+
+
+def archivable_orders(days=None):
+    if days is None:
+        days = getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 90)
+    return Order.objects.filter(status=True, date__lt=timezone.localdate() - datetime.timedelta(days=days))
+
+
+def archive_batch(queryset, batch_size):
+    # Moves up to batch_size orders with their items into the archive tables in
+    # one transaction: an interrupted run leaves each order either fully live
+    # or fully archived, and the next run carries on with what is left. Sales
+    # rollups are untouched, archived sales still count.
+    with transaction.atomic():
+        queryset = queryset.order_by('id')
+        if connections[queryset.db].features.has_select_for_update_skip_locked:
+            # orders a PATCH is holding are left for the next batch
+            queryset = queryset.select_for_update(skip_locked=True)
+        else:
+            queryset = queryset.select_for_update()
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        archived_at = timezone.now()
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(archived_at=archived_at, **row) for row in Order.objects.filter(id__in=ids).values(*ORDER_COLUMNS)
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(**row) for row in OrderItem.objects.filter(order_id__in=ids).values(*ORDER_ITEM_COLUMNS)
+        ], batch_size=2000)
+        with untracked_deletes():
+            OrderItem.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(days=None, batch_size=1000, limit=None, progress=None):
+    # delivered orders dated more than `days` ago, oldest ids first
+    queryset = archivable_orders(days)
+    archived = 0
+    while limit is None or archived < limit:
+        moved = archive_batch(queryset, batch_size if limit is None else min(batch_size, limit - archived))
+        if not moved:
+            break
+        archived += moved
+        if progress:
+            progress(archived)
+    return archived
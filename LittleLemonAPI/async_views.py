@@ -0,0 +1,221 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.generics import GenericAPIView
+from rest_framework.filters import OrderingFilter
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from django_filters.rest_framework import DjangoFilterBackend
+from .catalog_cache import AsyncCatalogCacheMixin, aget_catalog_version
+from .conditional import conditional_response, set_validators
+from .metrics import TimedViewMixin, timing
+from .models import ArchivedOrder, Category, MenuItem, Order
+from .pagination import AsyncPageNumberPagination, OrderKeysetPagination
+from .permissions import OnlyManagerCreates, OnlyManagerDestroys, OnlyManagerPatches, OnlyManagerUpdates
+from .querysets import ShapedQuerysetMixin, aprefetch_for, shape_queryset
+from .roles import aget_roles
+from .search import TitleSearchFilter
+from .serializers import CategorySerializer, ReadArchivedOrderSerializer, ReadMenuItemSerializer, ReadOrderSerializer
+from .views import archived_orders, check_order_access, includes_archive, list_with_archive, order_etag, visible_orders
+
+
+class AsyncAPIView(TimedViewMixin, GenericAPIView):
+    # Runs the DRF request cycle natively on the event loop: authentication, role
+    # resolution and throttling await the cache/ORM, after which the regular
+    # (sync) permission classes only read memoized roles. Handlers are async and
+    # the response is rendered here so Django does not hop to a thread for it.
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), None)
+            if request.method.lower() not in self.http_method_names or handler is None:
+                raise exceptions.MethodNotAllowed(request.method)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return rendered(self.response)
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+        await self.aperform_authentication(request)
+        await aget_roles(request)
+        self.check_permissions(request)
+        await self.acheck_throttles(request)
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    @timing('throttle')
+    async def acheck_throttles(self, request):
+        throttle_durations = []
+        for throttle in self.get_throttles():
+            if hasattr(throttle, 'aallow_request'):
+                allowed = await throttle.aallow_request(request, self)
+            else:
+                allowed = await sync_to_async(throttle.allow_request)(request, self)
+            if not allowed:
+                throttle_durations.append(throttle.wait())
+        if throttle_durations:
+            durations = [duration for duration in throttle_durations if duration is not None]
+            self.throttled(request, max(durations, default=None))
+
+    async def afilter_queryset(self, queryset):
+        # a search reads the catalog version and may scan the titles
+        if self.request.query_params.get(api_settings.SEARCH_PARAM):
+            return await sync_to_async(self.filter_queryset)(queryset)
+        return self.filter_queryset(queryset)
+
+    async def alist(self):
+        queryset = await self.afilter_queryset(self.get_queryset())
+        page = await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer([obj async for obj in queryset.aiterator(chunk_size=2000)], many=True).data)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, ValueError, TypeError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def aretrieve(self):
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+
+def rendered(response):
+    # renders a DRF response into a plain HttpResponse, which Django's async
+    # handler returns as is instead of calling render() through sync_to_async
+    if not hasattr(response, 'render'):
+        return response
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+class AsyncCategoryList(AsyncCatalogCacheMixin, ShapedQuerysetMixin, AsyncAPIView):
+    catalog_cache_name = 'CategoryList'
+    filter_backends = [DjangoFilterBackend, OrderingFilter, TitleSearchFilter]
+    queryset = Category.objects.all()
+    ordering_fields = ['title']
+    search_fields = ['title']
+    serializer_class = CategorySerializer
+    permission_classes = [OnlyManagerCreates]
+    pagination_class = AsyncPageNumberPagination
+
+    async def get(self, request, *args, **kwargs):
+        return await self.acached_response(request, self.alist)
+
+
+class AsyncMenuItemList(AsyncCatalogCacheMixin, ShapedQuerysetMixin, AsyncAPIView):
+    catalog_cache_name = 'MenuItemList'
+    filter_backends = [DjangoFilterBackend, OrderingFilter, TitleSearchFilter]
+    queryset = MenuItem.objects.all()
+    ordering_fields = ['title', 'featured']
+    search_fields = ['title']
+    filter_fields = ['category', 'featured']
+    serializer_class = ReadMenuItemSerializer
+    permission_classes = [OnlyManagerCreates]
+    pagination_class = AsyncPageNumberPagination
+
+    async def get(self, request, *args, **kwargs):
+        return await self.acached_response(request, self.alist)
+
+
+class AsyncMenuItemDetail(AsyncCatalogCacheMixin, ShapedQuerysetMixin, AsyncAPIView):
+    catalog_cache_name = 'MenuItemDetail'
+    queryset = MenuItem.objects.all()
+    serializer_class = ReadMenuItemSerializer
+    permission_classes = [OnlyManagerUpdates, OnlyManagerDestroys, OnlyManagerPatches]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.acached_response(request, self.aretrieve)
+
+
+class AsyncOrderList(AsyncAPIView):
+    ordering_fields = ['date', 'status']
+    search_fields = ['date', 'status']
+    filter_fields = ['status']
+    serializer_class = ReadOrderSerializer
+    pagination_class = OrderKeysetPagination
+    throttle_scope = 'orders'
+
+    def get_queryset(self):
+        return shape_queryset(visible_orders(self.request), self.get_serializer_class())
+
+    async def get(self, request, *args, **kwargs):
+        if includes_archive(request):
+            return await sync_to_async(list_with_archive)(self)
+        return await self.alist()
+
+
+class AsyncOrderDetail(ShapedQuerysetMixin, AsyncAPIView):
+    queryset = Order.objects.all()
+    defer_prefetch = True
+    serializer_class = ReadOrderSerializer
+    throttle_scope = 'orders'
+
+    async def get(self, request, *args, **kwargs):
+        serializer_class = ReadOrderSerializer
+        try:
+            order = await self.aget_object()
+        except Http404:
+            try:
+                order = await archived_orders().aget(pk=kwargs['pk'])
+            except ArchivedOrder.DoesNotExist:
+                raise Http404
+            self.check_object_permissions(request, order)
+            serializer_class = ReadArchivedOrderSerializer
+        check_order_access(request, order)
+        etag = order_etag(order, await aget_catalog_version())
+        response = conditional_response(request, etag)
+        if response is not None:
+            return response
+        await aprefetch_for([order], serializer_class)
+        return set_validators(Response(serializer_class(order, context=self.get_serializer_context()).data), etag)
+
+
+def read_view(sync_view_class, async_view_class):
+    # GETs go to the async variant, every other method to the sync DRF view in a
+    # thread; with ASYNC_READ_VIEWS off the sync view is used as is
+    sync_view = sync_view_class.as_view()
+    if not getattr(settings, 'ASYNC_READ_VIEWS', False):
+        return sync_view
+    async_view = async_view_class.as_view()
+    threaded_sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_view(request, *args, **kwargs)
+        return await threaded_sync_view(request, *args, **kwargs)
+
+    return csrf_exempt(view)
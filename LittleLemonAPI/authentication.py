@@ -0,0 +1,71 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .roles import aget_role_state, get_role_state
+from .tokens import ROLES_CLAIM, ROLE_VERSION_CLAIM, USERNAME_CLAIM
+
+
+class RoleJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not has_role_claims(validated_token):
+            # tokens issued before role claims existed fall back to a database lookup
+            return super().get_user(validated_token)
+        user_id = token_user_id(validated_token)
+        check_role_state(validated_token, get_role_state(user_id))
+        return token_user(user_id, validated_token)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if not has_role_claims(validated_token):
+            return await sync_to_async(super().get_user)(validated_token)
+        user_id = token_user_id(validated_token)
+        check_role_state(validated_token, await aget_role_state(user_id))
+        return token_user(user_id, validated_token)
+
+
+def has_role_claims(validated_token):
+    return ROLES_CLAIM in validated_token and ROLE_VERSION_CLAIM in validated_token
+
+
+def check_role_state(validated_token, state):
+    # what simplejwt's get_user checks on the database row, from the cached state
+    version, is_active = state
+    if not is_active:
+        raise AuthenticationFailed("User is inactive", code="user_inactive")
+    if validated_token[ROLE_VERSION_CLAIM] != version:
+        raise InvalidToken("Token roles are out of date, please refresh it")
+
+
+def token_user_id(validated_token):
+    try:
+        # simplejwt stores the id as a string; the deferred User needs the real pk
+        # type so comparisons such as order.user_id != request.user.pk hold
+        return User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+    except (KeyError, ValidationError):
+        raise InvalidToken("Token contained no recognizable user identification")
+
+
+def token_user(user_id, validated_token):
+    # a User instance with every field but the pk and username deferred, so FK
+    # filters and comparisons work and anything else is loaded only on access
+    field_names = ['id']
+    values = [user_id]
+    if USERNAME_CLAIM in validated_token:
+        field_names.append('username')
+        values.append(validated_token[USERNAME_CLAIM])
+    user = User.from_db(DEFAULT_DB_ALIAS, field_names, values)
+    user.token_roles = frozenset(validated_token[ROLES_CLAIM])
+    return user
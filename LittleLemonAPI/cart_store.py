@@ -0,0 +1,207 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Max
+from rest_framework import serializers
+from .models import CartItem, CartLineIdBlock, MenuItem
+
+# v2: lines carry their CartItem id; v1 records (keyed by menu item id only)
+# are ignored and read back from CartItem
+CART_KEY = 'littlelemon:cart:v2:%s'
+CART_LOCK_KEY = 'littlelemon:cart-lock:%s'
+
+
+def uses_cache_cart():
+    if getattr(settings, 'CART_STORE', 'database') != 'cache':
+        return False
+    # a per-process cache splits each cart across workers and LocMem's small
+    # MAX_ENTRIES evicts carts before they are written behind
+    cache = caches[getattr(settings, 'CART_CACHE', 'default')]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured("CART_STORE = 'cache' needs a shared cache backend for CART_CACHE, not %s" % type(cache).__name__)
+    return True
+
+
+class CacheCartStore:
+    # Keeps each user's cart as one cache record,
+    #   {'items': {menuitem_id: [line_id, quantity, unit_price, price]}, 'flushed': ts, 'dirty': bool}
+    # and writes it behind to CartItem at checkout, on clear, or when a mutation
+    # finds the last flush older than CART_FLUSH_INTERVAL. A missing record is
+    # read back from CartItem, so an evicted cart survives as of its last flush.
+    # A line's id is the id of its CartItem row, written with it, so line ids
+    # mean the same in both cart modes and do not change across flushes.
+    lock_timeout = 10
+    lock_wait = 5
+
+    def __init__(self):
+        self.ids_lock = threading.Lock()
+        self.forget_line_ids()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'CART_CACHE', 'default')]
+
+    @contextmanager
+    def locked(self, user):
+        key = CART_LOCK_KEY % user.pk
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(key, token, self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise serializers.ValidationError("Your cart is busy, please retry")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            # a holder that overran lock_timeout leaves the lock to whoever took
+            # it since; the cache API has no compare-and-delete, so this only
+            # narrows the race to the time between these two calls
+            if self.cache.get(key) == token:
+                self.cache.delete(key)
+
+    def new_line_ids(self, count):
+        # CartItem ids from a block reserved above every id handed out or
+        # written so far; a worker goes back to the database once per
+        # CART_LINE_ID_BLOCK new lines. Rows inserted with plain auto-increment
+        # ids while cache carts are in use could take ids of a reserved block.
+        ids = []
+        with self.ids_lock:
+            while len(ids) < count:
+                if self.next_id > self.last_id:
+                    self.next_id, self.last_id = self.reserve_line_ids(max(count - len(ids), getattr(settings, 'CART_LINE_ID_BLOCK', 1000)))
+                taken = min(count - len(ids), self.last_id - self.next_id + 1)
+                ids.extend(range(self.next_id, self.next_id + taken))
+                self.next_id += taken
+        return ids
+
+    def forget_line_ids(self):
+        self.next_id, self.last_id = 1, 0
+
+    def reserve_line_ids(self, size):
+        CartLineIdBlock.objects.get_or_create(pk=1)
+        with transaction.atomic():
+            block = CartLineIdBlock.objects.select_for_update().get(pk=1)
+            first = max(block.end, CartItem.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+            block.end = first + size - 1
+            block.save(update_fields=['end'])
+        return first, block.end
+
+    def load(self, user):
+        record = self.cache.get(CART_KEY % user.pk)
+        if record is None:
+            rows = CartItem.objects.filter(user=user).values_list('menuitem_id', 'id', 'quantity', 'unit_price', 'price')
+            record = {
+                'items': {menuitem_id: [line_id, quantity, str(unit_price), str(price)] for menuitem_id, line_id, quantity, unit_price, price in rows},
+                'flushed': time.time(),
+                'dirty': False,
+            }
+        return record
+
+    def save(self, user, record):
+        interval = getattr(settings, 'CART_FLUSH_INTERVAL', None)
+        if record['dirty'] and interval is not None and time.time() - record['flushed'] >= interval:
+            self.persist(user, record)
+        self.cache.set(CART_KEY % user.pk, record, getattr(settings, 'CART_CACHE_TIMEOUT', 7 * 24 * 3600))
+
+    def persist(self, user, record):
+        # lines whose menu item was deleted since they were added are dropped,
+        # as items() drops them, instead of failing the insert
+        lines = record['items']
+        for menuitem_id in set(lines) - set(MenuItem.objects.filter(pk__in=list(lines)).values_list('pk', flat=True)):
+            del lines[menuitem_id]
+        line_ids = {line[0] for line in lines.values()}
+        with transaction.atomic():
+            stored = set(CartItem.objects.filter(user=user).values_list('id', flat=True))
+            CartItem.objects.filter(user=user).exclude(id__in=line_ids).delete()
+            CartItem.objects.bulk_create([
+                CartItem(id=line_id, user=user, menuitem_id=menuitem_id, quantity=quantity, unit_price=unit_price, price=price)
+                for menuitem_id, (line_id, quantity, unit_price, price) in lines.items() if line_id not in stored
+            ])
+        record['flushed'] = time.time()
+        record['dirty'] = False
+
+    def items(self, user):
+        lines = self.load(user)['items']
+        menuitems = MenuItem.objects.select_related('category').in_bulk(list(lines))
+        return [
+            CartItem(id=line_id, user=user, menuitem=menuitems[menuitem_id], quantity=quantity, unit_price=Decimal(unit_price), price=Decimal(price))
+            for menuitem_id, (line_id, quantity, unit_price, price) in sorted(lines.items(), key=lambda line: line[1][0])
+            if menuitem_id in menuitems
+        ]
+
+    def add(self, user, menuitem_id, quantity, unit_price, price):
+        with self.locked(user):
+            record = self.load(user)
+            if menuitem_id in record['items']:
+                raise serializers.ValidationError({'non_field_errors': ["You already have this item in your cart"]})
+            line_id, = self.new_line_ids(1)
+            record['items'][menuitem_id] = [line_id, quantity, str(unit_price), str(price)]
+            record['dirty'] = True
+            self.save(user, record)
+        return line_id
+
+    def add_many(self, user, lines):
+        # adds the lines not already in the cart; returns {menu item id: line id}
+        # for the lines added
+        with self.locked(user):
+            record = self.load(user)
+            new = [line for line in lines if line['menuitem_id'] not in record['items']]
+            added = {}
+            for line, line_id in zip(new, self.new_line_ids(len(new))):
+                record['items'][line['menuitem_id']] = [line_id, line['quantity'], str(line['unit_price']), str(line['price'])]
+                added[line['menuitem_id']] = line_id
+            if added:
+                record['dirty'] = True
+                self.save(user, record)
+        return added
+
+    def remove(self, user, line_id):
+        with self.locked(user):
+            record = self.load(user)
+            menuitem_id = next((menuitem_id for menuitem_id, line in record['items'].items() if line[0] == line_id), None)
+            if menuitem_id is None:
+                return False
+            del record['items'][menuitem_id]
+            record['dirty'] = True
+            self.save(user, record)
+        return True
+
+    def clear(self, user):
+        with self.locked(user):
+            CartItem.objects.filter(user=user).delete()
+            self.cache.delete(CART_KEY % user.pk)
+
+    def flush(self, user):
+        record = self.load(user)
+        if record['dirty']:
+            self.persist(user, record)
+            self.cache.set(CART_KEY % user.pk, record, getattr(settings, 'CART_CACHE_TIMEOUT', 7 * 24 * 3600))
+
+    @contextmanager
+    def checking_out(self, user):
+        # the cart lock is held from the flush to the cache clear, so a concurrent
+        # add cannot slip in and a second checkout cannot re-flush a converted cart
+        with self.locked(user):
+            self.flush(user)
+            yield
+            self.cache.delete(CART_KEY % user.pk)
+
+
+cache_cart = CacheCartStore()
+
+
+@contextmanager
+def checking_out(user):
+    if uses_cache_cart():
+        with cache_cart.checking_out(user):
+            yield
+    else:
+        yield
@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from .conditional import conditional_response, set_validators
+
+CATALOG_VERSION_KEY = 'littlelemon:catalog:version'
+CATALOG_MODIFIED_KEY = 'littlelemon:catalog:modified'
+CATALOG_ENTRY_KEY = 'littlelemon:catalog:%s:%s'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def catalog_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+
+def _fresh_version():
+    # a millisecond timestamp never collides with versions handed out before the
+    # version key was evicted, so old entries cannot be resurrected
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    cache = catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _fresh_version(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_catalog_version():
+    cache = catalog_cache()
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, _fresh_version(), None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_modified():
+    return catalog_cache().get(CATALOG_MODIFIED_KEY)
+
+
+async def aget_catalog_modified():
+    return await catalog_cache().aget(CATALOG_MODIFIED_KEY)
+
+
+def bump_catalog_version(modified=None):
+    cache = catalog_cache()
+    cache.set(CATALOG_MODIFIED_KEY, int(modified.timestamp() if modified else time.time()), None)
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = _fresh_version()
+        cache.set(CATALOG_VERSION_KEY, version, None)
+        return version
+
+
+def catalog_cache_key(request, view_name, version):
+    query = sorted((key, sorted(request.query_params.getlist(key))) for key in request.query_params)
+    raw = repr((request.get_host(), request.path, query))
+    return CATALOG_ENTRY_KEY % (version, view_name + ':' + hashlib.md5(raw.encode()).hexdigest())
+
+
+def record(hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+
+def catalog_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class CatalogCacheMixin:
+    # caches the serialized GET payload of catalog views; entries are keyed by the
+    # catalog version, so a bump from the model signals invalidates all of them.
+    # The same key doubles as the ETag, so a matching If-None-Match is answered
+    # with a 304 before the cache or the database is touched
+    catalog_cache_name = None
+
+    def get_catalog_cache_name(self):
+        return self.catalog_cache_name or type(self).__name__
+
+    def cached_response(self, request, build):
+        cache = catalog_cache()
+        key = catalog_cache_key(request, self.get_catalog_cache_name(), get_catalog_version())
+        etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+        last_modified = get_catalog_modified()
+        response = conditional_response(request, etag, last_modified)
+        if response is not None:
+            record(True)
+            return response
+        data = cache.get(key)
+        if data is not None:
+            record(True)
+            return set_validators(Response(data, headers={'X-Cache': 'HIT'}), etag, last_modified)
+        record(False)
+        response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+            set_validators(response, etag, last_modified)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
+
+
+class AsyncCatalogCacheMixin(CatalogCacheMixin):
+    # async twin of cached_response(); async views set catalog_cache_name to the
+    # sync view they mirror so both share entries and ETags
+    async def acached_response(self, request, build):
+        cache = catalog_cache()
+        key = catalog_cache_key(request, self.get_catalog_cache_name(), await aget_catalog_version())
+        etag = '"%s"' % hashlib.md5(key.encode()).hexdigest()
+        last_modified = await aget_catalog_modified()
+        response = conditional_response(request, etag, last_modified)
+        if response is not None:
+            record(True)
+            return response
+        data = await cache.aget(key)
+        if data is not None:
+            record(True)
+            return set_validators(Response(data, headers={'X-Cache': 'HIT'}), etag, last_modified)
+        record(False)
+        response = await build()
+        if response.status_code == 200:
+            await cache.aset(key, response.data, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+            set_validators(response, etag, last_modified)
+        response['X-Cache'] = 'MISS'
+        return response
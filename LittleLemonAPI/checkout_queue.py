@@ -0,0 +1,127 @@
+import datetime
+import uuid
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from .metrics import registry
+from .models import CheckoutJob
+from .services import checkout
+
+
+class QueueFull(APIException):
+    # backpressure: clients are asked to come back instead of piling on
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many orders are waiting to be placed, try again shortly"
+    default_code = 'queue_full'
+    wait = 5
+
+
+class StaleClaim(Exception):
+    pass
+
+
+GAVE_UP_ERRORS = {'non_field_errors': ["The order could not be placed, please try again"]}
+
+
+def max_attempts():
+    return getattr(settings, 'CHECKOUT_JOB_MAX_ATTEMPTS', 3)
+
+
+def queue_requested(request):
+    # RFC 7240: clients opt in with Prefer: respond-async
+    return getattr(settings, 'CHECKOUT_QUEUE_ENABLED', False) and 'respond-async' in request.headers.get('Prefer', '')
+
+
+def enqueue_checkout(user, total, date):
+    # Only cheap checks happen here: the queue depth (a bounded count) and a
+    # job of the same user still pending. The cart itself is read and checked
+    # against total by the worker, like checkout() does for a direct POST.
+    max_depth = getattr(settings, 'CHECKOUT_QUEUE_MAX_DEPTH', 1000)
+    if CheckoutJob.objects.filter(status=CheckoutJob.QUEUED)[:max_depth].count() >= max_depth:
+        raise QueueFull()
+    pending = CheckoutJob.objects.filter(user=user, status__in=(CheckoutJob.QUEUED, CheckoutJob.RUNNING)).values_list('pk', flat=True).first()
+    if pending is not None:
+        raise serializers.ValidationError({'non_field_errors': ["An order of yours is still being placed"], 'job': pending})
+    return CheckoutJob.objects.create(user=user, total=total, date=date)
+
+
+def claim_jobs(batch_size):
+    # marks up to batch_size queued jobs, oldest first, as running under a
+    # fresh claim; concurrent workers end up with disjoint sets even on
+    # databases without SKIP LOCKED, since only one UPDATE can flip a job
+    claim = uuid.uuid4().hex
+    with transaction.atomic():
+        queryset = CheckoutJob.objects.filter(status=CheckoutJob.QUEUED).order_by('id')
+        if connections[queryset.db].features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        CheckoutJob.objects.filter(pk__in=ids, status=CheckoutJob.QUEUED).update(
+            status=CheckoutJob.RUNNING, claim=claim, started_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+    return list(CheckoutJob.objects.filter(claim=claim, status=CheckoutJob.RUNNING).select_related('user').order_by('id'))
+
+
+def finish(job, outcome, **fields):
+    # False if the job's claim was voided by requeue_stale_jobs() meanwhile
+    return bool(CheckoutJob.objects.filter(pk=job.pk, claim=job.claim, status=CheckoutJob.RUNNING).update(
+        status=outcome, finished_at=timezone.now(), **fields,
+    ))
+
+
+def run_job(job):
+    # The order and the job's completion commit together: a worker that dies
+    # halfway leaves neither, and the job is requeued after CHECKOUT_JOB_TIMEOUT.
+    # Returns the job's new status, None if it was no longer this worker's.
+    started = timezone.now()
+    try:
+        with transaction.atomic():
+            order = checkout(job.user, job.total, job.date)
+            if not finish(job, CheckoutJob.DONE, order=order):
+                raise StaleClaim(job.pk)
+        outcome = CheckoutJob.DONE
+    except StaleClaim:
+        outcome = None
+    except serializers.ValidationError as exc:
+        errors = exc.detail if isinstance(exc.detail, dict) else {'non_field_errors': exc.detail}
+        outcome = CheckoutJob.FAILED if finish(job, CheckoutJob.FAILED, errors=errors) else None
+    except DatabaseError:
+        # e.g. a deadlock
+        outcome = retry_job(job)
+    if outcome is None:
+        return None
+    registry.observe_job(outcome, {
+        'checkout_queue_wait_seconds': (job.started_at - job.created_at).total_seconds(),
+        'checkout_job_duration_seconds': (timezone.now() - started).total_seconds(),
+    })
+    return outcome
+
+
+def retry_job(job):
+    # back in the queue, or failed once it has had CHECKOUT_JOB_MAX_ATTEMPTS runs;
+    # returns the job's new status, None if it was no longer this worker's
+    if job.attempts >= max_attempts():
+        return CheckoutJob.FAILED if finish(job, CheckoutJob.FAILED, errors=GAVE_UP_ERRORS) else None
+    requeued = CheckoutJob.objects.filter(pk=job.pk, claim=job.claim, status=CheckoutJob.RUNNING).update(status=CheckoutJob.QUEUED, claim='')
+    return CheckoutJob.QUEUED if requeued else None
+
+
+def requeue_stale_jobs():
+    # jobs whose worker vanished (or crashed on them); their claim is void, see
+    # finish(). Those out of attempts fail, so a job that kills its worker every
+    # time does not keep its user's next checkout blocked forever.
+    timeout = getattr(settings, 'CHECKOUT_JOB_TIMEOUT', 300)
+    stale = CheckoutJob.objects.filter(status=CheckoutJob.RUNNING, started_at__lt=timezone.now() - datetime.timedelta(seconds=timeout))
+    stale.filter(attempts__gte=max_attempts()).update(status=CheckoutJob.FAILED, claim='', finished_at=timezone.now(), errors=GAVE_UP_ERRORS)
+    return stale.update(status=CheckoutJob.QUEUED, claim='')
+
+
+def queue_stats():
+    # for /api/metrics: jobs per open state and the age of the oldest queued one
+    counts = {job_status: CheckoutJob.objects.filter(status=job_status).count() for job_status in (CheckoutJob.QUEUED, CheckoutJob.RUNNING)}
+    oldest = CheckoutJob.objects.filter(status=CheckoutJob.QUEUED).aggregate(oldest=Min('created_at'))['oldest']
+    return counts, (timezone.now() - oldest).total_seconds() if oldest else 0.0
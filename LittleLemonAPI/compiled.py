@@ -0,0 +1,115 @@
+from functools import lru_cache
+from django.db.models import F
+from rest_framework import serializers
+from rest_framework.response import Response
+from .metrics import timing
+
+PARENT_KEY = '_compiled_parent'
+
+# fields whose to_representation() returns the .values() value unchanged
+RAW_FIELDS = (
+    serializers.IntegerField, serializers.CharField, serializers.SlugField,
+    serializers.EmailField, serializers.BooleanField, serializers.PrimaryKeyRelatedField,
+)
+
+
+class CompileError(Exception):
+    pass
+
+
+class CompiledSerializer:
+    # A read-only ModelSerializer turned into one generated function over
+    # .values() rows: nested single serializers read the joined columns of the same
+    # row, many=True nested serializers (top level only) are fetched with one
+    # .values() query per page, and only fields that need formatting (Decimal,
+    # dates...) still call their DRF to_representation(). The output is the same
+    # JSON as serializer(many=True).data.
+    def __init__(self, serializer_class):
+        self.model = serializer_class.Meta.model
+        self.paths = []
+        self.formatters = {}
+        self.children = []
+        expression = self.compile(serializer_class(), '')
+        if self.children:
+            self.add_path(self.model._meta.pk.attname)
+        namespace = dict(self.formatters)
+        exec('def render(row, children):\n    return %s\n' % expression, namespace)
+        self.render = namespace['render']
+
+    def add_path(self, path):
+        if path not in self.paths:
+            self.paths.append(path)
+        return 'row[%r]' % path
+
+    def compile(self, serializer, prefix):
+        items = []
+        for field in serializer._readable_fields:
+            if field.source == '*' or '.' in field.source:
+                raise CompileError("%s.%s has no plain model source" % (type(serializer).__name__, field.field_name))
+            path = prefix + field.source
+            if isinstance(field, serializers.ListSerializer):
+                if prefix or not isinstance(field.child, serializers.ModelSerializer):
+                    raise CompileError("%s.%s: only top-level many=True model serializers compile" % (type(serializer).__name__, field.field_name))
+                relation = self.model._meta.get_field(field.source)
+                if not relation.one_to_many:
+                    raise CompileError("%s.%s is not a reverse foreign key" % (type(serializer).__name__, field.field_name))
+                self.children.append((relation.field.name, compiled_serializer(type(field.child), strict=True)))
+                expression = 'children[%d].get(%s) or []' % (len(self.children) - 1, self.add_path(self.model._meta.pk.attname))
+            elif isinstance(field, serializers.BaseSerializer):
+                expression = '(None if %s is None else %s)' % (self.add_path(path), self.compile(field, path + '__'))
+            elif type(field) in RAW_FIELDS:
+                expression = self.add_path(path)
+            elif isinstance(field, serializers.Field) and not isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField)):
+                name = 'f%d' % len(self.formatters)
+                self.formatters[name] = field.to_representation
+                column = self.add_path(path)
+                expression = '(None if %s is None else %s(%s))' % (column, name, column)
+            else:
+                raise CompileError("%s.%s (%s) is not supported" % (type(serializer).__name__, field.field_name, type(field).__name__))
+            items.append('%r: %s' % (field.field_name, expression))
+        return '{%s}' % ', '.join(items)
+
+    def values(self, queryset):
+        return queryset.prefetch_related(None).values(*self.paths)
+
+    @timing('serializer')
+    def serialize(self, rows):
+        rows = list(rows)
+        children = tuple(self.fetch_children(rows, fk_name, child) for fk_name, child in self.children)
+        render = self.render
+        return [render(row, children) for row in rows]
+
+    def fetch_children(self, rows, fk_name, child):
+        if not rows:
+            return {}
+        pk = self.model._meta.pk.attname
+        child_rows = list(child.model._default_manager.filter(**{fk_name + '__in': [row[pk] for row in rows]}).values(*child.paths, **{PARENT_KEY: F(fk_name)}))
+        grouped = {}
+        for row, data in zip(child_rows, child.serialize(child_rows)):
+            grouped.setdefault(row[PARENT_KEY], []).append(data)
+        return grouped
+
+
+@lru_cache(maxsize=None)
+def compiled_serializer(serializer_class, strict=False):
+    # None for serializers that cannot be compiled, unless strict
+    try:
+        return CompiledSerializer(serializer_class)
+    except CompileError:
+        if strict:
+            raise
+        return None
+
+
+class CompiledListMixin:
+    # serves list() through the compiled form of the view's serializer class;
+    # views whose serializer does not compile keep the regular DRF path
+    def list(self, request, *args, **kwargs):
+        compiled = compiled_serializer(self.get_serializer_class())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(queryset))
@@ -0,0 +1,19 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, etag=None, last_modified=None):
+    # returns a 304 (or 412) response when the client's validators still match,
+    # otherwise None so the caller goes on to build the full response
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
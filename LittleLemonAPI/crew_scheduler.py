@@ -0,0 +1,61 @@
+import heapq
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import Order
+from .order_events import publish_order
+from .roles import DELIVERY_CREW
+
+
+def crew_loads():
+    # {crew member id: open orders}; the counts are a range scan of
+    # order_crew_status_idx (delivery_crew, status, ...)
+    loads = dict.fromkeys(User.objects.filter(groups__name=DELIVERY_CREW).values_list('id', flat=True), 0)
+    open_orders = (
+        Order.objects.filter(delivery_crew__in=list(loads), status=False)
+        .values_list('delivery_crew').annotate(open_orders=Count('id')).order_by()
+    )
+    for crew_id, count in open_orders:
+        loads[crew_id] = count
+    return loads
+
+
+def assign_delivery_crew(batch_size=500, limit=None):
+    # Hands unassigned open orders, oldest first, to whichever crew member has the
+    # fewest open orders, and returns how many were assigned. Each batch costs one
+    # SELECT plus one UPDATE per crew member it touches, and one more SELECT for
+    # the assigned orders' events when ORDER_EVENTS_ENABLED; orders assigned by
+    # hand in the meantime are left alone.
+    loads = crew_loads()
+    if not loads:
+        return 0
+    heap = [(load, crew_id) for crew_id, load in loads.items()]
+    heapq.heapify(heap)
+    assigned = 0
+    while limit is None or assigned < limit:
+        size = batch_size if limit is None else min(batch_size, limit - assigned)
+        with transaction.atomic():
+            queryset = Order.objects.filter(delivery_crew__isnull=True, status=False).order_by('date', 'id')
+            if connections[queryset.db].features.has_select_for_update_skip_locked:
+                # concurrent schedulers take disjoint batches
+                queryset = queryset.select_for_update(skip_locked=True)
+            order_ids = list(queryset.values_list('id', flat=True)[:size])
+            if not order_ids:
+                break
+            batches = defaultdict(list)
+            for order_id in order_ids:
+                load, crew_id = heapq.heappop(heap)
+                batches[crew_id].append(order_id)
+                heapq.heappush(heap, (load + 1, crew_id))
+            updated_at = timezone.now()
+            for crew_id, ids in batches.items():
+                assigned += Order.objects.filter(pk__in=ids, delivery_crew__isnull=True).update(delivery_crew_id=crew_id, updated_at=updated_at)
+            if getattr(settings, 'ORDER_EVENTS_ENABLED', False):
+                # the rows this batch assigned carry its updated_at; each is
+                # published once the batch commits
+                for order in Order.objects.filter(pk__in=order_ids, updated_at=updated_at):
+                    publish_order(order)
+    return assigned
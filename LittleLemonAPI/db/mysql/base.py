@@ -0,0 +1,10 @@
+from django.db.backends.mysql import base
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    # ENGINE 'LittleLemonAPI.db.mysql': Django's MySQL backend with a connection
+    # pool, which Django itself only offers for PostgreSQL
+
+    def check_pooled_connection(self, connection):
+        connection.ping()
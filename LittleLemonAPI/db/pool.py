@@ -0,0 +1,304 @@
+import functools
+import os
+import threading
+import time
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError
+from django.db.backends.base.base import NO_DB_ALIAS
+
+POOL_DEFAULTS = {
+    # open connections per process, idle or checked out
+    'max_size': 10,
+    # seconds a checkout waits for a free connection before PoolTimeout
+    'timeout': 10,
+    # seconds after which a connection is closed instead of reused
+    'max_lifetime': 1800,
+    # seconds an idle connection is kept; keep it below the server's wait_timeout
+    'max_idle': 300,
+}
+CLOSE_REASONS = ('lifetime', 'idle', 'broken')
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ('connection', 'created', 'returned')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.returned = time.monotonic()
+
+
+class ConnectionPool:
+    # A bounded set of raw DB-API connections shared by the threads of one
+    # process. Idle connections are reused most recently returned first, so
+    # the least used ones age out under max_idle when traffic drops.
+    def __init__(self, name, connect, check=None, max_size=10, timeout=10, max_lifetime=1800, max_idle=300):
+        self.name = name
+        self.connect = connect
+        self.check = check
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.condition = threading.Condition()
+        self.idle = []
+        self.in_use = {}
+        self.size = 0
+        self.closed = False
+        self.stats = {
+            'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'timeouts': 0, 'created': 0,
+            **{'closed_' + reason: 0 for reason in CLOSE_REASONS},
+        }
+
+    def expiry(self, entry, now, idle=True):
+        if self.max_lifetime is not None and now - entry.created >= self.max_lifetime:
+            return 'lifetime'
+        if idle and self.max_idle is not None and now - entry.returned >= self.max_idle:
+            return 'idle'
+        return None
+
+    def evict(self, now):
+        # under the lock; the oldest returned connections sit at the front
+        stale = []
+        while self.idle and self.expiry(self.idle[0], now):
+            entry = self.idle.pop(0)
+            stale.append((entry, self.expiry(entry, now)))
+        self.size -= len(stale)
+        return stale
+
+    def discard(self, stale):
+        # outside the lock, closing may wait on the network
+        for entry, reason in stale:
+            try:
+                entry.connection.close()
+            except Exception:
+                pass
+        if stale:
+            with self.condition:
+                for _, reason in stale:
+                    self.stats['closed_' + reason] += 1
+                self.condition.notify(len(stale))
+
+    def healthy(self, entry):
+        try:
+            self.check(entry.connection)
+        except Exception:
+            return False
+        return True
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+        while True:
+            timed_out = False
+            with self.condition:
+                if self.closed:
+                    raise OperationalError("Connection pool %s is closed" % self.name)
+                stale = self.evict(time.monotonic())
+                while True:
+                    entry = None
+                    while self.idle:
+                        candidate = self.idle.pop()
+                        reason = self.expiry(candidate, time.monotonic())
+                        if reason is None:
+                            entry = candidate
+                            break
+                        stale.append((candidate, reason))
+                        self.size -= 1
+                    if entry is not None or self.size < self.max_size:
+                        break
+                    remaining = started + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        timed_out = True
+                        break
+                    waited = True
+                    self.condition.wait(remaining)
+                if entry is None and not timed_out:
+                    # reserve the slot before connecting outside the lock
+                    self.size += 1
+            self.discard(stale)
+            if timed_out:
+                raise PoolTimeout("No connection free in pool %s after %ss (max_size %d)" % (self.name, self.timeout, self.max_size))
+            if entry is None:
+                try:
+                    entry = PooledConnection(self.connect())
+                except BaseException:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.stats['created'] += 1
+            elif self.check is not None and not self.healthy(entry):
+                with self.condition:
+                    self.size -= 1
+                self.discard([(entry, 'broken')])
+                continue
+            wait = time.monotonic() - started
+            with self.condition:
+                self.in_use[id(entry.connection)] = entry
+                self.stats['checkouts'] += 1
+                if waited:
+                    self.stats['waits'] += 1
+                    self.stats['wait_seconds'] += wait
+                    self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], wait)
+            return entry.connection
+
+    def putconn(self, connection, broken=False):
+        now = time.monotonic()
+        with self.condition:
+            entry = self.in_use.pop(id(connection))
+            if broken:
+                reason = 'broken'
+            elif self.closed:
+                reason = 'idle'
+            else:
+                reason = self.expiry(entry, now, idle=False)
+            if reason is None:
+                entry.returned = now
+                self.idle.append(entry)
+                self.condition.notify()
+                stale = self.evict(now)
+            else:
+                self.size -= 1
+                stale = [(entry, reason)]
+        self.discard(stale)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            stale = [(entry, 'idle') for entry in self.idle]
+            self.size -= len(stale)
+            self.idle = []
+        self.discard(stale)
+
+    def snapshot(self):
+        with self.condition:
+            return {**self.stats, 'size': self.size, 'idle': len(self.idle), 'in_use': len(self.in_use), 'max_size': self.max_size}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(key, factory):
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # a forked worker must not share its parent's sockets; they stay
+            # open for the parent, the child starts with empty pools
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+
+def merge_pool_stats(merged, stats):
+    for key, value in stats.items():
+        merged[key] = max(merged.get(key, 0), value) if key == 'max_wait_seconds' else merged.get(key, 0) + value
+    return merged
+
+
+def pool_stats():
+    # per alias, summed over the pools of test or renamed databases
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    stats = {}
+    for pool in pools:
+        merge_pool_stats(stats.setdefault(pool.name, {}), pool.snapshot())
+    return stats
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class PooledDatabaseWrapperMixin:
+    # Hands out connections from a ConnectionPool when OPTIONS['pool'] is set
+    # (True or a dict overriding POOL_DEFAULTS) and returns them on close(),
+    # the way Django's PostgreSQL backend uses psycopg_pool. Django closes the
+    # connection at the end of every request with CONN_MAX_AGE = 0, which here
+    # means giving it back. With CONN_HEALTH_CHECKS the pool checks a
+    # connection each time it is handed out.
+
+    def check_pooled_connection(self, connection):
+        # a round trip over the raw DB-API connection; backends with a cheaper
+        # ping override it
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+    @property
+    def pool_options(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options or self.alias == NO_DB_ALIAS:
+            return None
+        if self.settings_dict.get('CONN_MAX_AGE', 0) != 0:
+            raise ImproperlyConfigured("Pooling doesn't support persistent connections.")
+        unknown = set(options) - set(POOL_DEFAULTS) if isinstance(options, dict) else set()
+        if unknown:
+            raise ImproperlyConfigured("Unknown pool options for database %r: %s" % (self.alias, ', '.join(sorted(unknown))))
+        return {**POOL_DEFAULTS, **(options if isinstance(options, dict) else {})}
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_pool(self, conn_params):
+        options = self.pool_options
+        if options is None:
+            return None
+        # keyed by the parameters too, so the test database gets its own pool
+        key = (self.alias, repr(sorted(conn_params.items())))
+        check = self.check_pooled_connection if self.settings_dict.get('CONN_HEALTH_CHECKS') else None
+        return get_pool(key, lambda: ConnectionPool(
+            self.alias, functools.partial(super(PooledDatabaseWrapperMixin, self).get_new_connection, conn_params), check, **options,
+        ))
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.getconn()
+        self.connection_pool = pool
+        return connection
+
+    def _close(self):
+        pool = getattr(self, 'connection_pool', None)
+        if self.connection is None or pool is None:
+            return super()._close()
+        connection, self.connection, self.connection_pool = self.connection, None, None
+        broken = self.errors_occurred and not self.healthy(connection)
+        if not broken and not self.autocommit:
+            # a transaction left open, e.g. close() inside atomic()
+            try:
+                connection.rollback()
+            except self.Database.Error:
+                broken = True
+        pool.putconn(connection, broken=broken)
+
+    def healthy(self, connection):
+        try:
+            self.check_pooled_connection(connection)
+        except self.Database.Error:
+            return False
+        return True
+
+    def close_if_health_check_failed(self):
+        if getattr(self, 'connection_pool', None) is not None:
+            # the pool checked the connection when it handed it out
+            return
+        return super().close_if_health_check_failed()
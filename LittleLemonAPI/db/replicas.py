@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# reads that may be served from a replica; everything else stays on the primary
+REPLICA_MODELS = {
+    'LittleLemonAPI.category', 'LittleLemonAPI.menuitem', 'LittleLemonAPI.order', 'LittleLemonAPI.orderitem',
+    'LittleLemonAPI.archivedorder', 'LittleLemonAPI.archivedorderitem',
+    'LittleLemonAPI.menuitemdailysales', 'LittleLemonAPI.categorydailysales',
+}
+CATALOG_MODELS = {'LittleLemonAPI.category', 'LittleLemonAPI.menuitem'}
+PIN_KEY = 'littlelemon:replica:pin:%s'
+
+_routing = ContextVar('littlelemon_replica_routing', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def pin_user(user_id):
+    # read-your-writes: the user's reads stay on the primary until replicas
+    # have had time to replay the write
+    cache.set(PIN_KEY % user_id, 1, pin_seconds())
+
+
+async def apin_user(user_id):
+    await cache.aset(PIN_KEY % user_id, 1, pin_seconds())
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY % user_id) is not None
+
+
+class ReplicaHealth:
+    # Per-process view of which replicas are usable, refreshed at most every
+    # REPLICA_CHECK_INTERVAL seconds. A replica that cannot be reached, has
+    # stopped replicating or lags more than REPLICA_MAX_LAG seconds is skipped
+    # until a later check finds it caught up.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+        self.usable = {}
+
+    def replication_lag(self, alias):
+        connection = connections[alias]
+        if connection.vendor != 'mysql':
+            connection.ensure_connection()
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW REPLICA STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                # not a replica, e.g. pointed at the primary in development
+                return 0
+            status = dict(zip([column[0] for column in cursor.description], row))
+        return status.get('Seconds_Behind_Source')
+
+    def check(self, alias):
+        try:
+            lag = self.replication_lag(alias)
+        except DatabaseError:
+            return False
+        return lag is not None and lag <= getattr(settings, 'REPLICA_MAX_LAG', pin_seconds())
+
+    def usable_replicas(self):
+        now = time.monotonic()
+        interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 5)
+        aliases = replica_aliases()
+        for alias in aliases:
+            if now - self.checked.get(alias, float('-inf')) < interval or not self.lock.acquire(blocking=False):
+                continue
+            try:
+                # one thread per process checks, the others keep the last verdict
+                self.usable[alias] = self.check(alias)
+                self.checked[alias] = now
+            finally:
+                self.lock.release()
+        return [alias for alias in aliases if self.usable.get(alias)]
+
+
+health = ReplicaHealth()
+
+
+class RoutingState:
+    __slots__ = ('request', 'alias', 'pinned', 'catalog_fresh')
+
+    def __init__(self, request):
+        self.request = request
+        self.alias = self.pinned = self.catalog_fresh = None
+
+
+def catalog_recently_modified():
+    from ..catalog_cache import get_catalog_modified
+    modified = get_catalog_modified()
+    return modified is not None and time.time() - modified < pin_seconds() + 1
+
+
+def replica_for(model):
+    state = _routing.get()
+    if state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    if state.pinned is None:
+        user = getattr(state.request, 'user', None)
+        state.pinned = bool(user is not None and user.is_authenticated and is_pinned(user.pk))
+    if state.pinned:
+        return None
+    if model._meta.label_lower in CATALOG_MODELS:
+        # a lagging replica would otherwise fill the catalog cache with the
+        # payload from before the edit, under the new catalog version
+        if state.catalog_fresh is None:
+            state.catalog_fresh = not catalog_recently_modified()
+        if not state.catalog_fresh:
+            return None
+    if state.alias is None:
+        # one replica per request, so its reads see a single point in time
+        usable = health.usable_replicas()
+        state.alias = random.choice(usable) if usable else DEFAULT_DB_ALIAS
+    return state.alias
+
+
+class ReplicaRouter:
+    # Sends safe-method requests' reads of REPLICA_MODELS to a replica in
+    # DATABASE_REPLICAS; writes and everything outside such a request go to
+    # the primary. ReplicaRoutingMiddleware marks the requests.
+
+    def db_for_read(self, model, **hints):
+        if not replica_aliases():
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related lookups follow the object they start from
+            return instance._state.db
+        if model._meta.label_lower not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        return replica_for(model)
+
+    def db_for_write(self, model, **hints):
+        # also for objects read from a replica
+        return DEFAULT_DB_ALIAS if replica_aliases() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary's binlog
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    # Marks GET/HEAD/OPTIONS requests as eligible for replica reads and pins the
+    # user to the primary after a successful write. The user is only known
+    # once DRF has authenticated the request, so the router looks it up lazily.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def wrote(self, request, response):
+        user = getattr(request, 'user', None)
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not replica_aliases():
+            return None
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _routing.set(RoutingState(request) if request.method in SAFE_METHODS else None)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        user_id = self.wrote(request, response)
+        if user_id is not None:
+            pin_user(user_id)
+        return response
+
+    async def __acall__(self, request):
+        token = _routing.set(RoutingState(request) if request.method in SAFE_METHODS else None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        user_id = self.wrote(request, response)
+        if user_id is not None:
+            await apin_user(user_id)
+        return response
@@ -0,0 +1,13 @@
+from django.db.backends.sqlite3 import base
+from ..pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    # ENGINE 'LittleLemonAPI.db.sqlite3': the same pool over file-based SQLite
+    # databases, to exercise it without a MySQL server. In-memory databases,
+    # such as the default test database, are left unpooled.
+
+    def get_pool(self, conn_params):
+        if self.is_in_memory_db():
+            return None
+        return super().get_pool(conn_params)
@@ -0,0 +1,119 @@
+import csv
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .compiled import compiled_serializer
+
+CSV_COLUMNS = (
+    'order_id', 'date', 'status', 'total', 'user_id', 'username', 'delivery_crew_id',
+    'menuitem_id', 'menuitem', 'category', 'quantity', 'unit_price', 'price',
+)
+# what a spreadsheet opening the file would read as the start of a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_row(values):
+    # a text cell starting like a formula (usernames and menu item titles are
+    # user input) is prefixed with ' so spreadsheets show it as text
+    return ["'" + value if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value for value in values]
+
+
+class NDJSONRenderer(BaseRenderer):
+    # export rows are streamed by the view; this only renders error responses
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=JSONEncoder) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = Echo()
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        writer = csv.writer(buffer)
+        return writer.writerow(csv_row(data.keys())) + writer.writerow(csv_row(map(str, data.values())))
+
+
+class Echo:
+    # csv.writer target whose write() hands the formatted line back
+    def write(self, value):
+        return value
+
+
+def export_chunks(queryset, serializer_class, chunk_size=None):
+    # Compiled rows of queryset in primary key order, fetched chunk_size orders
+    # at a time with their order items: one keyset query per chunk instead of a
+    # server-side cursor, which MySQL's client would buffer whole anyway. Only
+    # one chunk is held in memory, whatever the size of the export.
+    chunk_size = chunk_size or getattr(settings, 'ORDER_EXPORT_CHUNK_SIZE', 500)
+    compiled = compiled_serializer(serializer_class, strict=True)
+    rows = compiled.values(queryset).order_by('pk')
+    last = None
+    while True:
+        chunk = list((rows if last is None else rows.filter(pk__gt=last))[:chunk_size])
+        if not chunk:
+            return
+        yield compiled.serialize(chunk)
+        last = chunk[-1]['id']
+
+
+def ndjson_lines(chunks):
+    encoder = JSONEncoder(separators=(',', ':'))
+    for orders in chunks:
+        yield ''.join(encoder.encode(order) + '\n' for order in orders)
+
+
+def csv_lines(chunks):
+    # one line per order item, orders without items get one line of their own
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for orders in chunks:
+        lines = []
+        for order in orders:
+            user, crew = order['user'], order['delivery_crew']
+            columns = [
+                order['id'], order['date'], order['status'], order['total'], user['id'], user['username'],
+                crew['id'] if crew else '',
+            ]
+            for item in order['order_items'] or [None]:
+                if item is None:
+                    lines.append(writer.writerow(csv_row(columns + [''] * 6)))
+                    continue
+                menuitem = item['menuitem']
+                lines.append(writer.writerow(csv_row(columns + [
+                    menuitem['id'], menuitem['title'], menuitem['category']['slug'],
+                    item['quantity'], item['unit_price'], item['price'],
+                ])))
+        yield ''.join(lines)
+
+
+def async_lines(lines):
+    # ASGI would read a sync iterator to the end before sending anything; this
+    # hands it over one step (one chunk's queries) at a time, each run in the
+    # thread-sensitive executor where the request's database connection lives
+    step = sync_to_async(next)
+    done = object()
+
+    async def iterate():
+        try:
+            while True:
+                line = await step(lines, done)
+                if line is done:
+                    return
+                yield line
+        finally:
+            await sync_to_async(lines.close)()
+
+    return iterate()
+
+
+EXPORT_FORMATS = {'ndjson': ndjson_lines, 'csv': csv_lines}
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY = 'littlelemon:idempotency:%s:%s'
+MAX_KEY_LENGTH = 255
+PENDING = 'pending'
+# headers of the original response that are replayed with it
+REPLAYED_HEADERS = ('Location',)
+
+
+def idempotency_cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+
+def fingerprint(request):
+    # over the parsed body: request.body cannot be read any more once a
+    # multipart body has been parsed, and form fields may repeat, hence lists()
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = sorted(data.lists())
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(('%s %s\n%s' % (request.method, request.get_full_path(), body)).encode()).hexdigest()
+
+
+def replay(record):
+    response = Response(record['data'], status=record['status'], headers=record['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyMixin:
+    # Makes a write handler safe to retry: a request carrying an
+    # Idempotency-Key header runs once per user and key, and repeats of it get
+    # the stored response back for IDEMPOTENCY_TTL seconds instead of running
+    # the handler again. A repeat that arrives while the first request is still
+    # running waits up to IDEMPOTENCY_WAIT seconds for its response. Refusals
+    # (validation errors and other 4xx, raised or returned) are stored like
+    # successes; failures (5xx, unexpected exceptions) and 429s are not, so
+    # those can be retried for real.
+
+    def idempotent_response(self, request, build):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None or not request.user.is_authenticated:
+            return build()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'detail': "Idempotency-Key must be 1 to %d characters" % MAX_KEY_LENGTH}, status=status.HTTP_400_BAD_REQUEST)
+        cache = idempotency_cache()
+        cache_key = IDEMPOTENCY_KEY % (request.user.pk, hashlib.sha256(key.encode()).hexdigest())
+        request_fingerprint = fingerprint(request)
+        lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 30)
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT', 10)
+        delay = 0.01
+        while not cache.add(cache_key, {'state': PENDING, 'fingerprint': request_fingerprint}, lock_timeout):
+            record = cache.get(cache_key)
+            if record is not None and record['fingerprint'] != request_fingerprint:
+                return Response({'detail': "Idempotency-Key was already used for a different request"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record is not None and record['state'] != PENDING:
+                return replay(record)
+            # None: the first request failed or its claim expired, the next add() takes over
+            if time.monotonic() >= deadline:
+                return Response({'detail': "A request with this Idempotency-Key is still in progress"}, status=status.HTTP_409_CONFLICT)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        try:
+            try:
+                response = build()
+            except Exception as exc:
+                # re-raises anything that is not an API error, 404 or 403
+                response = self.handle_exception(exc)
+        except BaseException:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS or not isinstance(response, Response):
+            cache.delete(cache_key)
+            return response
+        cache.set(cache_key, {
+            'state': 'done', 'fingerprint': request_fingerprint, 'status': response.status_code, 'data': response.data,
+            'headers': {header: response[header] for header in REPLAYED_HEADERS if response.has_header(header)},
+        }, getattr(settings, 'IDEMPOTENCY_TTL', 24 * 3600))
+        return response
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.archive import archive_orders, archivable_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves delivered orders older than --days (default: ORDER_ARCHIVE_AFTER_DAYS) with their items into the "
+        "archive tables, in batches of one transaction each; safe to interrupt and rerun"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=1000, help="Orders moved per transaction")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many orders")
+        parser.add_argument('--sleep', type=float, default=0, help="Seconds to pause between batches to spare the primary")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the orders that would be archived")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write("%d orders to archive" % archivable_orders(options['days']).count())
+            return
+        started = time.perf_counter()
+
+        def progress(archived):
+            elapsed = time.perf_counter() - started
+            self.stdout.write("  %d orders archived, %.0f orders/s" % (archived, archived / elapsed if elapsed else 0))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        archived = archive_orders(options['days'], options['batch_size'], options['limit'], progress)
+        self.stdout.write("%d orders archived in %.1fs" % (archived, time.perf_counter() - started))
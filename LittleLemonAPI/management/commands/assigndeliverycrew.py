@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from LittleLemonAPI.crew_scheduler import assign_delivery_crew
+
+
+class Command(BaseCommand):
+    help = "Assigns unassigned open orders to the least loaded members of the Delivery crew group"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=None, help="Assign at most this many orders per run")
+        parser.add_argument('--interval', type=float, default=None, help="Keep running, every this many seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            assigned = assign_delivery_crew(batch_size=options['batch_size'], limit=options['limit'])
+            self.stdout.write("Assigned %d orders in %.2fs" % (assigned, time.perf_counter() - started))
+            if options['interval'] is None:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
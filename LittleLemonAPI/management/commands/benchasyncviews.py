@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import statistics
+import time
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory
+from LittleLemonAPI.async_views import AsyncMenuItemList, AsyncOrderDetail, AsyncOrderList
+from LittleLemonAPI.models import Category, MenuItem, Order, OrderItem
+from LittleLemonAPI.tokens import RoleRefreshToken
+from LittleLemonAPI.views import MenuItemList, OrderDetail, OrderList
+
+
+class Command(BaseCommand):
+    help = "Compares in-process throughput of the sync and async read views at a fixed concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--items', type=int, default=20)
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(title='bench', slug='bench')
+        customer = User.objects.create_user('bench-async-customer')
+        try:
+            items = MenuItem.objects.bulk_create([
+                MenuItem(title='bench %d' % i, price='5.00', featured=False, category=category)
+                for i in range(options['items'])
+            ])
+            order = Order.objects.create(user=customer, total='5.00', status=False, date=datetime.date.today())
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem=item, quantity=1, unit_price='5.00', price='5.00') for item in items
+            ])
+            token = str(RoleRefreshToken.for_user(customer).access_token)
+            endpoints = [
+                ('menu-items', '/api/menu-items', {}, MenuItemList, AsyncMenuItemList),
+                ('orders', '/api/orders/', {}, OrderList, AsyncOrderList),
+                ('order-detail', '/api/orders/%d' % order.pk, {'pk': order.pk}, OrderDetail, AsyncOrderDetail),
+            ]
+            self.stdout.write("%-14s %-6s %10s %9s %9s" % ('endpoint', 'mode', 'req/s', 'p50 ms', 'p99 ms'))
+            for name, path, kwargs, sync_class, async_class in endpoints:
+                # sync views are driven the way ASGIHandler runs them: in the thread-sensitive executor
+                modes = [
+                    ('sync', sync_to_async(sync_class.as_view(throttle_classes=[]))),
+                    ('async', async_class.as_view(throttle_classes=[])),
+                ]
+                for mode, view in modes:
+                    rate, latencies = asyncio.run(self.drive(view, path, kwargs, token, options))
+                    latencies.sort()
+                    self.stdout.write("%-14s %-6s %10.1f %9.2f %9.2f" % (
+                        name, mode, rate, statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1],
+                    ))
+        finally:
+            Order.objects.filter(user=customer).delete()
+            MenuItem.objects.filter(category=category).delete()
+            category.delete()
+            customer.delete()
+
+    async def drive(self, view, path, kwargs, token, options):
+        factory = AsyncRequestFactory()
+        remaining = options['requests']
+        latencies = []
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                request = factory.get(path, headers={'authorization': 'Bearer ' + token})
+                request.META['HTTP_HOST'] = 'localhost'
+                started = time.perf_counter()
+                response = await view(request, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(options['concurrency'])])
+        return options['requests'] / (time.perf_counter() - started), latencies
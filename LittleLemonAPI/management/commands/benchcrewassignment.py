@@ -0,0 +1,87 @@
+import datetime
+import random
+import time
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from LittleLemonAPI.crew_scheduler import assign_delivery_crew, crew_loads
+from LittleLemonAPI.models import Order
+from LittleLemonAPI.roles import DELIVERY_CREW
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares one-at-a-time crew assignment (the PATCH path) with the bulk scheduler on synthetic orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--crew', type=int, default=40)
+        parser.add_argument('--open-per-crew', type=int, default=20, help="Upper bound of already assigned open orders per member")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                for name, run in (('per-order PATCH', self.one_at_a_time), ('scheduler', self.scheduled)):
+                    self.measure(name, run, options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Generated rows rolled back")
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        group, _ = Group.objects.get_or_create(name=DELIVERY_CREW)
+        User.objects.bulk_create([User(username='bench-crew-%d' % i) for i in range(options['crew'])])
+        self.crew_ids = list(User.objects.filter(username__startswith='bench-crew-').values_list('id', flat=True))
+        group.user_set.add(*self.crew_ids)
+        customer = User.objects.create(username='bench-customer')
+        today = datetime.date.today()
+        preassigned = [
+            Order(user=customer, delivery_crew_id=crew_id, total='10.00', status=False, date=today)
+            for crew_id in self.crew_ids for _ in range(rng.randrange(options['open_per_crew'] + 1))
+        ]
+        Order.objects.bulk_create(preassigned + [
+            Order(user=customer, total='10.00', status=False, date=today - datetime.timedelta(minutes=rng.randrange(720)))
+            for _ in range(options['orders'])
+        ], batch_size=5000)
+        self.stdout.write("%d crew members with %d open orders, %d unassigned orders, set up in %.1fs" % (
+            len(self.crew_ids), len(preassigned), options['orders'], time.perf_counter() - started,
+        ))
+
+    def one_at_a_time(self, options):
+        # what a manager's PATCH per order costs: the crew lookup and group check
+        # of the serializer/view, then a full save, cycling through the crew
+        for index, order_id in enumerate(Order.objects.filter(delivery_crew__isnull=True, status=False).values_list('id', flat=True)):
+            crew_id = self.crew_ids[index % len(self.crew_ids)]
+            User.objects.filter(id=crew_id).exists()
+            order = Order.objects.get(pk=order_id)
+            order.delivery_crew = User.objects.get(id=crew_id)
+            order.delivery_crew.groups.filter(name=DELIVERY_CREW).exists()
+            order.save()
+
+    def scheduled(self, options):
+        assign_delivery_crew(batch_size=options['batch_size'])
+
+    def measure(self, name, run, options):
+        savepoint = transaction.savepoint()
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            run(options)
+            elapsed = time.perf_counter() - started
+        loads = [load for crew_id, load in crew_loads().items() if crew_id in self.crew_ids]
+        self.stdout.write("%-16s %8.2fs %8d queries   open orders per crew member: min %d, max %d" % (
+            name, elapsed, len(queries), min(loads), max(loads),
+        ))
+        transaction.savepoint_rollback(savepoint)
@@ -0,0 +1,75 @@
+import copy
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+from LittleLemonAPI.db.pool import PooledDatabaseWrapperMixin, close_pools, pool_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs request-shaped connect / SELECT 1 / close cycles from several threads against a database, "
+        "with and without the connection pool of LittleLemonAPI.db backends"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help="Cycles per thread")
+        parser.add_argument('--max-size', type=int, default=None, help="Pool size for the pooled run (default: the configured one)")
+
+    def handle(self, *args, **options):
+        settings_dict = connections[options['database']].settings_dict
+        backend = load_backend(settings_dict['ENGINE'])
+        if not issubclass(backend.DatabaseWrapper, PooledDatabaseWrapperMixin):
+            raise CommandError("%s is not a pooled backend; use LittleLemonAPI.db.mysql or LittleLemonAPI.db.sqlite3" % settings_dict['ENGINE'])
+        pool = settings_dict['OPTIONS'].get('pool') or True
+        if options['max_size']:
+            pool = {**(pool if isinstance(pool, dict) else {}), 'max_size': options['max_size']}
+        for name, pool_options in (('unpooled', None), ('pooled', pool)):
+            config = copy.deepcopy(settings_dict)
+            config['OPTIONS'].pop('pool', None)
+            if pool_options:
+                config['OPTIONS']['pool'] = pool_options
+            config['CONN_MAX_AGE'] = 0
+            self.measure(name, backend, config, options)
+        close_pools()
+
+    def measure(self, name, backend, config, options):
+        alias = '%s-bench' % options['database']
+        connect_times = []
+        errors = []
+
+        def run():
+            connection = backend.DatabaseWrapper(config, alias)
+            try:
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    connection.ensure_connection()
+                    connect_times.append(time.perf_counter() - started)
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                    connection.close()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError("%s run failed: %r" % (name, errors[0]))
+        connect_times.sort()
+        self.stdout.write("%-9s %8.0f req/s   connect mean %7.3fms  p99 %7.3fms" % (
+            name, len(connect_times) / elapsed, sum(connect_times) / len(connect_times) * 1000,
+            connect_times[int(len(connect_times) * 0.99)] * 1000,
+        ))
+        stats = pool_stats().get(alias)
+        if stats:
+            self.stdout.write("          %(created)d connections opened for %(checkouts)d checkouts, %(waits)d waited "
+                              "(%(wait_seconds).3fs total, max %(max_wait_seconds).3fs), %(timeouts)d timeouts" % stats)
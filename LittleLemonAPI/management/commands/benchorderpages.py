@@ -0,0 +1,79 @@
+import datetime
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from LittleLemonAPI.models import Order
+from LittleLemonAPI.pagination import OrderKeysetPagination
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares OFFSET and keyset order pages at increasing depths on a synthetic Order table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--depths', default='0,1000,10000,100000,500000')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated rows instead of rolling back")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                self.measure(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Generated rows rolled back")
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        User.objects.bulk_create([User(username='bench-customer-%d' % i) for i in range(options['customers'])], batch_size=1000)
+        user_ids = list(User.objects.filter(username__startswith='bench-customer-').values_list('id', flat=True))
+        today = datetime.date.today()
+        batch = []
+        for _ in range(options['orders']):
+            batch.append(Order(
+                user_id=rng.choice(user_ids), total='10.00', status=rng.random() < 0.8,
+                date=today - datetime.timedelta(days=rng.randrange(730)),
+            ))
+            if len(batch) == 10000:
+                Order.objects.bulk_create(batch)
+                batch = []
+        Order.objects.bulk_create(batch)
+        self.stdout.write("Inserted %d orders in %.1fs" % (options['orders'], time.perf_counter() - started))
+
+    def timed(self, repeat, fn):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def measure(self, options):
+        paginator = OrderKeysetPagination()
+        size = paginator.page_size
+        paginator.fields = ['date', 'id']
+        ordered = Order.objects.order_by('-date', '-id')
+        self.stdout.write("%10s %14s %14s" % ('depth', 'offset ms', 'keyset ms'))
+        for depth in [int(value) for value in options['depths'].split(',')]:
+            if depth >= options['orders']:
+                continue
+            offset_ms = self.timed(options['repeat'], lambda: (ordered.count(), list(ordered[depth:depth + size])))
+            if depth:
+                boundary = ordered.values_list('date', 'id')[depth - 1]
+                keyset = ordered.filter(paginator.keyset_filter(list(boundary), True))
+            else:
+                keyset = ordered
+            keyset_ms = self.timed(options['repeat'], lambda: list(keyset[:size + 1]))
+            self.stdout.write("%10d %14.2f %14.2f" % (depth, offset_ms, keyset_ms))
@@ -0,0 +1,90 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from LittleLemonAPI.catalog_cache import bump_catalog_version
+from LittleLemonAPI.models import Category, MenuItem
+from LittleLemonAPI.search import TitleSearchFilter, title_index, tokenize
+
+WORDS = (
+    'lemon grilled chicken salad greek bruschetta pasta pizza margherita seafood risotto lamb souvlaki '
+    'falafel hummus pita baklava tiramisu gelato espresso orange mint garlic basil tomato olive feta '
+    'spinach mushroom truffle roasted spicy smoked honey citrus almond pistachio octopus calamari shrimp '
+    'burger sandwich wrap soup bread cake tart pie'
+).split()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares LIKE '%term%' with the indexed and the scanned title search on a synthetic catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--queries', default='lemon,chi,grilled chicken,pist,spicy shrimp wr,zzz')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                self.measure(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Generated rows rolled back")
+        bump_catalog_version()
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        category = Category.objects.create(title='bench', slug='bench')
+        started = time.perf_counter()
+        MenuItem.objects.bulk_create([
+            MenuItem(
+                title=' '.join(rng.sample(WORDS, rng.randint(2, 4)))[:44] + ' %d' % i,
+                price='9.99', featured=False, category=category,
+            )
+            for i in range(options['items'])
+        ], batch_size=5000)
+        # bulk_create sends no signals, so invalidate the catalog (and the index) by hand
+        version = bump_catalog_version()
+        self.stdout.write("Inserted %d menu items in %.1fs" % (options['items'], time.perf_counter() - started))
+        started = time.perf_counter()
+        # inline: a background rebuild would not see the uncommitted rows
+        title_index(MenuItem).rebuild(version)
+        self.stdout.write("Built the in-process title index in %.2fs" % (time.perf_counter() - started))
+
+    def timed(self, repeat, fn):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, result
+
+    def measure(self, options):
+        backend = TitleSearchFilter()
+        queryset = MenuItem.objects.select_related('category')
+        self.stdout.write("%-22s %10s %8s %10s %8s %10s" % ('query', 'like ms', 'rows', 'index ms', 'rows', 'scan ms'))
+        for query in options['queries'].split(','):
+            like = queryset
+            for term in query.split():
+                like = like.filter(title__icontains=term)
+            like_ms, like_rows = self.timed(options['repeat'], lambda: (like.count(), list(like[:5]))[0])
+
+            def indexed():
+                ranked = backend.search(queryset, tokenize(query))
+                return ranked.count(), list(ranked[:5])
+
+            def scanned():
+                ranked = backend.scanned(queryset, tokenize(query), True)
+                return ranked.count(), list(ranked[:5])
+
+            index_ms, (index_rows, _) = self.timed(options['repeat'], indexed)
+            scan_ms, (scan_rows, _) = self.timed(options['repeat'], scanned)
+            if scan_rows != index_rows:
+                self.stderr.write("%s: the scan matched %d rows, the index %d" % (query, scan_rows, index_rows))
+            self.stdout.write("%-22s %10.2f %8d %10.2f %8d %10.2f" % (query, like_ms, like_rows, index_ms, index_rows, scan_ms))
@@ -0,0 +1,86 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from LittleLemonAPI.catalog_cache import bump_catalog_version
+from LittleLemonAPI.compiled import compiled_serializer
+from LittleLemonAPI.models import Category, MenuItem, Order, OrderItem
+from LittleLemonAPI.querysets import shape_queryset
+from LittleLemonAPI.serializers import ReadMenuItemSerializer, ReadOrderSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares DRF and compiled serializers rendering large menu item and order pages to JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                self.measure(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Generated rows rolled back")
+        bump_catalog_version()
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        Category.objects.bulk_create([Category(title='bench %d' % i, slug='bench-%d' % i) for i in range(20)])
+        categories = list(Category.objects.filter(slug__startswith='bench-'))
+        MenuItem.objects.bulk_create([
+            MenuItem(title='bench item %d' % i, price=Decimal(rng.randrange(100, 5000)) / 100, featured=rng.random() < 0.1, category=rng.choice(categories))
+            for i in range(options['rows'])
+        ], batch_size=5000)
+        menuitems = list(MenuItem.objects.filter(title__startswith='bench item ').values_list('id', 'price'))
+        customer = User.objects.create(username='bench-customer', email='bench@example.com', first_name='Bench', last_name='Customer')
+        today = datetime.date.today()
+        Order.objects.bulk_create([
+            Order(user=customer, total='0.00', status=rng.random() < 0.5, date=today - datetime.timedelta(days=rng.randrange(365)))
+            for _ in range(options['rows'])
+        ], batch_size=5000)
+        order_ids = list(Order.objects.filter(user=customer).values_list('id', flat=True))
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, menuitem_id=menuitem_id, quantity=2, unit_price=price, price=price * 2)
+            for order_id in order_ids
+            for menuitem_id, price in rng.sample(menuitems, options['items_per_order'])
+        ], batch_size=5000)
+        self.stdout.write("Inserted %d menu items and %d orders in %.1fs" % (options['rows'], options['rows'], time.perf_counter() - started))
+
+    def timed(self, repeat, fn):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, result
+
+    def measure(self, options):
+        renderer = JSONRenderer()
+        pages = [
+            ('menu items', ReadMenuItemSerializer, MenuItem.objects.filter(title__startswith='bench item ').order_by('id')),
+            ('orders', ReadOrderSerializer, Order.objects.filter(user__username='bench-customer').order_by('-date', '-id')),
+        ]
+        self.stdout.write("%-12s %8s %12s %14s %9s" % ('page', 'rows', 'drf ms', 'compiled ms', 'speedup'))
+        for name, serializer_class, queryset in pages:
+            queryset = queryset[:options['rows']]
+            compiled = compiled_serializer(serializer_class)
+            drf_ms, drf_json = self.timed(options['repeat'], lambda: renderer.render(serializer_class(shape_queryset(queryset, serializer_class), many=True).data))
+            compiled_ms, compiled_json = self.timed(options['repeat'], lambda: renderer.render(compiled.serialize(compiled.values(queryset))))
+            if drf_json != compiled_json:
+                raise CommandError("%s: compiled JSON differs from the DRF serializer's" % name)
+            self.stdout.write("%-12s %8d %12.1f %14.1f %8.1fx" % (name, options['rows'], drf_ms, compiled_ms, drf_ms / compiled_ms))
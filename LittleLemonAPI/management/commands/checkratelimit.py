@@ -0,0 +1,65 @@
+import multiprocessing
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.throttling import SimpleRateThrottle
+from LittleLemonAPI.throttling import rate_store
+
+
+class FixedKeyThrottle(SimpleRateThrottle):
+    # DRF's own throttle on the default cache, for comparison
+    def __init__(self, key, rate):
+        self.key_value = key
+        self.rate = rate
+        self.num_requests, self.duration = self.parse_rate(rate)
+
+    def get_cache_key(self, request, view):
+        return self.key_value
+
+
+def hammer(engine, key, limit, hits, start, results):
+    start.wait()
+    if engine == 'drf':
+        throttle = FixedKeyThrottle(key, '%d/hour' % limit)
+        allowed = sum(throttle.allow_request(None, None) for _ in range(hits))
+    else:
+        store = rate_store()
+        allowed = sum(store.hit(key, limit, 3600)[0] for _ in range(hits))
+    results.put(allowed)
+
+
+class Command(BaseCommand):
+    help = "Hammers one throttle key from several processes and checks that exactly `limit` hits get through"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--hits', type=int, default=200, help="Hits per process")
+        parser.add_argument('--limit', type=int, default=100)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write("%-28s %10s %10s %10s" % ('engine', 'attempts', 'allowed', 'hits/s'))
+        failed = False
+        for engine in ('drf', 'engine'):
+            key = 'checkratelimit:%s' % uuid.uuid4().hex
+            start, results = context.Event(), context.Queue()
+            workers = [
+                context.Process(target=hammer, args=(engine, key, options['limit'], options['hits'], start, results))
+                for _ in range(options['processes'])
+            ]
+            for worker in workers:
+                worker.start()
+            started = time.perf_counter()
+            start.set()
+            allowed = sum(results.get() for _ in workers)
+            elapsed = time.perf_counter() - started
+            for worker in workers:
+                worker.join()
+            attempts = options['processes'] * options['hits']
+            name = 'DRF default cache' if engine == 'drf' else 'rate_store() %s' % type(rate_store()).__name__
+            self.stdout.write("%-28s %10d %10d %10.0f" % (name, attempts, allowed, attempts / elapsed))
+            if engine == 'engine' and allowed != min(options['limit'], attempts):
+                failed = True
+        if failed:
+            raise CommandError("The configured rate store let through a number of hits other than the limit")
+        self.stdout.write("Rate store enforced the limit across %d processes" % options['processes'])
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.sales import fold_sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds the sales deltas journaled by checkouts and order deletes into the daily sales rollups, "
+        "--batch-size deltas (default: SALES_FOLD_BATCH_SIZE) per transaction; run it from cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Deltas folded per transaction")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        folded = fold_sales(options['batch_size'])
+        self.stdout.write("%d sales deltas folded in %.1fs" % (folded, time.perf_counter() - started))
@@ -0,0 +1,393 @@
+import datetime
+import http.client
+import json
+import random
+import socket
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from decimal import Decimal
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connection, connections
+from django.test.utils import override_settings
+from LittleLemonAPI.models import Category, MenuItem, Order
+from LittleLemonAPI.roles import DELIVERY_CREW, MANAGER
+from LittleLemonAPI.sales import fold_sales
+from LittleLemonAPI.search import tokenize
+from LittleLemonAPI.services import delete_order
+from LittleLemonAPI.tokens import RoleRefreshToken
+
+QUERIES_HEADER = 'X-Loadtest-Queries'
+USER_PREFIX = 'loadtest-'
+CATEGORY_SLUG = 'loadtest'
+
+
+class QuietHandler(WSGIRequestHandler):
+    def setup(self):
+        super().setup()
+        # headers and body go out in separate writes; without this, delayed ACKs
+        # add ~40ms to every keep-alive response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def counting_queries(application):
+    # reports the SQL queries each request ran in a response header
+    def wrapped(environ, start_response):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        def start(status, headers, exc_info=None):
+            return start_response(status, headers + [(QUERIES_HEADER, str(queries[0]))], exc_info)
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            return application(environ, start)
+
+    return wrapped
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def add(self, label, status, elapsed_ms, queries):
+        with self.lock:
+            self.samples[label].append((status, elapsed_ms, queries))
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[1] for sample in samples)
+            queries = [sample[2] for sample in samples if sample[2] is not None]
+            statuses = defaultdict(int)
+            for sample in samples:
+                statuses[str(sample[0])] += 1
+            endpoints[label] = {
+                'requests': len(samples),
+                'rps': len(samples) / elapsed,
+                'statuses': dict(statuses),
+                'errors': sum(1 for sample in samples if sample[0] == 0 or sample[0] >= 500),
+                'latency_ms': {
+                    'mean': sum(latencies) / len(latencies),
+                    'p50': percentile(latencies, 0.50),
+                    'p95': percentile(latencies, 0.95),
+                    'p99': percentile(latencies, 0.99),
+                    'max': latencies[-1],
+                },
+                'queries_per_request': sum(queries) / len(queries) if queries else None,
+            }
+        return endpoints
+
+
+class Client:
+    # one keep-alive HTTP connection per virtual user
+    def __init__(self, base_url, token, recorder):
+        parts = urlsplit(base_url)
+        self.host, self.port, self.prefix = parts.hostname, parts.port, parts.path.rstrip('/')
+        self.headers = {'Authorization': 'Bearer ' + token, 'Accept': 'application/json', 'Host': parts.netloc}
+        self.recorder = recorder
+        self.connection = None
+
+    def request(self, label, method, path, body=None):
+        headers = dict(self.headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, self.prefix + path, payload, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status, queries = response.status, response.getheader(QUERIES_HEADER)
+            if response.will_close:
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            status, content, queries = 0, b'', None
+        self.recorder.add(label, status, (time.perf_counter() - started) * 1000, None if queries is None else int(queries))
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def results(data):
+    if isinstance(data, dict):
+        return data.get('results') or []
+    return data if isinstance(data, list) else []
+
+
+class Customer:
+    def __init__(self, client, world, rng):
+        self.client, self.world, self.rng = client, world, rng
+
+    def iteration(self):
+        client, world, rng = self.client, self.world, self.rng
+        client.request('GET /api/menu-items', 'GET', '/api/menu-items?page=%d' % rng.randint(1, world['menu_pages']))
+        client.request('GET /api/menu-items?search', 'GET', '/api/menu-items?search=%s' % rng.choice(world['words']))
+        client.request('GET /api/menu-items/<pk>', 'GET', '/api/menu-items/%d' % rng.choice(world['menu'])[0])
+        client.request('GET /api/categories', 'GET', '/api/categories')
+        client.request('GET /api/categories/<pk>', 'GET', '/api/categories/%d' % rng.choice(world['categories']))
+        client.request('DELETE /api/cart/menu-items', 'DELETE', '/api/cart/menu-items')
+        lines = []
+        for menuitem_id, price in rng.sample(world['menu'], rng.randint(1, min(4, len(world['menu'])))):
+            quantity = rng.randint(1, 3)
+            status, data = client.request('POST /api/cart/menu-items', 'POST', '/api/cart/menu-items', {
+                'menuitem_id': menuitem_id, 'quantity': quantity, 'unit_price': str(price), 'price': str(price * quantity),
+            })
+            if status == 201:
+                lines.append((data['id'], price * quantity))
+        client.request('GET /api/cart/menu-items', 'GET', '/api/cart/menu-items')
+        if len(lines) > 1 and rng.random() < 0.3:
+            line_id, _ = lines.pop()
+            client.request('DELETE /api/cart/menu-items/<pk>', 'DELETE', '/api/cart/menu-items/%d' % line_id)
+        if lines:
+            client.request('POST /api/orders/', 'POST', '/api/orders/', {
+                'total': str(sum(price for _, price in lines)), 'date': datetime.date.today().isoformat(),
+            })
+        _, data = client.request('GET /api/orders/', 'GET', '/api/orders/')
+        if results(data):
+            client.request('GET /api/orders/<pk>', 'GET', '/api/orders/%d' % rng.choice(results(data))['id'])
+
+
+class Manager(Customer):
+    def iteration(self):
+        client, world, rng = self.client, self.world, self.rng
+        _, data = client.request('GET /api/orders/', 'GET', '/api/orders/')
+        # only orders placed by the load test's own customers get reassigned
+        orders = [order for order in results(data) if order['user']['id'] in world['users']]
+        if orders and world['crew']:
+            client.request('PATCH /api/orders/<pk>', 'PATCH', '/api/orders/%d' % rng.choice(orders)['id'], {
+                'delivery_crew_id': rng.choice(world['crew']),
+            })
+        client.request('GET /api/users/all', 'GET', '/api/users/all')
+        client.request('GET /api/groups/manager/users', 'GET', '/api/groups/manager/users')
+        client.request('GET /api/groups/delivery-crew/users', 'GET', '/api/groups/delivery-crew/users')
+        client.request('GET /api/menu-items', 'GET', '/api/menu-items?page=%d' % rng.randint(1, world['menu_pages']))
+
+
+class DeliveryCrew(Customer):
+    def iteration(self):
+        client, rng = self.client, self.rng
+        _, data = client.request('GET /api/orders/', 'GET', '/api/orders/')
+        if results(data):
+            order = rng.choice(results(data))
+            client.request('GET /api/orders/<pk>', 'GET', '/api/orders/%d' % order['id'])
+            client.request('PATCH /api/orders/<pk>', 'PATCH', '/api/orders/%d' % order['id'], {'status': True})
+
+
+ROLES = {'customer': (Customer, None), 'manager': (Manager, MANAGER), 'crew': (DeliveryCrew, DELIVERY_CREW)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives a mix of customers, managers and delivery crew against the API and reports throughput, "
+        "latency percentiles and SQL queries per request for every endpoint, saved as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Target a running server (e.g. http://127.0.0.1:8000) instead of starting one in-process")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=20, help="Seconds")
+        parser.add_argument('--mix', default='customer=8,manager=1,crew=1', help="Virtual users per role, as relative weights")
+        parser.add_argument('--menu-items', type=int, default=40, help="Menu items to create when the catalog is smaller")
+        parser.add_argument('--throttle', action='store_true', help="Keep rate limiting on for the in-process server")
+        parser.add_argument('--output', help="JSON results file (default: loadtest-<timestamp>-<commit>.json)")
+        parser.add_argument('--compare', help="A previous JSON results file to print the differences against")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated users, orders and menu items")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        roles = self.parse_mix(options['mix'], options['concurrency'])
+        world, users = self.populate(roles, options)
+        try:
+            with override_settings(RATE_LIMIT_ENABLED=options['throttle'] or bool(options['url'])):
+                report = self.run(roles, world, users, options)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+        self.write_report(report, options)
+
+    def parse_mix(self, mix, concurrency):
+        # every role with a weight gets at least one virtual user, the rest are
+        # shared out by weight (largest remainder)
+        weights = {}
+        try:
+            for part in mix.split(','):
+                role, weight = part.split('=')
+                if role not in ROLES or int(weight) < 0:
+                    raise ValueError
+                if int(weight):
+                    weights[role] = int(weight)
+        except ValueError:
+            raise CommandError("--mix takes role=weight pairs with roles from: %s" % ', '.join(ROLES))
+        if not weights or concurrency < len(weights):
+            raise CommandError("--mix needs a positive weight for at least one role and --concurrency at least one user per role")
+        spare = concurrency - len(weights)
+        shares = {role: spare * weight / sum(weights.values()) for role, weight in weights.items()}
+        counts = {role: 1 + int(share) for role, share in shares.items()}
+        for role in sorted(shares, key=lambda role: int(shares[role]) - shares[role])[:concurrency - sum(counts.values())]:
+            counts[role] += 1
+        return [role for role in ROLES if role in counts for _ in range(counts[role])]
+
+    def populate(self, roles, options):
+        groups = {group: Group.objects.get_or_create(name=group)[0] for _, group in ROLES.values() if group}
+        users = []
+        for index, role in enumerate(roles):
+            user, _ = User.objects.get_or_create(username='%s%s-%d' % (USER_PREFIX, role, index))
+            if ROLES[role][1]:
+                user.groups.add(groups[ROLES[role][1]])
+            users.append(user)
+        if MenuItem.objects.count() < options['menu_items']:
+            rng = random.Random(options['seed'])
+            category, _ = Category.objects.get_or_create(slug=CATEGORY_SLUG, defaults={'title': 'Load test'})
+            words = 'lemon grilled chicken salad greek pasta pizza seafood lamb falafel baklava gelato'.split()
+            for index in range(options['menu_items']):
+                MenuItem.objects.create(
+                    title='%s %d' % (' '.join(rng.sample(words, 2)), index), category=category,
+                    price=Decimal(rng.randrange(300, 3000)) / 100, featured=rng.random() < 0.2,
+                )
+        menu = list(MenuItem.objects.values_list('id', 'price'))
+        # orders and crew are limited to the generated users, so a run against a
+        # real database never reassigns real orders; cleanup() deletes them all
+        world = {
+            'users': {user.pk for user in users},
+            'menu': menu,
+            'menu_pages': max(1, -(-len(menu) // settings.REST_FRAMEWORK.get('PAGE_SIZE', 5))),
+            'words': sorted({token for title in MenuItem.objects.values_list('title', flat=True)[:200] for token in tokenize(title) if not token.isdigit()}) or ['a'],
+            'categories': list(Category.objects.values_list('id', flat=True)),
+            'crew': [user.pk for user, role in zip(users, roles) if role == 'crew'],
+        }
+        return world, users
+
+    def cleanup(self):
+        # the orders go through delete_order() first, so their sales come out
+        # of the rollups before the users and items they belong to
+        for order in Order.objects.filter(user__username__startswith=USER_PREFIX).order_by('id').iterator():
+            delete_order(order)
+        fold_sales()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+        MenuItem.objects.filter(category__slug=CATEGORY_SLUG).delete()
+        Category.objects.filter(slug=CATEGORY_SLUG).delete()
+
+    def run(self, roles, world, users, options):
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+            server.set_app(counting_queries(get_internal_wsgi_application()))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = 'http://127.0.0.1:%d' % server.server_port
+        # worker threads open their own connections; this one is done with the setup
+        connection.close()
+        recorder = Recorder()
+        deadline = time.monotonic() + options['duration']
+        iterations = defaultdict(int)
+        iterations_lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            client = Client(base_url, str(RoleRefreshToken.for_user(users[index]).access_token), recorder)
+            actor = ROLES[roles[index]][0](client, world, rng)
+            while time.monotonic() < deadline:
+                actor.iteration()
+                with iterations_lock:
+                    iterations[roles[index]] += 1
+            client.close()
+
+        self.stdout.write("Running %d virtual users (%s) against %s for %gs" % (
+            len(roles), ', '.join('%d %s' % (roles.count(role), role) for role in ROLES if role in roles), base_url, options['duration'],
+        ))
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(roles))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        endpoints = recorder.summary(elapsed)
+        total = sum(endpoint['requests'] for endpoint in endpoints.values())
+        return {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': self.commit(),
+            'target': options['url'] or 'in-process',
+            'database': connection.vendor,
+            'concurrency': len(roles),
+            'mix': options['mix'],
+            'duration_s': elapsed,
+            'throttled': options['throttle'] or bool(options['url']),
+            'iterations': dict(iterations),
+            'requests': total,
+            'rps': total / elapsed,
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def write_report(self, report, options):
+        self.stdout.write("%-36s %7s %8s %8s %8s %8s %7s %7s" % ('endpoint', 'reqs', 'rps', 'p50 ms', 'p95 ms', 'p99 ms', 'q/req', 'errors'))
+        for label, endpoint in report['endpoints'].items():
+            latency = endpoint['latency_ms']
+            queries = endpoint['queries_per_request']
+            self.stdout.write("%-36s %7d %8.1f %8.1f %8.1f %8.1f %7s %7d" % (
+                label, endpoint['requests'], endpoint['rps'], latency['p50'], latency['p95'], latency['p99'],
+                '-' if queries is None else '%.1f' % queries, endpoint['errors'],
+            ))
+        self.stdout.write("%d requests in %.1fs, %.1f req/s, %d errors" % (report['requests'], report['duration_s'], report['rps'], report['errors']))
+        if options['compare']:
+            self.compare(report, options['compare'])
+        output = options['output'] or 'loadtest-%s-%s.json' % (datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), report['commit'] or 'nogit')
+        with open(output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write("Results saved to %s" % output)
+
+    def compare(self, report, path):
+        with open(path) as handle:
+            previous = json.load(handle)
+        self.stdout.write("Compared with %s (commit %s):" % (path, previous.get('commit')))
+        self.stdout.write("%-36s %16s %16s %14s" % ('endpoint', 'rps', 'p95 ms', 'q/req'))
+        for label, endpoint in report['endpoints'].items():
+            before = previous.get('endpoints', {}).get(label)
+            if before is None:
+                continue
+            queries = endpoint['queries_per_request'], before['queries_per_request']
+            self.stdout.write("%-36s %7.1f -> %6.1f %7.1f -> %6.1f %14s" % (
+                label, before['rps'], endpoint['rps'], before['latency_ms']['p95'], endpoint['latency_ms']['p95'],
+                '-' if None in queries else '%.1f -> %.1f' % (queries[1], queries[0]),
+            ))
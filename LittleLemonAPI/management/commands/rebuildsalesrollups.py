@@ -0,0 +1,34 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from LittleLemonAPI.models import ArchivedOrder, Order
+from LittleLemonAPI.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily sales rollups from live and archived order items for a date range "
+        "(default: every day with orders), one transaction per --days-per-batch days"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=datetime.date.fromisoformat, default=None, help="YYYY-MM-DD")
+        parser.add_argument('--end', type=datetime.date.fromisoformat, default=None, help="YYYY-MM-DD")
+        parser.add_argument('--days-per-batch', type=int, default=31)
+
+    def handle(self, *args, **options):
+        live = Order.objects.aggregate(first=Min('date'), last=Max('date'))
+        archived = ArchivedOrder.objects.aggregate(first=Min('date'), last=Max('date'))
+        start = options['start'] or min(filter(None, (live['first'], archived['first'])), default=timezone.localdate())
+        end = options['end'] or max(filter(None, (live['last'], archived['last'])), default=timezone.localdate())
+        if start > end:
+            raise CommandError("--start is after --end")
+        started = time.perf_counter()
+
+        def progress(day, span_end, rows):
+            self.stdout.write("  %s..%s: %d rows" % (day, span_end, rows))
+
+        rows = rebuild_sales(start, end, options['days_per_batch'], progress)
+        self.stdout.write("%d rollup rows for %s..%s in %.1fs" % (rows, start, end, time.perf_counter() - started))
@@ -0,0 +1,76 @@
+import threading
+import time
+import traceback
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from LittleLemonAPI.checkout_queue import claim_jobs, requeue_stale_jobs, retry_job, run_job
+from LittleLemonAPI.metrics import registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a pool of worker threads that turn queued checkout jobs (POST /api/orders/ with "
+        "Prefer: respond-async) into orders; several processes can run side by side"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Worker threads")
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs a worker claims at a time")
+        parser.add_argument('--poll-interval', type=float, default=0.2, help="Seconds an idle worker waits before looking again")
+        parser.add_argument('--drain', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.outcomes = Counter()
+        self.lock = threading.Lock()
+        stop = threading.Event()
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.work, args=(stop,), daemon=True) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # workers finish the job they are on
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if getattr(settings, 'METRICS_DIR', None):
+            registry.flush(settings.METRICS_DIR)
+        elapsed = time.perf_counter() - started
+        processed = sum(self.outcomes.values())
+        self.stdout.write("%d jobs (%s) in %.1fs, %.0f jobs/s" % (
+            processed, ', '.join('%d %s' % (count, outcome) for outcome, count in sorted(self.outcomes.items())),
+            elapsed, processed / elapsed if elapsed else 0,
+        ))
+
+    def work(self, stop):
+        try:
+            while not stop.is_set():
+                jobs = claim_jobs(self.options['batch_size'])
+                if not jobs:
+                    if self.options['drain']:
+                        return
+                    requeue_stale_jobs()
+                    close_old_connections()
+                    stop.wait(self.options['poll_interval'])
+                    continue
+                for job in jobs:
+                    try:
+                        outcome = run_job(job)
+                    except Exception:
+                        self.stderr.write("Checkout job %d failed:\n%s" % (job.pk, traceback.format_exc()))
+                        try:
+                            outcome = retry_job(job)
+                        except Exception:
+                            # the job stays running, requeue_stale_jobs() picks it up
+                            continue
+                    if outcome is not None:
+                        with self.lock:
+                            self.outcomes[outcome] += 1
+        finally:
+            connections.close_all()
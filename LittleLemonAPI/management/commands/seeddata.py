@@ -0,0 +1,190 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from LittleLemonAPI.catalog_cache import bump_catalog_version
+from LittleLemonAPI.models import CartItem, Category, MenuItem, Order, OrderItem
+from LittleLemonAPI.roles import DELIVERY_CREW, MANAGER
+from LittleLemonAPI.sales import rebuild_sales
+
+WORDS = (
+    'lemon grilled chicken salad greek bruschetta pasta pizza margherita seafood risotto lamb souvlaki '
+    'falafel hummus pita baklava tiramisu gelato espresso orange mint garlic basil tomato olive feta '
+    'spinach mushroom truffle roasted spicy smoked honey citrus almond pistachio octopus calamari shrimp'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a consistent synthetic data set (catalog, staff, customers, carts, orders with order items) "
+        "with chunked bulk inserts, deterministic for a given --seed and starting database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--menu-items', type=int, default=500)
+        parser.add_argument('--customers', type=int, default=10000)
+        parser.add_argument('--managers', type=int, default=3)
+        parser.add_argument('--crew', type=int, default=50)
+        parser.add_argument('--carts', type=float, default=0.1, help="Share of customers with a filled cart")
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--max-items-per-order', type=int, default=5)
+        parser.add_argument('--days', type=int, default=730, help="Orders are spread over this many past days")
+        parser.add_argument('--chunk', type=int, default=20000, help="Orders generated and committed per transaction")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows per INSERT statement")
+        parser.add_argument('--prefix', default='seed', help="Prefix of generated usernames, category slugs and menu item titles")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=options['prefix'] + '-').exists():
+            raise CommandError("Users prefixed %r already exist; pass another --prefix" % options['prefix'])
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.rows = {}
+        started = time.perf_counter()
+        menu = self.seed_catalog()
+        customer_ids, crew_ids = self.seed_users()
+        self.seed_carts(customer_ids, menu)
+        self.seed_orders(customer_ids, crew_ids, menu)
+        with connection.cursor() as cursor:
+            # explicit order ids leave sequence-based backends behind
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Order]):
+                cursor.execute(sql)
+        # bulk_create sends no signals and skips the sales rollups
+        bump_catalog_version()
+        self.seed_sales()
+        elapsed = time.perf_counter() - started
+        total = sum(self.rows.values())
+        self.stdout.write("%s: %d rows in %.1fs, %.0f rows/s" % (
+            ', '.join('%d %s' % (count, table) for table, count in self.rows.items()), total, elapsed, total / elapsed,
+        ))
+
+    def insert(self, model, objs):
+        model.objects.bulk_create(objs, batch_size=self.options['batch_size'])
+        self.rows[model._meta.model_name] = self.rows.get(model._meta.model_name, 0) + len(objs)
+
+    def report(self, what, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write("%-12s %10d rows in %7.1fs  %10.0f rows/s" % (what, count, elapsed, count / elapsed if elapsed else 0))
+
+    def seed_catalog(self):
+        started = time.perf_counter()
+        prefix = self.options['prefix']
+        with transaction.atomic():
+            self.insert(Category, [
+                Category(title='%s %s' % (prefix, ' '.join(self.rng.sample(WORDS, 2))), slug='%s-%d' % (prefix, index))
+                for index in range(self.options['categories'])
+            ])
+            category_ids = list(Category.objects.filter(slug__startswith=prefix + '-').values_list('id', flat=True))
+            self.insert(MenuItem, [
+                MenuItem(
+                    title='%s %s %d' % (prefix, ' '.join(self.rng.sample(WORDS, self.rng.randint(1, 3))), index),
+                    price=Decimal(self.rng.randrange(200, 4000)).scaleb(-2),
+                    featured=self.rng.random() < 0.1, category_id=self.rng.choice(category_ids),
+                )
+                for index in range(self.options['menu_items'])
+            ])
+        menu = list(MenuItem.objects.filter(title__startswith=prefix + ' ').order_by('id').values_list('id', 'price', 'category_id'))
+        self.report('catalog', len(category_ids) + len(menu), started)
+        # (id, unit price in cents, category id)
+        return [(menuitem_id, int(price * 100), category_id) for menuitem_id, price, category_id in menu]
+
+    def seed_users(self):
+        started = time.perf_counter()
+        prefix = self.options['prefix']
+        password = make_password(None)
+        groups = {name: Group.objects.get_or_create(name=name)[0] for name in (MANAGER, DELIVERY_CREW)}
+        counts = (('customer', self.options['customers']), ('manager', self.options['managers']), ('crew', self.options['crew']))
+        with transaction.atomic():
+            self.insert(User, [
+                User(username='%s-%s-%d' % (prefix, role, index), password=password, email='%s-%s-%d@example.com' % (prefix, role, index))
+                for role, count in counts for index in range(count)
+            ])
+            ids = {
+                role: list(User.objects.filter(username__startswith='%s-%s-' % (prefix, role)).order_by('id').values_list('id', flat=True))
+                for role, _ in counts
+            }
+            # through rows directly: groups.add() would send m2m_changed per user
+            # for users that cannot hold a token yet
+            memberships = [
+                User.groups.through(user_id=user_id, group_id=groups[group].id)
+                for role, group in (('manager', MANAGER), ('crew', DELIVERY_CREW)) for user_id in ids[role]
+            ]
+            self.insert(User.groups.through, memberships)
+        self.report('users', sum(len(role_ids) for role_ids in ids.values()) + len(memberships), started)
+        return ids['customer'], ids['crew']
+
+    def seed_carts(self, customer_ids, menu):
+        started = time.perf_counter()
+        lines = []
+        for user_id in customer_ids:
+            if self.rng.random() >= self.options['carts']:
+                continue
+            for menuitem_id, cents, _ in self.rng.sample(menu, min(len(menu), self.rng.randint(1, 4))):
+                quantity = self.rng.randint(1, 3)
+                lines.append(CartItem(
+                    user_id=user_id, menuitem_id=menuitem_id, quantity=quantity,
+                    unit_price=Decimal(cents).scaleb(-2), price=Decimal(cents * quantity).scaleb(-2),
+                ))
+        with transaction.atomic():
+            self.insert(CartItem, lines)
+        self.report('cart items', len(lines), started)
+
+    def seed_sales(self):
+        if not self.options['orders']:
+            return
+        started = time.perf_counter()
+        today = timezone.localdate()
+        rows = rebuild_sales(today - datetime.timedelta(days=self.options['days'] - 1), today)
+        self.report('sales rollup', rows, started)
+
+    def seed_orders(self, customer_ids, crew_ids, menu):
+        if not customer_ids or not menu:
+            return
+        started = time.perf_counter()
+        rng, options = self.rng, self.options
+        today = timezone.localdate()
+        now = timezone.now()
+        next_id = (Order.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        last_id = next_id + options['orders']
+        max_items = min(options['max_items_per_order'], len(menu))
+        # (id, cents, category id, [price for quantity 0..4]) so the loop builds no Decimals
+        menu = [
+            (menuitem_id, cents, category_id, [Decimal(cents * quantity).scaleb(-2) for quantity in range(5)])
+            for menuitem_id, cents, category_id in menu
+        ]
+        written = 0
+        while next_id < last_id:
+            chunk_end = min(next_id + options['chunk'], last_id)
+            orders, items = [], []
+            for order_id in range(next_id, chunk_end):
+                age = rng.randrange(options['days'])
+                # delivered once they are a couple of days old, open and maybe unassigned before that
+                delivered = age > 2
+                crew_id = rng.choice(crew_ids) if crew_ids and (delivered or rng.random() < 0.5) else None
+                total = 0
+                for menuitem_id, cents, category_id, prices in rng.sample(menu, rng.randint(1, max_items)):
+                    quantity = rng.randint(1, 4)
+                    total += cents * quantity
+                    items.append(OrderItem(
+                        order_id=order_id, menuitem_id=menuitem_id, category_id=category_id, quantity=quantity, unit_price=prices[1], price=prices[quantity]))
+                orders.append(Order(
+                    id=order_id, user_id=rng.choice(customer_ids), delivery_crew_id=crew_id,
+                    total=Decimal(total).scaleb(-2), status=delivered and crew_id is not None,
+                    date=today - datetime.timedelta(days=age), updated_at=now,
+                ))
+            with transaction.atomic():
+                self.insert(Order, orders)
+                self.insert(OrderItem, items)
+            written += len(orders)
+            next_id = chunk_end
+            elapsed = time.perf_counter() - started
+            self.stdout.write("  %d/%d orders, %.0f orders/s" % (written, options['orders'], written / elapsed))
+        self.report('orders', written + self.rows.get(OrderItem._meta.model_name, 0), started)
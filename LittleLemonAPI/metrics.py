@@ -0,0 +1,424 @@
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from .catalog_cache import catalog_cache_stats
+from .db.pool import CLOSE_REASONS, merge_pool_stats, pool_stats
+
+PREFIX = 'littlelemon_'
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HISTOGRAMS = {
+    'request_duration_seconds': ("Wall time of the request through the middleware stack", SECONDS_BUCKETS),
+    'db_queries': ("SQL queries run by the request", (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)),
+    'db_duration_seconds': ("Time the request spent in SQL", SECONDS_BUCKETS),
+    'serializer_duration_seconds': ("Time the request spent producing serializer data", SECONDS_BUCKETS),
+    'permission_duration_seconds': ("Time the request spent in permission checks", SECONDS_BUCKETS),
+    'throttle_duration_seconds': ("Time the request spent in throttle checks", SECONDS_BUCKETS),
+    'response_size_bytes': ("Size of the response body", (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+}
+# observed by checkout workers (LittleLemonAPI/checkout_queue.py) per job outcome
+JOB_HISTOGRAMS = {
+    'checkout_queue_wait_seconds': ("Time checkout jobs waited in the queue for a worker", (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)),
+    'checkout_job_duration_seconds': ("Time a worker spent turning a checkout job into an order", SECONDS_BUCKETS),
+}
+
+_current = ContextVar('littlelemon_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db', 'serializer', 'permission', 'throttle', 'active', 'aliases')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.serializer = self.permission = self.throttle = 0.0
+        self.active = set()
+        # database alias -> [queries, seconds], to see what replicas serve
+        self.aliases = {}
+
+
+class Registry:
+    # Per-process histograms keyed by (metric, view, method). Bucket counts are
+    # kept per bucket and only made cumulative when rendered, so snapshots from
+    # several workers merge by plain addition.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.responses = {}
+        self.aliases = {}
+        self.jobs = {}
+        self.token = uuid.uuid4().hex
+        self.flushed = 0.0
+
+    def observe(self, view, method, status, values, aliases=None):
+        with self.lock:
+            for alias, (count, seconds) in (aliases or {}).items():
+                entry = self.aliases.setdefault((view, method, alias), [0, 0.0])
+                entry[0] += count
+                entry[1] += seconds
+            for name, value in values.items():
+                add_observation(self.histograms, (name, view, method), HISTOGRAMS[name][1], value)
+            key = (view, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_job(self, outcome, values):
+        with self.lock:
+            for name, value in values.items():
+                add_observation(self.jobs, (name, outcome), JOB_HISTOGRAMS[name][1], value)
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': [[name, view, method, counts[:], total] for (name, view, method), (counts, total) in self.histograms.items()],
+                'responses': [[view, method, status, count] for (view, method, status), count in self.responses.items()],
+                'aliases': [[view, method, alias, count, seconds] for (view, method, alias), (count, seconds) in self.aliases.items()],
+                'jobs': [[name, outcome, counts[:], total] for (name, outcome), (counts, total) in self.jobs.items()],
+                'catalog_cache': catalog_cache_stats(),
+                'db_pools': pool_stats(),
+            }
+
+    def path(self, directory):
+        return os.path.join(directory, 'metrics-%d-%s.json' % (os.getpid(), self.token))
+
+    def flush(self, directory):
+        # one file per process, replaced atomically so readers never see half of it
+        self.flushed = time.monotonic()
+        path = self.path(directory)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(path + '.tmp', path)
+
+    def maybe_flush(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory and time.monotonic() - self.flushed >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 10):
+            self.flush(directory)
+
+
+def add_observation(histograms, key, buckets, value):
+    entry = histograms.get(key)
+    if entry is None:
+        entry = histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+    entry[0][bisect.bisect_left(buckets, value)] += 1
+    entry[1] += value
+
+
+registry = Registry()
+
+
+def collect():
+    # this process's snapshot, or with METRICS_DIR every worker's latest one
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return [registry.snapshot()]
+    registry.flush(directory)
+    snapshots = []
+    # snapshots of workers that stopped (or idled) longer than the max age go
+    expires = time.time() - getattr(settings, 'METRICS_SNAPSHOT_MAX_AGE', 24 * 3600)
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            if os.path.getmtime(path) < expires:
+                os.remove(path)
+                continue
+            with open(path) as handle:
+                snapshots.append(json.load(handle))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def merge(snapshots):
+    histograms, responses, aliases, cache, pools, jobs = {}, {}, {}, {'hits': 0, 'misses': 0}, {}, {}
+    for snapshot in snapshots:
+        for name, view, method, counts, total in snapshot['histograms']:
+            entry = histograms.setdefault((name, view, method), [[0] * len(counts), 0.0])
+            entry[0] = [merged + count for merged, count in zip(entry[0], counts)]
+            entry[1] += total
+        for name, outcome, counts, total in snapshot.get('jobs', []):
+            entry = jobs.setdefault((name, outcome), [[0] * len(counts), 0.0])
+            entry[0] = [merged + count for merged, count in zip(entry[0], counts)]
+            entry[1] += total
+        for view, method, status, count in snapshot['responses']:
+            responses[(view, method, status)] = responses.get((view, method, status), 0) + count
+        for view, method, alias, count, seconds in snapshot.get('aliases', []):
+            entry = aliases.setdefault((view, method, alias), [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+        for key in cache:
+            cache[key] += snapshot.get('catalog_cache', {}).get(key, 0)
+        for alias, stats in snapshot.get('db_pools', {}).items():
+            merge_pool_stats(pools.setdefault(alias, {}), stats)
+    return histograms, responses, aliases, cache, pools, jobs
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    histograms, responses, aliases, cache, pools, jobs = merge(collect())
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += render_histogram(name, help_text, buckets, [
+            ('view="%s",method="%s"' % (label(view), label(method)), entry)
+            for (metric, view, method), entry in sorted(histograms.items()) if metric == name
+        ])
+    lines += ['# HELP %sresponses_total Responses by view, method and status' % PREFIX, '# TYPE %sresponses_total counter' % PREFIX]
+    for (view, method, status), count in sorted(responses.items()):
+        lines.append('%sresponses_total{view="%s",method="%s",status="%s"} %d' % (PREFIX, label(view), label(method), status, count))
+    for name, help_text, index, fmt in (('db_alias_queries_total', "SQL queries by database alias", 0, '%d'), ('db_alias_query_seconds_total', "Time in SQL by database alias", 1, '%r')):
+        lines += ['# HELP %s%s %s' % (PREFIX, name, help_text), '# TYPE %s%s counter' % (PREFIX, name)]
+        for (view, method, alias), entry in sorted(aliases.items()):
+            lines.append(('%s%s{view="%s",method="%s",alias="%s"} ' + fmt) % (PREFIX, name, label(view), label(method), label(alias), entry[index]))
+    for key in ('hits', 'misses'):
+        lines += [
+            '# HELP %scatalog_cache_%s_total Catalog response cache %s' % (PREFIX, key, key),
+            '# TYPE %scatalog_cache_%s_total counter' % (PREFIX, key),
+            '%scatalog_cache_%s_total %d' % (PREFIX, key, cache[key]),
+        ]
+    return '\n'.join(lines + render_pools(pools) + render_checkout_queue(jobs)) + '\n'
+
+
+def render_histogram(name, help_text, buckets, series):
+    lines = ['# HELP %s%s %s' % (PREFIX, name, help_text), '# TYPE %s%s histogram' % (PREFIX, name)]
+    for labels, (counts, total) in series:
+        cumulative = 0
+        for bound, count in zip(buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('%s%s_bucket{%s,le="%s"} %d' % (PREFIX, name, labels, bound, cumulative))
+        lines.append('%s%s_sum{%s} %r' % (PREFIX, name, labels, total))
+        lines.append('%s%s_count{%s} %d' % (PREFIX, name, labels, cumulative))
+    return lines
+
+
+def render_checkout_queue(jobs):
+    if not getattr(settings, 'CHECKOUT_QUEUE_ENABLED', False):
+        return []
+    from .checkout_queue import queue_stats
+    counts, oldest = queue_stats()
+    lines = ['# HELP %scheckout_jobs Checkout jobs waiting for or held by a worker' % PREFIX, '# TYPE %scheckout_jobs gauge' % PREFIX]
+    lines += ['%scheckout_jobs{status="%s"} %d' % (PREFIX, status, count) for status, count in counts.items()]
+    lines += [
+        '# HELP %scheckout_queue_oldest_seconds Age of the oldest queued checkout job' % PREFIX,
+        '# TYPE %scheckout_queue_oldest_seconds gauge' % PREFIX,
+        '%scheckout_queue_oldest_seconds %r' % (PREFIX, oldest),
+    ]
+    for name, (help_text, buckets) in JOB_HISTOGRAMS.items():
+        lines += render_histogram(name, help_text, buckets, [
+            ('outcome="%s"' % label(outcome), entry) for (metric, outcome), entry in sorted(jobs.items()) if metric == name
+        ])
+    return lines
+
+
+POOL_METRICS = (
+    # (name, type, help, [(labels, stats key)])
+    ('db_pool_checkouts_total', 'counter', "Connections handed out by the pool", [('', 'checkouts')]),
+    ('db_pool_waits_total', 'counter', "Checkouts that had to wait for a free connection", [('', 'waits')]),
+    ('db_pool_wait_seconds_total', 'counter', "Time checkouts spent waiting for a free connection", [('', 'wait_seconds')]),
+    ('db_pool_max_wait_seconds', 'gauge', "Longest wait for a free connection of any worker", [('', 'max_wait_seconds')]),
+    ('db_pool_timeouts_total', 'counter', "Checkouts that gave up waiting", [('', 'timeouts')]),
+    ('db_pool_connections_created_total', 'counter', "Connections opened by the pool", [('', 'created')]),
+    ('db_pool_connections_closed_total', 'counter', "Connections closed by the pool", [(',reason="%s"' % reason, 'closed_' + reason) for reason in CLOSE_REASONS]),
+    ('db_pool_connections', 'gauge', "Open pooled connections", [(',state="idle"', 'idle'), (',state="in_use"', 'in_use')]),
+    ('db_pool_max_size', 'gauge', "Pool size limit summed over workers", [('', 'max_size')]),
+)
+
+
+def render_pools(pools):
+    lines = []
+    if not pools:
+        return lines
+    for name, kind, help_text, series in POOL_METRICS:
+        lines += ['# HELP %s%s %s' % (PREFIX, name, help_text), '# TYPE %s%s %s' % (PREFIX, name, kind)]
+        for alias, stats in sorted(pools.items()):
+            for labels, key in series:
+                lines.append('%s%s{alias="%s"%s} %s' % (PREFIX, name, label(alias), labels, stats.get(key, 0)))
+    return lines
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db += elapsed
+        entry = metrics.aliases.get(context['connection'].alias)
+        if entry is None:
+            entry = metrics.aliases[context['connection'].alias] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def add_query_wrapper(connection, **kwargs):
+    # first in the list: execute_wrapper() context managers pop the last one
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def add_query_wrappers(**kwargs):
+    # connections opened before install(); request_started is sent from the
+    # thread that runs the request's sync code (the thread-sensitive one on ASGI)
+    for connection in connections.all(initialized_only=True):
+        add_query_wrapper(connection)
+
+
+def timed(section, function):
+    # nested calls (e.g. a serializer reading another's .data) count once
+    if iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            metrics = _current.get()
+            if metrics is None or section in metrics.active:
+                return await function(*args, **kwargs)
+            metrics.active.add(section)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                setattr(metrics, section, getattr(metrics, section) + time.perf_counter() - started)
+                metrics.active.discard(section)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _current.get()
+            if metrics is None or section in metrics.active:
+                return function(*args, **kwargs)
+            metrics.active.add(section)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                setattr(metrics, section, getattr(metrics, section) + time.perf_counter() - started)
+                metrics.active.discard(section)
+    wrapper.metrics_section = section
+    return wrapper
+
+
+def timing(section):
+    return lambda function: timed(section, function)
+
+
+class TimedViewMixin:
+    # permission and throttle time of the repo's views; AsyncAPIView times its
+    # own acheck_throttles
+    @timing('permission')
+    def check_permissions(self, request):
+        super().check_permissions(request)
+
+    @timing('permission')
+    def check_object_permissions(self, request, obj):
+        super().check_object_permissions(request, obj)
+
+    @timing('throttle')
+    def check_throttles(self, request):
+        super().check_throttles(request)
+
+
+class TimedSerializerMixin:
+    # serializer time of the repo's serializers, per object so that many=True
+    # lists (a plain ListSerializer around this one) are covered too
+    @timing('serializer')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    # counts queries on every connection once per process, including those
+    # async views use from worker threads
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(add_query_wrapper)
+        request_started.connect(add_query_wrappers)
+        add_query_wrappers()
+        _installed = True
+
+
+def response_size(response):
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    if getattr(response, 'streaming', False):
+        return None
+    return len(response.content)
+
+
+def observe(request, response, metrics, elapsed):
+    match = request.resolver_match
+    if match is None:
+        view = '<unmatched>'
+    else:
+        view = match.view_name if match.url_name else match.route or '<unnamed>'
+    values = {
+        'request_duration_seconds': elapsed,
+        'db_queries': metrics.queries,
+        'db_duration_seconds': metrics.db,
+        'serializer_duration_seconds': metrics.serializer,
+        'permission_duration_seconds': metrics.permission,
+        'throttle_duration_seconds': metrics.throttle,
+    }
+    size = response_size(response)
+    if size is not None:
+        values['response_size_bytes'] = size
+    registry.observe(view, request.method, response.status_code, values, metrics.aliases)
+    registry.maybe_flush()
+
+
+class MetricsMiddleware:
+    # Outermost middleware: times the request and records it per resolved URL
+    # name. The per-request numbers live in a context variable, which
+    # sync_to_async copies into its worker threads, so async views are covered.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        observe(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        observe(request, response, metrics, time.perf_counter() - started)
+        return response
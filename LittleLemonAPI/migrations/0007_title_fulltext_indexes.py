@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+from django.db import migrations
+
+FULLTEXT_INDEXES = [
+    ('LittleLemonAPI_menuitem', 'menuitem_title_fulltext'),
+    ('LittleLemonAPI_category', 'category_title_fulltext'),
+]
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    # only MySQL has FULLTEXT; other backends search through the in-process index
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name in FULLTEXT_INDEXES:
+        schema_editor.execute('ALTER TABLE %s ADD FULLTEXT INDEX %s (title)' % (
+            schema_editor.quote_name(table), schema_editor.quote_name(name),
+        ))
+
+
+def remove_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name in FULLTEXT_INDEXES:
+        schema_editor.execute('ALTER TABLE %s DROP INDEX %s' % (
+            schema_editor.quote_name(table), schema_editor.quote_name(name),
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0006_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, remove_fulltext_indexes),
+    ]
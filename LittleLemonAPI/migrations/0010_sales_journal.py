@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_line_categories(apps, schema_editor):
+    # lines sold before the category was recorded get their item's current one,
+    # the category the rollups were built with so far
+    Category = apps.get_model('LittleLemonAPI', 'Category')
+    for model_name in ('OrderItem', 'ArchivedOrderItem'):
+        model = apps.get_model('LittleLemonAPI', model_name)
+        for category_id in Category.objects.values_list('id', flat=True).iterator():
+            model.objects.filter(menuitem__category_id=category_id).update(category_id=category_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_checkoutjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('menuitem_id', models.BigIntegerField(null=True)),
+                ('category_id', models.BigIntegerField(null=True)),
+                ('quantity', models.IntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('orders', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='LittleLemonAPI.category'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='LittleLemonAPI.category'),
+        ),
+        migrations.RunPython(backfill_line_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_sales_journal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartLineIdBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
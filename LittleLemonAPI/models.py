@@ -11,6 +11,7 @@ class MenuItem(models.Model):
     price = models.DecimalField(max_digits=6, decimal_places=2)
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['title']
@@ -24,6 +25,13 @@ class CartItem(models.Model):
     
     class Meta:
         unique_together = ('user', 'menuitem')
+
+
+class CartLineIdBlock(models.Model):
+    # one row: the last CartItem id handed out to the cache cart store, which
+    # reserves ids for new cart lines in blocks (LittleLemonAPI/cart_store.py)
+    end = models.BigIntegerField(default=0)
+
         
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -31,10 +39,57 @@ class Order(models.Model):
     total = models.DecimalField(max_digits=6, decimal_places=2)
     status = models.BooleanField(db_index=True)
     date = models.DateField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # one index per (visibility filter, keyset ordering) used by OrderList
+        indexes = [
+            models.Index(fields=['date', 'id'], name='order_date_id_idx'),
+            models.Index(fields=['status', 'date', 'id'], name='order_status_date_id_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='order_user_date_id_idx'),
+            models.Index(fields=['user', 'status', 'date', 'id'], name='order_user_status_idx'),
+            models.Index(fields=['delivery_crew', 'date', 'id'], name='order_crew_date_id_idx'),
+            models.Index(fields=['delivery_crew', 'status', 'date', 'id'], name='order_crew_status_idx'),
+        ]
     
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="order_items")
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    # the item's category when the order was placed, which the sales rollups use
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, related_name='+', null=True)
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+
+    class Meta:
+        unique_together = ('order', 'menuitem')
+
+
+class ArchivedOrder(models.Model):
+    # delivered orders moved out of Order by archive_orders(); same ids and
+    # columns, so ReadOrderSerializer's shape and the keyset cursors carry over
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True)
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    status = models.BooleanField()
+    date = models.DateField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='archived_date_id_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='archived_user_date_id_idx'),
+            models.Index(fields=['delivery_crew', 'date', 'id'], name='archived_crew_date_id_idx'),
+        ]
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="order_items")
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, related_name='+', null=True)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -42,3 +97,73 @@ class OrderItem(models.Model):
     class Meta:
         unique_together = ('order', 'menuitem')
 
+
+class MenuItemDailySales(models.Model):
+    # sales rollups by Order.date, kept current by LittleLemonAPI/sales.py;
+    # orders counts the orders that contained the item
+    date = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'menuitem')
+
+
+class CategoryDailySales(models.Model):
+    # attributed to the item's category at the time of the sale
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'category')
+
+
+class SalesDelta(models.Model):
+    # Changes to the rollups above, journaled by the transactions that place or
+    # delete orders and folded into them later by fold_sales(), so a checkout
+    # only inserts and never waits on the rollup rows of a busy day. A row holds
+    # either a menu item's or a category's change; plain ids, because the item
+    # or category may be gone by the time it is folded.
+    date = models.DateField()
+    menuitem_id = models.BigIntegerField(null=True)
+    category_id = models.BigIntegerField(null=True)
+    quantity = models.IntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+    orders = models.IntegerField()
+
+
+class CheckoutJob(models.Model):
+    # a queued POST /api/orders/, turned into an Order by `manage.py
+    # runcheckoutworkers`; see LittleLemonAPI/checkout_queue.py
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    total = models.DecimalField(max_digits=6, decimal_places=2)
+    date = models.DateField()
+    status = models.CharField(max_length=8, choices=STATUSES, default=QUEUED)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, related_name='+', null=True)
+    errors = models.JSONField(null=True)
+    # the worker's claim on a running job; a worker whose claim was taken over
+    # after CHECKOUT_JOB_TIMEOUT cannot complete it any more
+    claim = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='checkoutjob_status_id_idx'),
+            models.Index(fields=['user', 'status'], name='checkoutjob_user_status_idx'),
+        ]
+
+
+class RoleVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='role_version')
+    version = models.PositiveIntegerField(default=0)
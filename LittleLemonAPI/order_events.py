@@ -0,0 +1,377 @@
+import asyncio
+import io
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotAuthenticated, NotFound, Throttled
+from rest_framework.settings import api_settings
+from .authentication import RoleJWTAuthentication
+from .models import Order
+from .roles import is_delivery_crew
+
+STREAM_PATH = re.compile(r'^/api/orders/(?P<pk>[0-9]+)/events$')
+STREAM_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'),
+]
+SEQUENCE_KEY = 'littlelemon:order-events:seq'
+EVENT_KEY = 'littlelemon:order-events:%d'
+# events a lagging cache poller catches up on at once; older ones are skipped
+CATCH_UP_EVENTS = 1000
+
+
+class TooManyStreams(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many open order event streams, try again shortly"
+    default_code = 'too_many_streams'
+    wait = 5
+
+
+def order_version(order):
+    # same resolution as the order's ETag; doubles as the SSE event id
+    return int(order.updated_at.timestamp() * 1000000)
+
+
+def order_payload(order):
+    return {
+        'id': order.pk, 'user_id': order.user_id, 'status': order.status, 'delivery_crew_id': order.delivery_crew_id,
+        'total': str(order.total), 'date': str(order.date), 'version': order_version(order),
+    }
+
+
+class OrderEvent:
+    # a payload as sent to subscribers, encoded once per process
+    __slots__ = ('order_id', 'crew_id', 'version', 'frame')
+
+    def __init__(self, payload):
+        self.order_id = payload['id']
+        self.crew_id = payload['delivery_crew_id']
+        self.version = payload['version']
+        data = {key: payload[key] for key in ('id', 'status', 'delivery_crew_id', 'total', 'date')}
+        self.frame = ('id: %d\nevent: order\ndata: %s\n\n' % (self.version, json.dumps(data, separators=(',', ':')))).encode()
+
+
+class Subscriber:
+    # Holds only the newest event not yet sent: a slow client skips states in
+    # between instead of buffering them, so an idle or stalled stream costs the
+    # same few objects whatever happens to its order.
+    __slots__ = ('order_id', 'user_id', 'crew_only', 'version', 'pending', 'changed', 'closed', 'loop')
+
+    def __init__(self, order_id, user_id, crew_only, version, loop):
+        self.order_id = order_id
+        self.user_id = user_id
+        # delivery crew may only follow the orders assigned to them
+        self.crew_only = crew_only
+        self.version = version
+        self.pending = None
+        self.changed = asyncio.Event()
+        # set once the client went away
+        self.closed = False
+        self.loop = loop
+
+    def offer(self, event):
+        # called with the hub's lock held, from any thread
+        if event.version <= self.version or (self.pending is not None and event.version <= self.pending.version):
+            return
+        self.pending = event
+        try:
+            self.loop.call_soon_threadsafe(self.changed.set)
+        except RuntimeError:
+            # the stream's event loop is shutting down
+            pass
+
+
+class OrderEventHub:
+    # Per-process fan-out of order events to the open streams, keyed by order
+    # id. Events arrive through the transport, from whichever thread published
+    # or polled them; streams consume them on the event loop.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.count = 0
+        self.per_user = Counter()
+
+    def subscribe(self, order_id, user_id, crew_only, version, loop):
+        subscriber = Subscriber(order_id, user_id, crew_only, version, loop)
+        with self.lock:
+            if self.count >= getattr(settings, 'ORDER_EVENTS_MAX_STREAMS', 10000):
+                raise TooManyStreams()
+            if self.per_user[user_id] >= getattr(settings, 'ORDER_EVENTS_MAX_USER_STREAMS', 20):
+                raise Throttled(detail="Too many open order event streams")
+            self.subscribers[order_id].add(subscriber)
+            self.count += 1
+            self.per_user[user_id] += 1
+        transport().start(self)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.order_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.order_id]
+            self.count -= 1
+            self.per_user[subscriber.user_id] -= 1
+            if not self.per_user[subscriber.user_id]:
+                del self.per_user[subscriber.user_id]
+
+    def offer(self, subscriber, event):
+        with self.lock:
+            subscriber.offer(event)
+
+    def take(self, subscriber):
+        with self.lock:
+            event, subscriber.pending = subscriber.pending, None
+            if event is not None:
+                subscriber.version = event.version
+            return event
+
+    def dispatch(self, payload):
+        if payload['id'] not in self.subscribers:
+            return
+        event = OrderEvent(payload)
+        with self.lock:
+            for subscriber in self.subscribers.get(event.order_id, ()):
+                subscriber.offer(event)
+
+
+hub = OrderEventHub()
+
+
+class LocalTransport:
+    # Publishes straight to this process's hub: enough for a single ASGI
+    # process, since a write served by another process is never seen here.
+    def publish(self, payload):
+        hub.dispatch(payload)
+
+    def start(self, hub):
+        pass
+
+
+class CacheTransport:
+    # Relays events through a cache alias shared by every process and host:
+    # publishing numbers the event with an incr() and stores it under that
+    # number, and each process with open streams polls for new numbers every
+    # ORDER_EVENTS_POLL_INTERVAL seconds. Events are whole order states, so one
+    # lost to eviction is made up for by the next, or by the state a reconnecting
+    # client is sent.
+    def __init__(self, alias):
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last = None
+        # a number taken by incr() whose event was not stored yet at the last poll
+        self.stalled = None
+
+    def publish(self, payload):
+        cache = caches[self.alias]
+        cache.add(SEQUENCE_KEY, 0, None)
+        sequence = cache.incr(SEQUENCE_KEY)
+        cache.set(EVENT_KEY % sequence, payload, getattr(settings, 'ORDER_EVENTS_TTL', 60))
+
+    def start(self, hub):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=(hub,), name='order-events', daemon=True)
+                self.thread.start()
+
+    def run(self, hub):
+        interval = getattr(settings, 'ORDER_EVENTS_POLL_INTERVAL', 0.5)
+        while True:
+            try:
+                self.poll(hub)
+            except Exception:
+                # an unreachable cache: streams stay open and idle until it is back
+                self.last = None
+            time.sleep(interval)
+
+    def poll(self, hub):
+        cache = caches[self.alias]
+        current = cache.get(SEQUENCE_KEY)
+        if current is None or self.last is None or current < self.last:
+            # first poll, or the counter was evicted and starts over
+            self.last = current or 0
+            return
+        first = max(self.last + 1, current - CATCH_UP_EVENTS + 1)
+        if first > current:
+            return
+        found = cache.get_many([EVENT_KEY % sequence for sequence in range(first, current + 1)])
+        for sequence in range(first, current + 1):
+            payload = found.get(EVENT_KEY % sequence)
+            if payload is None and sequence != self.stalled:
+                self.stalled = sequence
+                return
+            self.last = sequence
+            if payload is not None:
+                hub.dispatch(payload)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def transport():
+    if getattr(settings, 'ORDER_EVENTS_TRANSPORT', 'local') == 'cache':
+        config = ('cache', getattr(settings, 'ORDER_EVENTS_CACHE', 'default'))
+    else:
+        config = ('local', None)
+    with _transports_lock:
+        if config not in _transports:
+            _transports[config] = CacheTransport(config[1]) if config[0] == 'cache' else LocalTransport()
+        return _transports[config]
+
+
+def publish_order(order):
+    # after the write commits, so a subscriber never sees a state that rolls
+    # back; a transport failure is logged rather than failing the write
+    if not getattr(settings, 'ORDER_EVENTS_ENABLED', False):
+        return
+    payload = order_payload(order)
+    transaction.on_commit(lambda: transport().publish(payload), robust=True)
+
+
+def last_event_id(request):
+    # the version the client saw last, sent back by EventSource on reconnect
+    try:
+        return int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        return 0
+
+
+class StreamView:
+    # what the throttle classes read off a view: streams count against the
+    # 'user' rate and the 'orders' scope, like GET /api/orders/<id>
+    throttle_scope = 'orders'
+
+
+def check_throttles(request):
+    # APIView.check_throttles() for the stream, which never reaches DRF
+    durations = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, StreamView):
+            durations.append(throttle.wait())
+    if durations:
+        raise Throttled(max((duration for duration in durations if duration is not None), default=None))
+
+
+def open_stream(request, order_id, loop):
+    # Authentication, the order and GET /api/orders/<id>'s access check, in one
+    # worker thread hop. The subscription comes before the order is read, so a
+    # change in between is not missed. This thread serves no request, so its
+    # connection is recycled here the way a request's would be.
+    from .views import check_order_access
+    close_old_connections()
+    try:
+        user_auth_tuple = RoleJWTAuthentication().authenticate(request)
+        if user_auth_tuple is None:
+            raise NotAuthenticated()
+        request.user, request.auth = user_auth_tuple
+        check_throttles(request)
+        subscriber = hub.subscribe(order_id, request.user.pk, is_delivery_crew(request), last_event_id(request), loop)
+        try:
+            order = Order.objects.filter(pk=order_id).first()
+            if order is None:
+                raise NotFound()
+            check_order_access(request, order)
+        except BaseException:
+            hub.unsubscribe(subscriber)
+            raise
+        hub.offer(subscriber, OrderEvent(order_payload(order)))
+        # EventSource reconnects once the stream ends, which authenticates it again
+        expires_at = time.time() + getattr(settings, 'ORDER_EVENTS_MAX_AGE', 600)
+        return subscriber, min(expires_at, request.auth.payload.get('exp', expires_at))
+    finally:
+        close_old_connections()
+
+
+async def send_error(send, exc):
+    # the response DRF's exception handler would have made
+    headers = [(b'content-type', b'application/json')]
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        headers.append((b'www-authenticate', b'Bearer realm="api"'))
+    elif exc.status_code == status.HTTP_405_METHOD_NOT_ALLOWED:
+        headers.append((b'allow', b'GET'))
+    if getattr(exc, 'wait', None) is not None:
+        headers.append((b'retry-after', b'%d' % exc.wait))
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    await send({'type': 'http.response.start', 'status': exc.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+
+async def wait_for_disconnect(receive, subscriber):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscriber.closed = True
+    subscriber.changed.set()
+
+
+async def stream(send, subscriber, expires_at):
+    # One frame per event the subscriber is offered, starting with the order's
+    # current state unless the client already has it (Last-Event-ID), and a
+    # comment line every ORDER_EVENTS_HEARTBEAT seconds so proxies keep an idle
+    # stream open. Ends at expires_at, and once the order is handed to another
+    # delivery crew member than the one following it.
+    heartbeat = getattr(settings, 'ORDER_EVENTS_HEARTBEAT', 15)
+    await send({'type': 'http.response.body', 'body': b'retry: %d\n\n' % getattr(settings, 'ORDER_EVENTS_RETRY_MS', 3000), 'more_body': True})
+    while not subscriber.closed:
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            break
+        try:
+            async with asyncio.timeout(min(heartbeat, remaining)):
+                await subscriber.changed.wait()
+        except TimeoutError:
+            await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+            continue
+        subscriber.changed.clear()
+        event = hub.take(subscriber)
+        if subscriber.closed:
+            return
+        if event is None:
+            continue
+        if subscriber.crew_only and event.crew_id != subscriber.user_id:
+            break
+        await send({'type': 'http.response.body', 'body': event.frame, 'more_body': True})
+    if not subscriber.closed:
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+class OrderEventStreams:
+    # ASGI application serving GET /api/orders/<id>/events as Server-Sent Events
+    # in front of Django's (LittleLemon/asgi.py), which gets every other request.
+    # Django's handler would keep the request, a thread and its database
+    # connection for the whole life of a streamed response; here an idle stream
+    # is one coroutine, its Subscriber and a task waiting for the client to leave.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = STREAM_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None or not getattr(settings, 'ORDER_EVENTS_ENABLED', False):
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await send_error(send, MethodNotAllowed(scope['method']))
+        try:
+            subscriber, expires_at = await sync_to_async(open_stream, thread_sensitive=False)(
+                ASGIRequest(scope, io.BytesIO()), int(match['pk']), asyncio.get_running_loop(),
+            )
+        except APIException as exc:
+            return await send_error(send, exc)
+        listener = asyncio.ensure_future(wait_for_disconnect(receive, subscriber))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': STREAM_HEADERS})
+            await stream(send, subscriber, expires_at)
+        finally:
+            listener.cancel()
+            hub.unsubscribe(subscriber)
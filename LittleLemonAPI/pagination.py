@@ -0,0 +1,157 @@
+import base64
+import json
+from django.core.paginator import InvalidPage, Page
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Pages by comparing against the last row seen on a composite, unique sort key
+    # instead of COUNT(*) + OFFSET, so every page is one index range scan no
+    # matter how deep it is. Every key must end in the primary key and use a
+    # single direction.
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size = api_settings.PAGE_SIZE
+    orderings = {}
+    default_ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request)
+        return self.set_page([obj async for obj in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        ordering = self.orderings.get(request.query_params.get(self.ordering_query_param), self.default_ordering)
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        self.descending = descending = ordering[0].startswith('-') != self.reverse
+        queryset = queryset.order_by(*[('-' if descending else '') + field for field in self.fields])
+        if self.position is not None:
+            queryset = queryset.filter(self.keyset_filter(self.position, descending))
+        return queryset[:self.page_size + 1]
+
+    def paginate_querysets(self, querysets, request):
+        # one page over querysets of models with the same key columns and
+        # disjoint primary keys (live and archived orders): each contributes
+        # its own next page_size + 1 rows, the merged first ones make the page
+        rows = []
+        for queryset in querysets:
+            rows.extend(self.page_queryset(queryset, request))
+        rows.sort(key=self.position_of, reverse=self.descending)
+        return self.set_page(rows[:self.page_size + 1])
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = rows
+        return rows
+
+    def keyset_filter(self, position, descending):
+        lookup = 'lt' if descending else 'gt'
+        after = Q()
+        for index, field in enumerate(self.fields):
+            clause = Q(**{'%s__%s' % (field, lookup): position[index]})
+            for previous, value in zip(self.fields[:index], position[:index]):
+                clause &= Q(**{previous: value})
+            after |= clause
+        # the redundant bound on the leading column gives the planner a range to scan
+        return Q(**{'%s__%se' % (self.fields[0], lookup): position[0]}) & after
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            position = [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, cursor['p'])]
+            if len(position) != len(self.fields):
+                raise ValueError
+            return position, bool(cursor.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def position_of(self, obj):
+        if isinstance(obj, dict):
+            # .values() rows from a compiled serializer
+            return [obj[field] for field in self.fields]
+        return [getattr(obj, obj._meta.get_field(field).attname) for field in self.fields]
+
+    def encode_cursor(self, obj, reverse):
+        position = self.position_of(obj)
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return replace_query_param(self.base_url, self.cursor_query_param, base64.urlsafe_b64encode(cursor.encode()).decode())
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class OrderKeysetPagination(KeysetPagination):
+    orderings = {
+        'date': ('date', 'id'),
+        '-date': ('-date', '-id'),
+        'status': ('status', 'date', 'id'),
+        '-status': ('-status', '-date', '-id'),
+    }
+    default_ordering = ('-date', '-id')
+
+
+class UserKeysetPagination(KeysetPagination):
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+    }
+    default_ordering = ('id',)
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    # same page/links/response as PageNumberPagination, with the count and the
+    # page rows fetched through the async ORM
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * page_size
+        rows = [obj async for obj in queryset[bottom:bottom + page_size].aiterator(chunk_size=page_size)]
+        self.page = Page(rows, number, paginator)
+        return rows
@@ -0,0 +1,60 @@
+from functools import lru_cache
+from django.db.models import Prefetch, aprefetch_related_objects, prefetch_related_objects
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+@lru_cache(maxsize=None)
+def related_lookups(serializer_class):
+    # walks the serializer tree once per class and returns the relations it reads:
+    # single nested serializers become select_related paths, many=True nested
+    # serializers become prefetches with their own (recursively shaped) lookups
+    select, prefetch = [], []
+    for field in serializer_class().fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = field.source.replace('.', '__')
+        if isinstance(field, ListSerializer) and isinstance(field.child, BaseSerializer):
+            child_class = type(field.child)
+            prefetch.append((path, child_class.Meta.model, child_class))
+        elif isinstance(field, BaseSerializer):
+            child_select, child_prefetch = related_lookups(type(field))
+            select.append(path)
+            select.extend(path + '__' + lookup for lookup in child_select)
+            prefetch.extend((path + '__' + lookup, model, child_class) for lookup, model, child_class in child_prefetch)
+    return tuple(select), tuple(prefetch)
+
+
+def prefetches(serializer_class):
+    _, prefetch = related_lookups(serializer_class)
+    return [
+        Prefetch(lookup, queryset=shape_queryset(model._default_manager.all(), child_class))
+        for lookup, model, child_class in prefetch
+    ]
+
+
+def shape_queryset(queryset, serializer_class, prefetch=True):
+    select, _ = related_lookups(serializer_class)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        lookups = prefetches(serializer_class)
+        if lookups:
+            queryset = queryset.prefetch_related(*lookups)
+    return queryset
+
+
+def prefetch_for(instances, serializer_class):
+    prefetch_related_objects(instances, *prefetches(serializer_class))
+
+
+async def aprefetch_for(instances, serializer_class):
+    await aprefetch_related_objects(instances, *prefetches(serializer_class))
+
+
+class ShapedQuerysetMixin:
+    # views that set defer_prefetch run the prefetches themselves via
+    # prefetch_for(), e.g. only once a conditional GET has missed
+    defer_prefetch = False
+
+    def get_queryset(self):
+        return shape_queryset(super().get_queryset(), self.get_serializer_class(), prefetch=not self.defer_prefetch)
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from .models import RoleVersion
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery crew'
+
+STAFF_ROLES = frozenset([MANAGER, DELIVERY_CREW])
+
+# (role version, is_active) per user, see get_role_state()
+ROLE_VERSION_CACHE_KEY = 'littlelemon:role-state:%s'
+
+
+def get_roles(request):
+    # group names are loaded once and memoized on the request, keyed by the user
+    # so a later re-authentication on the same request does not reuse stale roles
+    user = request.user
+    cached = getattr(request, '_littlelemon_roles', None)
+    if cached is not None and cached[0] == user.pk:
+        return cached[1]
+    token_roles = getattr(user, 'token_roles', None)
+    if token_roles is not None:
+        roles = token_roles
+    elif user.is_authenticated:
+        roles = load_roles(user.pk)
+    else:
+        roles = frozenset()
+    request._littlelemon_roles = (user.pk, roles)
+    return roles
+
+
+async def aget_roles(request):
+    # resolves and memoizes the roles without blocking the event loop, after which
+    # the sync helpers (and so the permission classes) only read the memo
+    user = request.user
+    cached = getattr(request, '_littlelemon_roles', None)
+    if cached is not None and cached[0] == user.pk:
+        return cached[1]
+    token_roles = getattr(user, 'token_roles', None)
+    if token_roles is not None:
+        roles = token_roles
+    elif user.is_authenticated:
+        roles = frozenset([name async for name in Group.objects.filter(user__id=user.pk).values_list('name', flat=True)])
+    else:
+        roles = frozenset()
+    request._littlelemon_roles = (user.pk, roles)
+    return roles
+
+
+def load_roles(user_id):
+    return frozenset(Group.objects.filter(user__id=user_id).values_list('name', flat=True))
+
+
+def is_manager(request):
+    return MANAGER in get_roles(request)
+
+
+def is_delivery_crew(request):
+    return DELIVERY_CREW in get_roles(request)
+
+
+def is_customer(request):
+    return not (get_roles(request) & STAFF_ROLES)
+
+
+def load_role_state(user_id):
+    # (role version, is_active); a deleted user is an inactive one
+    row = User.objects.filter(pk=user_id).values_list('role_version__version', 'is_active').first()
+    return (0, False) if row is None else (row[0] or 0, row[1])
+
+
+def get_role_state(user_id):
+    key = ROLE_VERSION_CACHE_KEY % user_id
+    state = cache.get(key)
+    if state is None:
+        state = load_role_state(user_id)
+        cache.set(key, state, getattr(settings, 'ROLE_VERSION_CACHE_TIMEOUT', 60))
+    return state
+
+
+async def aget_role_state(user_id):
+    key = ROLE_VERSION_CACHE_KEY % user_id
+    state = await cache.aget(key)
+    if state is None:
+        row = await User.objects.filter(pk=user_id).values_list('role_version__version', 'is_active').afirst()
+        state = (0, False) if row is None else (row[0] or 0, row[1])
+        await cache.aset(key, state, getattr(settings, 'ROLE_VERSION_CACHE_TIMEOUT', 60))
+    return state
+
+
+def get_role_version(user_id):
+    return get_role_state(user_id)[0]
+
+
+def forget_role_state(user_ids):
+    cache.delete_many([ROLE_VERSION_CACHE_KEY % user_id for user_id in user_ids])
+
+
+def bump_role_version(user_ids):
+    for user_id in user_ids:
+        _, created = RoleVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+        if not created:
+            RoleVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+    # once the new versions are visible: forgetting earlier would let a request
+    # cache the old version again before the bump commits
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: forget_role_state(user_ids))
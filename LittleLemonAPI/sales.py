@@ -0,0 +1,244 @@
+import datetime
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from .models import ArchivedOrderItem, Category, CategoryDailySales, MenuItem, MenuItemDailySales, OrderItem, SalesDelta
+
+# rows per bulk write when rebuilding
+REBUILD_BATCH_SIZE = 2000
+# an order line as the rollups see it
+SOLD_LINE_FIELDS = ('menuitem_id', 'category_id', 'quantity', 'price')
+
+deletes = threading.local()
+
+
+def record_sales(date, lines, sign=1):
+    # Journals one order's lines, given as SOLD_LINE_FIELDS, as added to
+    # (sign=1) or taken back from (sign=-1) the rollups of its date: one insert
+    # in the transaction that writes the order, and no rollup row locked until
+    # fold_sales() picks the deltas up.
+    if not lines:
+        return
+    menuitems, categories = {}, {}
+    for menuitem_id, category_id, quantity, price in lines:
+        add_line(menuitems, menuitem_id, quantity, price)
+        if category_id is not None:
+            add_line(categories, category_id, quantity, price)
+    SalesDelta.objects.bulk_create([
+        SalesDelta(date=date, menuitem_id=menuitem_id, quantity=sign * quantity, revenue=sign * revenue, orders=sign)
+        for menuitem_id, (quantity, revenue) in menuitems.items()
+    ] + [
+        SalesDelta(date=date, category_id=category_id, quantity=sign * quantity, revenue=sign * revenue, orders=sign)
+        for category_id, (quantity, revenue) in categories.items()
+    ])
+
+
+def add_line(totals, key, quantity, price):
+    total_quantity, revenue = totals.get(key, (0, Decimal('0.00')))
+    totals[key] = (total_quantity + quantity, revenue + price)
+
+
+@contextmanager
+def untracked_deletes():
+    # order lines deleted in this block leave the rollups alone: archiving moves
+    # sales without undoing them, and the order services journal whole orders
+    previous = getattr(deletes, 'untracked', False)
+    deletes.untracked = True
+    try:
+        yield
+    finally:
+        deletes.untracked = previous
+
+
+def line_deleting(instance):
+    # pre_delete of an OrderItem or ArchivedOrderItem deleted some other way
+    # (admin, a User or MenuItem cascade, a queryset delete): notes the order's
+    # date and its other lines in the same category while they still exist
+    if getattr(deletes, 'untracked', False):
+        return
+    model = type(instance)
+    siblings = []
+    if instance.category_id is not None:
+        siblings = list(model.objects.filter(order_id=instance.order_id, category_id=instance.category_id).exclude(pk=instance.pk).values_list('pk', flat=True))
+    instance._sold = (instance.order.date, siblings)
+    pending_deletes().add((model, instance.pk))
+
+
+def line_deleted(instance):
+    # post_delete, once every row of the delete is gone: journals the line as
+    # taken back. The category loses the order with its last line in it, which
+    # is whichever of them gets here last.
+    sold = instance.__dict__.pop('_sold', None)
+    if sold is None:
+        return
+    date, siblings = sold
+    model = type(instance)
+    pending = pending_deletes()
+    pending.discard((model, instance.pk))
+    kept = any((model, pk) in pending for pk in siblings) or (siblings and model.objects.filter(pk__in=siblings).exists())
+    deltas = [SalesDelta(date=date, menuitem_id=instance.menuitem_id, quantity=-instance.quantity, revenue=-instance.price, orders=-1)]
+    if instance.category_id is not None:
+        deltas.append(SalesDelta(
+            date=date, category_id=instance.category_id, quantity=-instance.quantity, revenue=-instance.price, orders=0 if kept else -1,
+        ))
+    SalesDelta.objects.bulk_create(deltas)
+
+
+def pending_deletes():
+    if not hasattr(deletes, 'pending'):
+        deletes.pending = set()
+    return deletes.pending
+
+
+def fold_sales(batch_size=None):
+    # Moves journaled deltas into the rollups, oldest first, up to batch_size
+    # of them per transaction; returns how many it folded. Only the deltas read
+    # are locked, by primary key, so checkouts journaling new ones never wait,
+    # and a concurrent fold waits for them and then finds them gone.
+    if batch_size is None:
+        batch_size = getattr(settings, 'SALES_FOLD_BATCH_SIZE', 5000)
+    folded = 0
+    while True:
+        ids = list(SalesDelta.objects.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return folded
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    deltas = list(SalesDelta.objects.select_for_update().filter(pk__in=ids).order_by('id'))
+                    menuitems, categories = {}, {}
+                    for delta in deltas:
+                        if delta.menuitem_id is not None:
+                            entry = menuitems.setdefault((delta.date, delta.menuitem_id), [0, Decimal('0.00'), 0])
+                        else:
+                            entry = categories.setdefault((delta.date, delta.category_id), [0, Decimal('0.00'), 0])
+                        entry[0] += delta.quantity
+                        entry[1] += delta.revenue
+                        entry[2] += delta.orders
+                    add_to_rollup(MenuItemDailySales, 'menuitem_id', MenuItem, menuitems)
+                    add_to_rollup(CategoryDailySales, 'category_id', Category, categories)
+                    SalesDelta.objects.filter(pk__in=[delta.pk for delta in deltas]).delete()
+                break
+            except IntegrityError:
+                # a rebuild inserted a row we were about to create
+                if attempt:
+                    raise
+        folded += len(deltas)
+
+
+def add_to_rollup(model, key, parent, totals):
+    # totals: {(date, key value): [quantity, revenue, orders]}. Rows are locked
+    # in (date, key) order, so overlapping folds cannot deadlock on them. Deltas
+    # of an item or category deleted since, and takebacks of sales that were
+    # never counted (no row), have nowhere to go and are dropped.
+    if not totals:
+        return
+    alive = set(parent.objects.filter(pk__in={value for _, value in totals}).values_list('pk', flat=True))
+    rows = {
+        (row.date, getattr(row, key)): row
+        for row in model.objects.select_for_update().filter(date__in={date for date, _ in totals}, **{key + '__in': alive}).order_by('date', key)
+    }
+    changed, created = [], []
+    for (date, value), (quantity, revenue, orders) in totals.items():
+        row = rows.get((date, value))
+        if row is not None:
+            row.quantity += quantity
+            row.revenue += revenue
+            row.orders += orders
+            changed.append(row)
+        elif value in alive and orders > 0:
+            created.append(model(date=date, quantity=quantity, revenue=revenue, orders=orders, **{key: value}))
+    model.objects.bulk_update([row for row in changed if row.orders > 0], ['quantity', 'revenue', 'orders'])
+    emptied = [row.pk for row in changed if row.orders <= 0]
+    if emptied:
+        model.objects.filter(pk__in=emptied).delete()
+    model.objects.bulk_create(created)
+
+
+def rebuild_sales(start, end, days_per_batch=31, progress=None):
+    # Recomputes the rollups of [start, end] from live and archived order items,
+    # one transaction per span of days, so an interrupted rebuild can be rerun
+    # from where it stopped; the span's journaled deltas are dropped with the
+    # rows they were meant for. Checkouts committed during a span's rebuild can
+    # be lost from it: run this for a backfill or after bulk loads, not on the
+    # busy current day.
+    rows = 0
+    day = start
+    while day <= end:
+        span_end = min(day + datetime.timedelta(days=days_per_batch - 1), end)
+        with transaction.atomic():
+            MenuItemDailySales.objects.filter(date__range=(day, span_end)).delete()
+            CategoryDailySales.objects.filter(date__range=(day, span_end)).delete()
+            SalesDelta.objects.filter(date__range=(day, span_end)).delete()
+            menuitems, categories = {}, {}
+            # an order is either live or archived, so the two sets of counts add up
+            for items in (OrderItem.objects, ArchivedOrderItem.objects):
+                sold = items.filter(order__date__range=(day, span_end))
+                add_totals(menuitems, sold.values('order__date', 'menuitem_id'))
+                add_totals(categories, sold.filter(category__isnull=False).values('order__date', 'category_id'))
+            MenuItemDailySales.objects.bulk_create([
+                MenuItemDailySales(date=date, menuitem_id=menuitem_id, quantity=quantity, revenue=revenue, orders=orders)
+                for (date, menuitem_id), (quantity, revenue, orders) in menuitems.items()
+            ], batch_size=REBUILD_BATCH_SIZE)
+            CategoryDailySales.objects.bulk_create([
+                CategoryDailySales(date=date, category_id=category_id, quantity=quantity, revenue=revenue, orders=orders)
+                for (date, category_id), (quantity, revenue, orders) in categories.items()
+            ], batch_size=REBUILD_BATCH_SIZE)
+        rows += len(menuitems) + len(categories)
+        if progress:
+            progress(day, span_end, len(menuitems) + len(categories))
+        day = span_end + datetime.timedelta(days=1)
+    return rows
+
+
+def add_totals(totals, grouped):
+    # grouped: .values(date column, key column) of order items
+    date_column, key_column = grouped.query.values_select
+    for row in grouped.annotate(sold=Sum('quantity'), revenue=Sum('price'), orders=Count('order_id', distinct=True)):
+        entry = totals.setdefault((row[date_column], row[key_column]), [0, Decimal('0.00'), 0])
+        entry[0] += row['sold']
+        entry[1] += row['revenue']
+        entry[2] += row['orders']
+
+
+GROUPINGS = {
+    # rollup table: {group_by: (grouping fields, renamed grouping columns)}
+    MenuItemDailySales: {
+        'day': (('date',), {}),
+        'menuitem': (('menuitem_id',), {'title': F('menuitem__title')}),
+        'category': ((), {'category_id': F('menuitem__category_id'), 'title': F('menuitem__category__title')}),
+    },
+    CategoryDailySales: {
+        'day': (('date',), {}),
+        'category': (('category_id',), {'title': F('category__title')}),
+    },
+}
+
+
+def sales_report(start, end, group_by='day', menuitem=None, category=None):
+    # date-range totals straight from the rollups, per day, menu item or
+    # category, once the journal is folded in; the item table answers anything
+    # that involves a menu item, and knows the items' current categories only.
+    # Daily totals over categories have no order count: an order can span them.
+    fold_sales()
+    model = MenuItemDailySales if group_by == 'menuitem' or menuitem is not None else CategoryDailySales
+    rows = model.objects.filter(date__range=(start, end))
+    if menuitem is not None:
+        rows = rows.filter(menuitem_id=menuitem)
+    if category is not None:
+        rows = rows.filter(**{'category_id' if model is CategoryDailySales else 'menuitem__category_id': category})
+    fields, renamed = GROUPINGS[model][group_by]
+    rows = rows.values(*fields, **renamed).annotate(sold=Sum('quantity'), total=Sum('revenue'), order_count=Sum('orders'))
+    rows = rows.order_by('date') if group_by == 'day' else rows.order_by('-total', *fields, *renamed)
+    with_orders = group_by != 'day' or model is MenuItemDailySales
+    report = []
+    for row in rows:
+        sold, total, order_count = row.pop('sold'), row.pop('total'), row.pop('order_count')
+        row.update(quantity=sold, revenue=total)
+        if with_orders:
+            row['orders'] = order_count
+        report.append(row)
+    return report
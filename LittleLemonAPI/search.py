@@ -0,0 +1,232 @@
+import bisect
+import operator
+import re
+import threading
+from collections import defaultdict
+from functools import reduce
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from .catalog_cache import get_catalog_version
+
+TOKEN_RE = re.compile(r'\w+')
+MYSQL_MIN_TOKEN_SIZE = 3
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class TitleIndex:
+    # In-process inverted index over a model's title: token -> primary keys, plus a
+    # sorted token list so prefixes resolve with a bisect. It is kept current
+    # incrementally by the model signals once their transaction commits, and
+    # rebuilt in a background thread whenever the catalog version moved without
+    # this process seeing the change (another worker or a bulk write); searches
+    # made meanwhile are matched by the database instead.
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.version = None
+        self.postings = {}
+        self.tokens = []
+        self.titles = {}
+        self.rebuilding = None
+
+    def ensure_current(self):
+        # True when the index matches the catalog version; otherwise a rebuild is
+        # started, and the caller does without the index until it is done
+        version = get_catalog_version()
+        if self.version == version:
+            return True
+        with self.lock:
+            if self.rebuilding is None or not self.rebuilding.is_alive():
+                self.rebuilding = threading.Thread(target=self.rebuild_in_background, args=(version,), name='title-index', daemon=True)
+                self.rebuilding.start()
+        return False
+
+    def rebuild_in_background(self, version):
+        try:
+            self.rebuild(version)
+        finally:
+            connections.close_all()
+
+    def rebuild(self, version):
+        # version has to be read before the rows, so a write committed while
+        # they are read shows up as a newer version and another rebuild
+        postings = defaultdict(set)
+        titles = {}
+        for pk, title in self.model._default_manager.values_list('pk', 'title').iterator(chunk_size=5000):
+            titles[pk] = set(tokenize(title))
+            for token in titles[pk]:
+                postings[token].add(pk)
+        with self.lock:
+            if self.version is not None and self.version > version:
+                # a rebuild that started later already got here
+                return
+            self.postings = dict(postings)
+            self.tokens = sorted(postings)
+            self.titles = titles
+            self.version = version
+
+    def update(self, pk, title, version):
+        with self.lock:
+            if not self._follows(version):
+                return
+            self._discard(pk)
+            self.titles[pk] = set(tokenize(title))
+            for token in self.titles[pk]:
+                if token not in self.postings:
+                    self.postings[token] = set()
+                    bisect.insort(self.tokens, token)
+                self.postings[token].add(pk)
+            self.version = version
+
+    def remove(self, pk, version):
+        with self.lock:
+            if not self._follows(version):
+                return
+            self._discard(pk)
+            self.version = version
+
+    def advance(self, version):
+        # a bump for another model's write: nothing to change here
+        with self.lock:
+            if self._follows(version):
+                self.version = version
+
+    def _follows(self, version):
+        # a change applies only on top of the version just before its own bump;
+        # otherwise another worker wrote in between and the index rebuilds
+        if self.version is not None and self.version != version - 1:
+            self.version = None
+        return self.version is not None
+
+    def _discard(self, pk):
+        for token in self.titles.pop(pk, ()):
+            postings = self.postings[token]
+            postings.discard(pk)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def search(self, terms, limit=None):
+        # every term has to match a title token, exactly (2 points) or as a prefix
+        # (1 point); returns [(rank, [pk, ...]), ...] best rank first, or None
+        # when more than limit titles match
+        scores = None
+        with self.lock:
+            for term in terms:
+                matches = dict.fromkeys(self.postings.get(term, ()), 2)
+                start = bisect.bisect_left(self.tokens, term)
+                for token in self.tokens[start:bisect.bisect_right(self.tokens, term + '\uffff', start)]:
+                    if token != term:
+                        for pk in self.postings[token]:
+                            matches.setdefault(pk, 1)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {pk: score + matches[pk] for pk, score in scores.items() if pk in matches}
+                if not scores:
+                    return []
+        if limit is not None and len(scores) > limit:
+            return None
+        ranks = defaultdict(list)
+        for pk, score in scores.items():
+            ranks[score].append(pk)
+        return sorted(ranks.items(), reverse=True)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def title_index(model):
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = TitleIndex(model)
+        return _indexes[model]
+
+
+def _other_indexes(model):
+    with _indexes_lock:
+        return [index for index in _indexes.values() if index.model is not model]
+
+
+def index_saved(model, pk, title, version):
+    title_index(model).update(pk, title, version)
+    for index in _other_indexes(model):
+        index.advance(version)
+
+
+def index_deleted(model, pk, version):
+    title_index(model).remove(pk, version)
+    for index in _other_indexes(model):
+        index.advance(version)
+
+
+class TitleSearchFilter(SearchFilter):
+    # ?search= over the title with ranking and token-prefix (typeahead) matching:
+    # a FULLTEXT index on MySQL, the in-process TitleIndex elsewhere, with the same
+    # matching done by the database (a regex scan) while that index is rebuilt or
+    # when more titles match than SEARCH_INDEX_MAX_IDS. Results keep any explicit
+    # ?ordering=, otherwise they are ordered by rank
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(' '.join(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+        return self.search(queryset, terms, ranked=not request.query_params.get(api_settings.ORDERING_PARAM))
+
+    def search(self, queryset, terms, ranked=True):
+        if connections[queryset.db].vendor == 'mysql':
+            return self.fulltext(queryset, terms, ranked)
+        return self.indexed(queryset, terms, ranked)
+
+    def fulltext(self, queryset, terms, ranked):
+        long_terms = [term for term in terms if len(term) >= MYSQL_MIN_TOKEN_SIZE]
+        for term in terms:
+            if len(term) < MYSQL_MIN_TOKEN_SIZE:
+                queryset = queryset.filter(Q(title__istartswith=term) | Q(title__icontains=' ' + term))
+        if not long_terms:
+            return queryset.order_by('title') if ranked else queryset
+        # tokens are \w+ runs, so they never carry boolean-mode operators
+        against = ' '.join('+%s*' % term for term in long_terms)
+        column = '%s.%s' % tuple(map(connections[queryset.db].ops.quote_name, (queryset.model._meta.db_table, 'title')))
+        queryset = queryset.annotate(
+            search_rank=RawSQL('MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % column, [against]),
+        ).filter(search_rank__gt=0)
+        return queryset.order_by('-search_rank', 'title') if ranked else queryset
+
+    def indexed(self, queryset, terms, ranked):
+        index = title_index(queryset.model)
+        if not index.ensure_current():
+            return self.scanned(queryset, terms, ranked)
+        ranks = index.search(terms, getattr(settings, 'SEARCH_INDEX_MAX_IDS', 1000))
+        if ranks is None:
+            # too many ids to send back to the database
+            return self.scanned(queryset, terms, ranked)
+        if not ranks:
+            return queryset.none()
+        queryset = queryset.filter(pk__in=[pk for _, pks in ranks for pk in pks]).annotate(
+            search_rank=Case(*[When(pk__in=pks, then=Value(rank)) for rank, pks in ranks], default=Value(0), output_field=IntegerField()),
+        )
+        return queryset.order_by('-search_rank', 'title') if ranked else queryset
+
+    def scanned(self, queryset, terms, ranked):
+        # TitleIndex.search() as SQL: a term matches where a title token starts
+        # with it, and scores 2 where the whole token is the term; tokens are \w
+        # runs, so they never carry regex operators. The LIKE ahead of each regex
+        # spares most rows the (on SQLite, Python) regex call; it is only added for
+        # ASCII terms, which LIKE matches case-insensitively on every backend
+        for term in terms:
+            if term.isascii():
+                queryset = queryset.filter(title__icontains=term)
+            queryset = queryset.filter(title__iregex=r'(^|\W)%s' % term)
+        queryset = queryset.annotate(search_rank=reduce(operator.add, [
+            Case(When(title__iregex=r'(^|\W)%s(\W|$)' % term, then=Value(2)), default=Value(1), output_field=IntegerField())
+            for term in terms
+        ]))
+        return queryset.order_by('-search_rank', 'title') if ranked else queryset
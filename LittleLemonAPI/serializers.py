@@ -1,11 +1,13 @@
+import datetime
 from rest_framework import serializers
 from .models import *
 import bleach
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from .metrics import TimedSerializerMixin
 
-class CustomUserCreateSerializer(UserCreateSerializer):
+class CustomUserCreateSerializer(TimedSerializerMixin, UserCreateSerializer):
     first_name = serializers.CharField(max_length=30, required=True)
     last_name = serializers.CharField(max_length=30, required=True)
     email = serializers.EmailField(required=True)
@@ -13,7 +15,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         model = User
         fields = ('id', 'email', 'username', 'password', 'first_name', 'last_name')
         
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     first_name = serializers.CharField(max_length=30, required=True)
     last_name = serializers.CharField(max_length=30, required=True)
     email = serializers.EmailField(required=True)
@@ -21,7 +23,7 @@ class CustomUserSerializer(UserSerializer):
         model = User
         fields = ('id', 'email', 'username', 'first_name', 'last_name')
         
-class AssignUserSerializer(serializers.ModelSerializer):
+class AssignUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_id = serializers.IntegerField(write_only=True)
     
     class Meta:
@@ -33,12 +35,12 @@ class AssignUserSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("User does not exist")
         return value
     
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class ReadMenuItemSerializer(serializers.ModelSerializer):
+class ReadMenuItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer()
     class Meta:
         model = MenuItem
@@ -46,7 +48,7 @@ class ReadMenuItemSerializer(serializers.ModelSerializer):
         depth = 1
         
     
-class WriteMenuItemSerializer(serializers.ModelSerializer):
+class WriteMenuItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category_id = serializers.IntegerField(write_only=True)
     
     class Meta:
@@ -63,20 +65,34 @@ class WriteMenuItemSerializer(serializers.ModelSerializer):
         return value
         
         
-class CategorySerializer(serializers.ModelSerializer):
+class ImportMenuItemSerializer(serializers.Serializer):
+    # one row of a bulk import; the title is sanitized and matched, and the
+    # category slug resolved, for the whole batch by services.import_menu_items()
+    title = serializers.CharField(max_length=50)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2)
+    featured = serializers.BooleanField(default=False)
+    category = serializers.SlugField()
+    
+    def validate_price(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Price cannot be negative")
+        return value
+        
+        
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
         
     
-class ReadCartItemSerializer(serializers.ModelSerializer):
+class ReadCartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     menuitem = ReadMenuItemSerializer(read_only=True)
     class Meta:
         model = CartItem
         fields = ['id', 'menuitem', 'quantity', 'unit_price', 'price']
         depth = 1
         
-class WriteCartItemSerializer(serializers.ModelSerializer):
+class WriteCartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     menuitem_id = serializers.IntegerField(write_only=True)
     user_id = serializers.IntegerField(write_only=True)
     
@@ -92,26 +108,47 @@ class WriteCartItemSerializer(serializers.ModelSerializer):
         ]
         
     def validate(self, attrs):
-        if attrs['quantity'] < 1:
-            raise serializers.ValidationError("Quantity must be at least 1")
-        if attrs['unit_price'] < 0:
-            raise serializers.ValidationError("Price cannot be negative")
-        if attrs['price'] != attrs['quantity'] * attrs['unit_price']:
-            raise serializers.ValidationError("Price does not match quantity * unit price")
+        check_line_prices(attrs)
         menuitem = get_object_or_404(MenuItem, pk=attrs['menuitem_id'])
         if menuitem.price != attrs['unit_price']:
             raise serializers.ValidationError("Unit price does not match menu item price")
         return attrs
         
         
-class ReadOrderItemSerializer(serializers.ModelSerializer):
+def check_line_prices(attrs):
+    if attrs['quantity'] < 1:
+        raise serializers.ValidationError("Quantity must be at least 1")
+    if attrs['unit_price'] < 0:
+        raise serializers.ValidationError("Price cannot be negative")
+    if attrs['price'] != attrs['quantity'] * attrs['unit_price']:
+        raise serializers.ValidationError("Price does not match quantity * unit price")
+        
+        
+class BatchCartItemSerializer(WriteCartItemSerializer):
+    # one line of a batch add; menu item prices and uniqueness are checked for the
+    # whole batch at once by services.add_cart_lines()
+    class Meta(WriteCartItemSerializer.Meta):
+        validators = []
+        
+    def validate(self, attrs):
+        check_line_prices(attrs)
+        return attrs
+        
+        
+class CacheCartItemSerializer(WriteCartItemSerializer):
+    # uniqueness is enforced by the cache cart store instead of a CartItem query
+    class Meta(WriteCartItemSerializer.Meta):
+        validators = []
+        
+        
+class ReadOrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     menuitem = ReadMenuItemSerializer()
     class Meta:
         model = OrderItem
         fields = ['id', 'menuitem', 'quantity', 'unit_price', 'price']
         depth = 1
 
-class ReadOrderSerializer(serializers.ModelSerializer):
+class ReadOrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     order_items = ReadOrderItemSerializer(many=True, read_only=True)
     delivery_crew = CustomUserSerializer(read_only=True)
     user = CustomUserSerializer(read_only=True)
@@ -119,7 +156,17 @@ class ReadOrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'total', 'status', 'date', 'delivery_crew', 'order_items', 'user']
 
-class PatchOrderSerializer(serializers.ModelSerializer):
+class ReadArchivedOrderItemSerializer(ReadOrderItemSerializer):
+    class Meta(ReadOrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+class ReadArchivedOrderSerializer(ReadOrderSerializer):
+    # same payload as a live order
+    order_items = ReadArchivedOrderItemSerializer(many=True, read_only=True)
+    class Meta(ReadOrderSerializer.Meta):
+        model = ArchivedOrder
+
+class PatchOrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     delivery_crew_id = serializers.IntegerField(write_only=True, required=False)
     status = serializers.BooleanField(write_only=True, required=False)
     class Meta:
@@ -133,7 +180,12 @@ class PatchOrderSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Delivery crew does not exist")
         return attrs
 
-class WriteOrderItemSerializer(serializers.ModelSerializer):
+class CheckoutJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = CheckoutJob
+        fields = ['id', 'status', 'order', 'total', 'date', 'errors', 'created_at', 'started_at', 'finished_at']
+
+class WriteOrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     menuitem_id = serializers.IntegerField(write_only=True)
     
     class Meta:
@@ -152,7 +204,7 @@ class WriteOrderItemSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Unit price does not match menu item price")
         return attrs
     
-class WriteOrderSerializer(serializers.ModelSerializer):    
+class WriteOrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):    
     class Meta:
         model = Order
         fields = ['id', 'total', 'date']
@@ -162,4 +214,29 @@ class WriteOrderSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Total cannot be negative")
         if attrs['date'] < timezone.now().date():
             raise serializers.ValidationError("Date cannot be in the past")
-        return attrs
\ No newline at end of file
+        return attrs
+    
+class SalesQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    group_by = serializers.ChoiceField(choices=['day', 'menuitem', 'category'], default='day')
+    menuitem = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(required=False)
+    
+    def validate(self, attrs):
+        # the last 30 days by default
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - datetime.timedelta(days=29))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("Start date is after end date")
+        return attrs
+    
+class OrderExportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.BooleanField(required=False, allow_null=True)
+    
+    def validate(self, attrs):
+        if 'start' in attrs and 'end' in attrs and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("Start date is after end date")
+        return attrs
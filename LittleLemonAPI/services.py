@@ -0,0 +1,204 @@
+from decimal import Decimal
+import bleach
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework import serializers
+from .cart_store import cache_cart, checking_out, uses_cache_cart
+from .catalog_cache import bump_catalog_version
+from .models import CartItem, Category, MenuItem, Order, OrderItem
+from .sales import SOLD_LINE_FIELDS, record_sales, untracked_deletes
+
+CART_LINE_FIELDS = ('menuitem_id', 'quantity', 'unit_price', 'price')
+MARKUP_CHARACTERS = frozenset('<>&')
+
+
+def lock_cart(user):
+    # locks the user's cart rows until the surrounding transaction ends, so two
+    # concurrent checkouts of the same cart are serialized
+    return list(CartItem.objects.select_for_update().filter(user=user).values_list(*CART_LINE_FIELDS))
+
+
+def cart_total(user):
+    return CartItem.objects.filter(user=user).aggregate(total=Sum('price'))['total'] or Decimal('0.00')
+
+
+def order_lines(order):
+    return list(OrderItem.objects.filter(order=order).values_list(*SOLD_LINE_FIELDS))
+
+
+def write_order_items(order, lines):
+    # cart lines in, sold lines out: each item keeps the category it is in now
+    categories = dict(MenuItem.objects.filter(pk__in=[line[0] for line in lines]).values_list('pk', 'category_id'))
+    items = [
+        OrderItem(order=order, menuitem_id=menuitem_id, category_id=categories.get(menuitem_id), quantity=quantity, unit_price=unit_price, price=price)
+        for menuitem_id, quantity, unit_price, price in lines
+    ]
+    OrderItem.objects.bulk_create(items)
+    return [(item.menuitem_id, item.category_id, item.quantity, item.price) for item in items]
+
+
+def add_cart_lines(user, lines):
+    # adds a batch of validated cart lines with one price query, one uniqueness
+    # query and one insert; returns (line id, None) or (None, errors) per line
+    prices = dict(MenuItem.objects.filter(pk__in={line['menuitem_id'] for line in lines}).values_list('pk', 'price'))
+    results = [None] * len(lines)
+    accepted = {}
+    for index, line in enumerate(lines):
+        if line['menuitem_id'] not in prices:
+            results[index] = (None, {'menuitem_id': ["Menu item does not exist"]})
+        elif prices[line['menuitem_id']] != line['unit_price']:
+            results[index] = (None, {'non_field_errors': ["Unit price does not match menu item price"]})
+        elif line['menuitem_id'] in accepted:
+            results[index] = (None, {'non_field_errors': ["This item appears more than once in the batch"]})
+        else:
+            accepted[line['menuitem_id']] = index
+    if uses_cache_cart():
+        line_ids = cache_cart.add_many(user, [lines[index] for index in accepted.values()])
+    else:
+        line_ids = insert_cart_lines(user, [lines[index] for index in accepted.values()])
+    for menuitem_id, index in accepted.items():
+        if menuitem_id in line_ids:
+            results[index] = (line_ids[menuitem_id], None)
+        else:
+            results[index] = (None, {'non_field_errors': ["You already have this item in your cart"]})
+    return results
+
+
+def insert_cart_lines(user, lines):
+    # returns {menuitem_id: CartItem id} for the lines that were not in the cart yet
+    if not lines:
+        return {}
+    in_cart = set(CartItem.objects.filter(user=user, menuitem_id__in=[line['menuitem_id'] for line in lines]).values_list('menuitem_id', flat=True))
+    items = [
+        CartItem(user=user, menuitem_id=line['menuitem_id'], quantity=line['quantity'], unit_price=line['unit_price'], price=line['price'])
+        for line in lines if line['menuitem_id'] not in in_cart
+    ]
+    try:
+        with transaction.atomic():
+            CartItem.objects.bulk_create(items)
+    except IntegrityError:
+        raise serializers.ValidationError("Your cart changed while adding these items, please retry")
+    if any(item.pk is None for item in items):
+        # backends that cannot return ids from a bulk insert (MySQL)
+        return dict(CartItem.objects.filter(user=user, menuitem_id__in=[item.menuitem_id for item in items]).values_list('menuitem_id', 'id'))
+    return {item.menuitem_id: item.pk for item in items}
+
+
+def checkout(user, total, date):
+    with checking_out(user), transaction.atomic():
+        lines = lock_cart(user)
+        if not lines:
+            raise serializers.ValidationError("Cart is empty")
+        current_total = cart_total(user)
+        if current_total != total:
+            raise serializers.ValidationError("Total does not match cart total")
+        order = Order.objects.create(user=user, total=current_total, status=False, date=date)
+        record_sales(date, write_order_items(order, lines))
+        CartItem.objects.filter(user=user).delete()
+    return order
+
+
+def replace_order(order, user, total, date):
+    with checking_out(user), transaction.atomic():
+        lines = lock_cart(user)
+        if not lines:
+            raise serializers.ValidationError("Cart is empty")
+        current_total = cart_total(user)
+        if current_total != total:
+            raise serializers.ValidationError("Total does not match cart total")
+        updated_at = timezone.now()
+        previous_date = Order.objects.select_for_update().values_list('date', flat=True).get(pk=order.pk)
+        record_sales(previous_date, order_lines(order), sign=-1)
+        Order.objects.filter(pk=order.pk).update(total=current_total, date=date, updated_at=updated_at)
+        with untracked_deletes():
+            OrderItem.objects.filter(order=order).delete()
+        record_sales(date, write_order_items(order, lines))
+        CartItem.objects.filter(user=user).delete()
+    order.total = current_total
+    order.date = date
+    order.updated_at = updated_at
+    return order
+
+
+def delete_order(order):
+    with transaction.atomic():
+        date = Order.objects.select_for_update().values_list('date', flat=True).get(pk=order.pk)
+        record_sales(date, order_lines(order), sign=-1)
+        with untracked_deletes():
+            order.delete()
+
+
+def sanitize_titles(titles):
+    # what bleach.clean() makes of each title: printable text without markup
+    # characters comes back unchanged, the rest goes through one Cleaner for the
+    # batch instead of a new one per bleach.clean() call
+    cleaner = None
+    cleaned = []
+    for title in titles:
+        if title.isprintable() and not MARKUP_CHARACTERS.intersection(title):
+            cleaned.append(title)
+            continue
+        if cleaner is None:
+            cleaner = bleach.Cleaner()
+        cleaned.append(cleaner.clean(title))
+    return cleaned
+
+
+def import_menu_items(rows):
+    # Upserts validated menu items keyed by their (sanitized) title with one
+    # category query, one lookup of existing titles, one INSERT and one UPDATE;
+    # returns (menu item id, 'created' | 'updated' | 'unchanged', None) or
+    # (None, None, errors) per row. bulk writes send no signals, so the catalog
+    # version is bumped once for the whole import.
+    title_field = MenuItem._meta.get_field('title')
+    titles = sanitize_titles([row['title'] for row in rows])
+    results = [None] * len(rows)
+    categories = {}
+    for slug, category_id in Category.objects.filter(slug__in={row['category'] for row in rows}).values_list('slug', 'pk'):
+        categories.setdefault(slug, []).append(category_id)
+    accepted = {}
+    for index, (row, title) in enumerate(zip(rows, titles)):
+        if len(title) > title_field.max_length:
+            results[index] = (None, None, {'title': ["Ensure this field has no more than %d characters once sanitized." % title_field.max_length]})
+        elif len(categories.get(row['category'], ())) != 1:
+            message = "Category does not exist" if row['category'] not in categories else "Several categories have this slug"
+            results[index] = (None, None, {'category': [message]})
+        elif title in accepted:
+            results[index] = (None, None, {'title': ["This title appears more than once in the import"]})
+        else:
+            accepted[title] = index
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {}
+        for item in MenuItem.objects.select_for_update().filter(title__in=accepted).order_by('pk'):
+            existing.setdefault(item.title, []).append(item)
+        created, updated = [], []
+        for title, index in accepted.items():
+            row = rows[index]
+            values = {'price': row['price'], 'featured': row['featured'], 'category_id': categories[row['category']][0]}
+            items = existing.get(title, [])
+            if len(items) > 1:
+                results[index] = (None, None, {'title': ["Several menu items have this title"]})
+            elif not items:
+                created.append(MenuItem(title=title, updated_at=now, **values))
+            elif all(getattr(items[0], field) == value for field, value in values.items()):
+                results[index] = (items[0].pk, 'unchanged', None)
+            else:
+                for field, value in values.items():
+                    setattr(items[0], field, value)
+                items[0].updated_at = now
+                updated.append(items[0])
+        MenuItem.objects.bulk_create(created, batch_size=500)
+        MenuItem.objects.bulk_update(updated, ['price', 'featured', 'category_id', 'updated_at'], batch_size=500)
+        if created and created[0].pk is None:
+            # MySQL does not return the ids of bulk inserted rows
+            ids = dict(MenuItem.objects.filter(title__in=[item.title for item in created]).values_list('title', 'pk'))
+            for item in created:
+                item.pk = ids[item.title]
+    for action, items in (('created', created), ('updated', updated)):
+        for item in items:
+            results[accepted[item.title]] = (item.pk, action, None)
+    if created or updated:
+        bump_catalog_version(now)
+    return results
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .catalog_cache import bump_catalog_version
+from .models import ArchivedOrderItem, Category, MenuItem, OrderItem
+from .roles import bump_role_version, forget_role_state
+from .sales import line_deleted, line_deleting
+from .search import index_deleted, index_saved
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        user_ids = list(instance.user_set.values_list('id', flat=True)) if reverse else [instance.pk]
+    else:
+        user_ids = list(pk_set) if reverse else [instance.pk]
+    if user_ids:
+        bump_role_version(user_ids)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # tokens of a deactivated or deleted user stop working once the cached
+    # state is dropped; bulk updates wait for ROLE_VERSION_CACHE_TIMEOUT
+    user_id = instance.pk
+    transaction.on_commit(lambda: forget_role_state([user_id]))
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_save, sender=Category)
+def catalog_saved(sender, instance, **kwargs):
+    # bump once the write is visible, or a reader could cache the old rows under
+    # the new version before the writing transaction commits; the title index
+    # applies the change against the version it gets back
+    modified = getattr(instance, 'updated_at', None)
+    pk, title = instance.pk, instance.title
+    transaction.on_commit(lambda: index_saved(sender, pk, title, bump_catalog_version(modified)))
+
+
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_delete, sender=Category)
+def catalog_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: index_deleted(sender, pk, bump_catalog_version()))
+
+
+@receiver(pre_delete, sender=OrderItem)
+@receiver(pre_delete, sender=ArchivedOrderItem)
+def order_line_deleting(sender, instance, **kwargs):
+    # lines deleted around the order services (admin, User and MenuItem
+    # cascades) are taken back from the sales rollups as well
+    line_deleting(instance)
+
+
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_delete, sender=ArchivedOrderItem)
+def order_line_deleted(sender, instance, **kwargs):
+    line_deleted(instance)
@@ -1,3 +1,1085 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.utils import load_backend
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from djoser.serializers import UserSerializer
+from rest_framework import serializers
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import metrics
+from .archive import archive_orders
+from .cart_store import CART_LOCK_KEY, cache_cart, uses_cache_cart
+from .catalog_cache import bump_catalog_version, get_catalog_version
+from .checkout_queue import claim_jobs, enqueue_checkout, requeue_stale_jobs, retry_job
+from .compiled import compiled_serializer
+from .crew_scheduler import assign_delivery_crew, crew_loads
+from .db.pool import ConnectionPool, PoolTimeout
+from .db.replicas import health
+from .management.commands.loadtest import USER_PREFIX as LOADTEST_USER_PREFIX, Command as LoadtestCommand
+from .models import ArchivedOrder, CartItem, Category, CategoryDailySales, CheckoutJob, MenuItem, MenuItemDailySales, Order, OrderItem, SalesDelta
+from .order_events import hub, open_stream
+from .roles import DELIVERY_CREW, MANAGER, ROLE_VERSION_CACHE_KEY
+from .sales import fold_sales, rebuild_sales, sales_report
+from .search import TitleSearchFilter, title_index
+from .serializers import CategorySerializer, CustomUserSerializer, ReadArchivedOrderSerializer, ReadMenuItemSerializer, ReadOrderSerializer
+from .services import checkout, delete_order
+from .throttling import SQLiteRateStore, rate_store
+from .tokens import RoleRefreshToken
 
-# Create your tests here.
+# Run with `python manage.py test --settings=LittleLemon.test_settings`.
+
+
+def fill_cart(user, lines):
+    category, _ = Category.objects.get_or_create(title='Mains', slug='mains')
+    for i in range(lines):
+        menuitem = MenuItem.objects.create(title='%s item %d' % (user.username, i), price='2.50', featured=False, category=category)
+        CartItem.objects.create(user=user, menuitem=menuitem, quantity=2, unit_price='2.50', price='5.00')
+    return Decimal('5.00') * lines
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.today = datetime.date.today()
+
+    def test_places_order_and_clears_cart(self):
+        total = fill_cart(self.user, 3)
+        order = checkout(self.user, total, self.today)
+        self.assertEqual(order.total, total)
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_statement_count_does_not_grow_with_cart(self):
+        counts = []
+        for lines in (1, 20):
+            user = User.objects.create_user('customer%d' % lines)
+            total = fill_cart(user, lines)
+            with CaptureQueriesContext(connection) as queries:
+                checkout(user, total, self.today)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_total_mismatch_leaves_cart_alone(self):
+        total = fill_cart(self.user, 2)
+        with self.assertRaises(serializers.ValidationError):
+            checkout(self.user, total + 1, self.today)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_empty_cart_is_rejected(self):
+        with self.assertRaises(serializers.ValidationError):
+            checkout(self.user, Decimal('0.00'), self.today)
+        self.assertFalse(Order.objects.exists())
+
+    def test_failure_rolls_back_order_and_cart(self):
+        total = fill_cart(self.user, 2)
+        with mock.patch('LittleLemonAPI.services.write_order_items', side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                checkout(self.user, total, self.today)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_cart_is_converted_once(self):
+        user = User.objects.create_user('customer')
+        total = fill_cart(user, 10)
+        outcomes = []
+        lock = threading.Lock()
+
+        def place():
+            try:
+                checkout(user, total, datetime.date.today())
+                outcome = 'placed'
+            except serializers.ValidationError:
+                outcome = 'rejected'
+            finally:
+                connections.close_all()
+            with lock:
+                outcomes.append(outcome)
+
+        threads = [threading.Thread(target=place) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(outcomes), ['placed'] + ['rejected'] * 7)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 10)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CatalogVersionTests(TestCase):
+    def test_bumped_after_commit(self):
+        category = Category.objects.create(title='Mains', slug='mains')
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.create(title='Soup', price='4.00', featured=False, category=category)
+            self.assertEqual(get_catalog_version(), version)
+        self.assertGreater(get_catalog_version(), version)
+
+
+class TitleIndexTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Mains', slug='mains')
+        self.index = title_index(MenuItem)
+        self.index.rebuild(bump_catalog_version())
+
+    def create(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return MenuItem.objects.create(title=title, price='4.00', featured=False, category=self.category)
+
+    def test_follows_committed_writes(self):
+        soup = self.create('Chicken soup')
+        self.assertEqual(self.index.version, get_catalog_version())
+        self.assertEqual(self.index.search(['chick'], 10), [(1, [soup.pk])])
+        with self.captureOnCommitCallbacks(execute=True):
+            soup.delete()
+        self.assertEqual(self.index.search(['chick'], 10), [])
+
+    def test_missed_bump_invalidates(self):
+        bump_catalog_version()
+        self.create('Chicken soup')
+        self.assertIsNone(self.index.version)
+
+
+class TitleSearchTests(TransactionTestCase):
+    # the background rebuild reads through its own connection, so no TestCase transaction
+    def setUp(self):
+        category = Category.objects.create(title='Mains', slug='mains')
+        for title in ('Chicken soup', 'Chickpea salad', 'Grilled chicken', 'Fried chicken wings', 'Chicory tart', 'Spring chick', 'Lemon cake'):
+            MenuItem.objects.create(title=title, price='4.00', featured=False, category=category)
+        self.index = title_index(MenuItem)
+        self.index.rebuild(get_catalog_version())
+        self.client = APIClient()
+
+    def titles(self, search):
+        # the count, and the first page of titles
+        response = self.client.get('/api/menu-items', {'search': search})
+        self.assertEqual(response.status_code, 200)
+        return response.data['count'], [item['title'] for item in response.data['results']]
+
+    def test_broad_searches_are_not_cut_off(self):
+        prefixed = (6, ['Chicken soup', 'Chickpea salad', 'Chicory tart', 'Fried chicken wings', 'Grilled chicken'])
+        self.assertEqual(self.titles('chic'), prefixed)
+        self.assertEqual(self.titles('chick'), (5, ['Spring chick', 'Chicken soup', 'Chickpea salad', 'Fried chicken wings', 'Grilled chicken']))
+        with override_settings(SEARCH_INDEX_MAX_IDS=2), mock.patch.object(TitleSearchFilter, 'scanned', autospec=True, side_effect=TitleSearchFilter.scanned) as scanned:
+            # more matches than ids the index may hand over: the database matches
+            # and ranks them the same way instead of dropping any
+            self.assertEqual(self.titles('chi'), prefixed)
+            self.assertEqual(self.titles('chicken'), (3, ['Chicken soup', 'Fried chicken wings', 'Grilled chicken']))
+            # 'chick ' is 'chick' under another catalog cache key
+            self.assertEqual(self.titles('chick '), (5, ['Spring chick', 'Chicken soup', 'Chickpea salad', 'Fried chicken wings', 'Grilled chicken']))
+            self.assertEqual(self.titles('chicken wing'), (1, ['Fried chicken wings']))
+        self.assertEqual(scanned.call_count, 3)
+
+    def test_stale_index_is_rebuilt_off_the_request(self):
+        bump_catalog_version()
+        rebuilt_by = []
+        rebuild = self.index.rebuild
+
+        def record(version):
+            rebuilt_by.append(threading.current_thread())
+            rebuild(version)
+
+        with mock.patch.object(self.index, 'rebuild', side_effect=record):
+            self.assertEqual(self.titles('grilled chick'), (1, ['Grilled chicken']))
+            self.index.rebuilding.join()
+        self.assertEqual(len(rebuilt_by), 1)
+        self.assertIsNot(rebuilt_by[0], threading.current_thread())
+        self.assertEqual(self.index.version, get_catalog_version())
+        self.assertEqual(self.index.search(['grilled', 'chick']), [(3, [MenuItem.objects.get(title='Grilled chicken').pk])])
+
+
+class CacheCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.menuitem = MenuItem.objects.create(title='Soup', price='4.00', featured=False, category=Category.objects.create(title='Mains', slug='mains'))
+        # the id block an earlier test reserved was rolled back with it
+        cache_cart.forget_line_ids()
+
+    @override_settings(CART_STORE='cache')
+    def test_refuses_process_local_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            uses_cache_cart()
+
+    def shared_cache(self, **settings):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        carts = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location.name}
+        overrides = override_settings(CACHES={'default': carts}, CART_STORE='cache', **settings)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.assertTrue(uses_cache_cart())
+
+    def test_evicted_cart_survives_as_of_last_flush(self):
+        self.shared_cache(CART_FLUSH_INTERVAL=0)
+        cache_cart.add(self.user, self.menuitem.pk, 1, Decimal('4.00'), Decimal('4.00'))
+        caches['default'].clear()
+        self.assertEqual([item.menuitem_id for item in cache_cart.items(self.user)], [self.menuitem.pk])
+
+    def test_line_ids_are_cart_item_ids(self):
+        self.shared_cache(CART_FLUSH_INTERVAL=None)
+        other = User.objects.create_user('other')
+        CartItem.objects.create(user=other, menuitem=self.menuitem, quantity=1, unit_price='4.00', price='4.00')
+        drink = MenuItem.objects.create(title='Tea', price='2.00', featured=False, category=self.menuitem.category)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/cart/menu-items', [
+            {'menuitem_id': self.menuitem.pk, 'quantity': 1, 'unit_price': '4.00', 'price': '4.00'},
+            {'menuitem_id': drink.pk, 'quantity': 2, 'unit_price': '2.00', 'price': '4.00'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        line_ids = [result['data']['id'] for result in response.data]
+        self.assertNotIn(CartItem.objects.get(user=other).pk, line_ids)
+        self.assertEqual([line['id'] for line in client.get('/api/cart/menu-items').data['results']], line_ids)
+        cache_cart.flush(self.user)
+        self.assertEqual(list(CartItem.objects.filter(user=self.user).order_by('id').values_list('id', flat=True)), line_ids)
+        caches['default'].clear()
+        self.assertEqual(client.delete('/api/cart/menu-items/%d' % line_ids[0]).status_code, 204)
+        self.assertEqual([item.pk for item in cache_cart.items(self.user)], line_ids[1:])
+
+    def test_flush_drops_lines_of_deleted_menu_items(self):
+        self.shared_cache(CART_FLUSH_INTERVAL=None)
+        drink = MenuItem.objects.create(title='Tea', price='2.00', featured=False, category=self.menuitem.category)
+        cache_cart.add(self.user, self.menuitem.pk, 1, Decimal('4.00'), Decimal('4.00'))
+        cache_cart.add(self.user, drink.pk, 1, Decimal('2.00'), Decimal('2.00'))
+        drink.delete()
+        cache_cart.flush(self.user)
+        self.assertEqual(list(CartItem.objects.filter(user=self.user).values_list('menuitem_id', flat=True)), [self.menuitem.pk])
+
+    def test_overrun_lock_is_left_to_its_new_holder(self):
+        self.shared_cache()
+        key = CART_LOCK_KEY % self.user.pk
+        with cache_cart.locked(self.user):
+            # lock_timeout passed and another request took the lock
+            caches['default'].set(key, 'other holder')
+        self.assertEqual(caches['default'].get(key), 'other holder')
+
+
+def hammer_rate_store(key, hits, start, results):
+    start.wait()
+    store = rate_store()
+    results.put(sum(store.hit(key, 50, 3600)[0] for _ in range(hits)))
+
+
+class SQLiteRateStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = '%s/ratelimit.sqlite3' % directory.name
+
+    def test_burst_then_one_hit_per_interval(self):
+        store = SQLiteRateStore(self.path)
+        with mock.patch('LittleLemonAPI.throttling.time') as clock:
+            clock.time.return_value = 1000.0
+            self.assertEqual([store.hit('k', 3, 60)[0] for _ in range(4)], [True, True, True, False])
+            self.assertAlmostEqual(store.hit('k', 3, 60)[1], 20.0)
+            clock.time.return_value = 1019.0
+            self.assertFalse(store.hit('k', 3, 60)[0])
+            clock.time.return_value = 1020.0
+            self.assertEqual([store.hit('k', 3, 60)[0] for _ in range(2)], [True, False])
+            self.assertTrue(store.hit('other', 3, 60)[0])
+
+    def test_limit_is_shared_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        start, results = context.Event(), context.Queue()
+        with override_settings(RATE_LIMIT_STORE='sqlite', RATE_LIMIT_PATH=self.path):
+            workers = [context.Process(target=hammer_rate_store, args=('shared', 40, start, results)) for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            start.set()
+            allowed = sum(results.get(timeout=60) for _ in workers)
+            for worker in workers:
+                worker.join()
+        self.assertEqual(allowed, 50)
+
+
+class MetricsTests(TestCase):
+    def test_only_own_serializers_are_timed(self):
+        category = Category.objects.create(title='Mains', slug='mains')
+        items = [MenuItem.objects.create(title='Item %d' % i, price='4.00', featured=False, category=category) for i in range(3)]
+        request_metrics = metrics.RequestMetrics()
+        token = metrics._current.set(request_metrics)
+        try:
+            UserSerializer(User.objects.create_user('customer')).data
+            self.assertEqual(request_metrics.serializer, 0.0)
+            ReadMenuItemSerializer(items, many=True).data
+            self.assertGreater(request_metrics.serializer, 0.0)
+        finally:
+            metrics._current.reset(token)
+
+    def test_stale_snapshots_are_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stale = os.path.join(directory, 'metrics-1-gone.json')
+            with open(stale, 'w') as handle:
+                handle.write('{}')
+            os.utime(stale, (0, 0))
+            with override_settings(METRICS_DIR=directory, METRICS_SNAPSHOT_MAX_AGE=60):
+                self.assertEqual(len(metrics.collect()), 1)
+            self.assertFalse(os.path.exists(stale))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_CHECK_INTERVAL=0)
+class ReplicaRoutingTests(TransactionTestCase):
+    # the two test databases hold different orders, so each response shows
+    # which one served it; TransactionTestCase because the router keeps reads
+    # inside an atomic block on the primary
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        health.checked.clear()
+        health.usable.clear()
+        self.user = User.objects.create_user('customer')
+        User.objects.using('replica').create(pk=self.user.pk, username='customer')
+        # flush skips the replica: it is not migrated while listed in DATABASE_REPLICAS
+        self.addCleanup(User.objects.using('replica').all().delete)
+        for alias, total in (('default', '10.00'), ('replica', '20.00')):
+            Order.objects.using(alias).create(user_id=self.user.pk, total=total, status=False, date=datetime.date.today())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order_totals(self):
+        response = self.client.get('/api/orders/')
+        self.assertEqual(response.status_code, 200)
+        return [order['total'] for order in response.data['results']]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.order_totals(), ['20.00'])
+
+    def test_write_pins_user_to_primary(self):
+        self.assertEqual(self.client.delete('/api/cart/menu-items').status_code, 204)
+        self.assertEqual(self.order_totals(), ['10.00'])
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.client.delete('/api/cart/menu-items')
+        self.assertEqual(self.order_totals(), ['20.00'])
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        with mock.patch.object(health, 'replication_lag', side_effect=DatabaseError("gone")):
+            self.assertEqual(self.order_totals(), ['10.00'])
+        self.assertEqual(self.order_totals(), ['20.00'])
+
+
+class OrderLifecycleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.manager = User.objects.create_user('manager')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_archived_orders_are_read_only(self):
+        order = checkout(self.user, fill_cart(self.user, 1), datetime.date.today() - datetime.timedelta(days=400))
+        Order.objects.filter(pk=order.pk).update(status=True)
+        self.assertEqual(archive_orders(days=90), 1)
+        self.assertEqual(self.client.get('/api/orders/%d' % order.pk).status_code, 200)
+        self.assertEqual(self.client.patch('/api/orders/%d' % order.pk, {'status': False}, format='json').status_code, 409)
+        self.assertEqual(self.client.delete('/api/orders/%d' % order.pk).status_code, 409)
+        self.assertEqual(self.client.delete('/api/orders/%d' % (order.pk + 1)).status_code, 404)
+
+    def test_deleting_an_uncounted_order_leaves_no_negative_rollups(self):
+        order = checkout(self.user, fill_cart(self.user, 2), datetime.date.today())
+        fold_sales()
+        MenuItemDailySales.objects.all().delete()
+        CategoryDailySales.objects.all().delete()
+        delete_order(order)
+        fold_sales()
+        self.assertFalse(MenuItemDailySales.objects.exists())
+        self.assertFalse(CategoryDailySales.objects.exists())
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.today = datetime.date.today()
+
+    def rollups(self):
+        fold_sales()
+        return (
+            sorted(MenuItemDailySales.objects.values_list('menuitem__title', 'quantity', 'revenue', 'orders')),
+            sorted(CategoryDailySales.objects.values_list('category__slug', 'quantity', 'revenue', 'orders')),
+        )
+
+    def test_checkout_journals_without_touching_rollups(self):
+        total = fill_cart(self.user, 3)
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.user, total, self.today)
+        self.assertFalse([query for query in queries if 'dailysales' in query['sql'].lower()])
+        items, categories = self.rollups()
+        self.assertEqual(len(items), 3)
+        self.assertEqual(categories, [('mains', 6, Decimal('15.00'), 1)])
+        self.assertFalse(SalesDelta.objects.exists())
+
+    def test_folds_orders_of_several_customers(self):
+        other = User.objects.create_user('other')
+        checkout(self.user, fill_cart(self.user, 2), self.today)
+        checkout(other, fill_cart(other, 1), self.today)
+        self.assertEqual(self.rollups()[1], [('mains', 6, Decimal('15.00'), 2)])
+        self.assertEqual(sales_report(self.today, self.today, 'category')[0]['orders'], 2)
+
+    def test_category_is_the_one_at_the_time_of_sale(self):
+        order = checkout(self.user, fill_cart(self.user, 1), self.today)
+        drinks = Category.objects.create(title='Drinks', slug='drinks')
+        MenuItem.objects.update(category=drinks)
+        rebuild_sales(self.today, self.today)
+        self.assertEqual(self.rollups()[1], [('mains', 2, Decimal('5.00'), 1)])
+        delete_order(order)
+        self.assertEqual(self.rollups(), ([], []))
+
+    def test_admin_and_cascade_deletes_are_taken_back(self):
+        first = checkout(self.user, fill_cart(self.user, 2), self.today)
+        other = User.objects.create_user('other')
+        checkout(other, fill_cart(other, 1), self.today)
+        Order.objects.filter(pk=first.pk).delete()
+        self.assertEqual(self.rollups()[1], [('mains', 2, Decimal('5.00'), 1)])
+        other.delete()
+        self.assertEqual(self.rollups(), ([], []))
+
+    def test_category_keeps_the_order_until_its_last_line_goes(self):
+        order = checkout(self.user, fill_cart(self.user, 3), self.today)
+        first, second, third = OrderItem.objects.filter(order=order).order_by('id')
+        first.menuitem.delete()
+        self.assertEqual(self.rollups()[1], [('mains', 4, Decimal('10.00'), 1)])
+        OrderItem.objects.filter(pk__in=[second.pk, third.pk]).delete()
+        self.assertEqual(self.rollups(), ([], []))
+
+    def test_loadtest_cleanup_takes_its_sales_back(self):
+        kept = checkout(self.user, fill_cart(self.user, 1), self.today)
+        visitor = User.objects.create_user(LOADTEST_USER_PREFIX + 'customer-0')
+        checkout(visitor, fill_cart(visitor, 2), self.today)
+        LoadtestCommand().cleanup()
+        self.assertEqual(self.rollups()[1], [('mains', 2, Decimal('5.00'), 1)])
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [kept.pk])
+
+    def test_archiving_keeps_sales_and_matches_a_rebuild(self):
+        order = checkout(self.user, fill_cart(self.user, 2), self.today - datetime.timedelta(days=400))
+        Order.objects.filter(pk=order.pk).update(status=True)
+        archive_orders(days=90)
+        folded = self.rollups()
+        self.assertEqual(folded[1], [('mains', 4, Decimal('10.00'), 1)])
+        rebuild_sales(order.date, order.date)
+        self.assertEqual(self.rollups(), folded)
+
+
+@override_settings(ORDER_EXPORT_CHUNK_SIZE=2)
+class OrderExportTests(TestCase):
+    def setUp(self):
+        manager = User.objects.create_user('manager')
+        manager.groups.add(Group.objects.create(name=MANAGER))
+        self.token = str(RoleRefreshToken.for_user(manager).access_token)
+        customer = User.objects.create_user('customer')
+        self.order_ids = [checkout(customer, fill_cart(customer, 1), datetime.date.today()).pk for _ in range(5)]
+
+    def exported_ids(self, content):
+        return [json.loads(line)['id'] for line in content.decode().splitlines()]
+
+    def test_wsgi_gets_a_sync_stream(self):
+        response = self.client.get('/api/orders/export?format=ndjson', headers={'Authorization': 'Bearer ' + self.token})
+        self.assertFalse(response.is_async)
+        self.assertEqual(self.exported_ids(b''.join(response.streaming_content)), self.order_ids)
+
+    async def test_asgi_gets_an_async_stream(self):
+        response = await AsyncClient().get('/api/orders/export?format=ndjson', headers={'Authorization': 'Bearer ' + self.token})
+        self.assertTrue(response.is_async)
+        self.assertEqual(self.exported_ids(b''.join([chunk async for chunk in response.streaming_content])), self.order_ids)
+
+    def test_csv_cells_cannot_start_formulas(self):
+        customer = User.objects.create_user('@admin')
+        category = Category.objects.get(slug='mains')
+        for title in ('=HYPERLINK("http://example.com")', '-1+2', 'Soup'):
+            menuitem = MenuItem.objects.create(title=title, price='2.50', featured=False, category=category)
+            CartItem.objects.create(user=customer, menuitem=menuitem, quantity=1, unit_price='2.50', price='2.50')
+        order = checkout(customer, Decimal('7.50'), datetime.date.today())
+        response = self.client.get('/api/orders/export?format=csv', headers={'Authorization': 'Bearer ' + self.token})
+        rows = [row for row in csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())) if row['order_id'] == str(order.pk)]
+        self.assertEqual({row['username'] for row in rows}, {"'@admin"})
+        self.assertEqual(sorted(row['menuitem'] for row in rows), ["'-1+2", "'=HYPERLINK(\"http://example.com\")", 'Soup'])
+        self.assertEqual({row['total'] for row in rows}, {'7.50'})
+
+
+@override_settings(CHECKOUT_JOB_MAX_ATTEMPTS=2, CHECKOUT_JOB_TIMEOUT=0)
+class CheckoutQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.job = enqueue_checkout(self.user, fill_cart(self.user, 1), datetime.date.today())
+
+    def test_crashing_job_fails_after_max_attempts(self):
+        for expected in (CheckoutJob.QUEUED, CheckoutJob.FAILED):
+            [job] = claim_jobs(10)
+            self.assertEqual(retry_job(job), expected)
+        self.assertFalse(claim_jobs(10))
+        enqueue_checkout(self.user, Decimal('5.00'), datetime.date.today())
+
+    def test_stale_job_fails_after_max_attempts(self):
+        for expected in (CheckoutJob.QUEUED, CheckoutJob.FAILED):
+            claim_jobs(10)
+            requeue_stale_jobs()
+            self.job.refresh_from_db()
+            self.assertEqual(self.job.status, expected)
+
+
+class OrderEventStreamTests(TransactionTestCase):
+    # open_stream() recycles its thread's connection, so no TestCase transaction
+    def test_opening_streams_is_throttled(self):
+        user = User.objects.create_user('customer')
+        order = Order.objects.create(user=user, total='5.00', status=False, date=datetime.date.today())
+        token = str(RoleRefreshToken.for_user(user).access_token)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/orders/%d/events' % order.pk, 'query_string': b'',
+            'headers': [(b'authorization', ('Bearer ' + token).encode())], 'client': ('127.0.0.1', 5000),
+        }
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with tempfile.TemporaryDirectory() as directory, override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_PATH='%s/ratelimit.sqlite3' % directory):
+            for _ in range(10):
+                subscriber, _ = open_stream(ASGIRequest(scope, io.BytesIO()), order.pk, loop)
+                hub.unsubscribe(subscriber)
+            with self.assertRaises(Throttled) as raised:
+                open_stream(ASGIRequest(scope, io.BytesIO()), order.pk, loop)
+        self.assertGreater(raised.exception.wait, 0)
+
+
+class IdempotencyTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('customer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.order = {'total': '10.00', 'date': str(datetime.date.today())}
+
+    def place(self, key, data=None, client=None, format='json'):
+        return (client or self.client).post('/api/orders/', data or self.order, format=format, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_gets_the_stored_response(self):
+        fill_cart(self.user, 2)
+        first = self.place('order-1')
+        retry = self.place('order-1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_refusal_is_stored_too(self):
+        self.assertEqual(self.place('order-1').status_code, 400)
+        fill_cart(self.user, 2)
+        retry = self.place('order-1')
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(Order.objects.exists())
+
+    def test_key_reused_for_another_request_is_422(self):
+        fill_cart(self.user, 2)
+        self.place('order-1')
+        self.assertEqual(self.place('order-1', {**self.order, 'total': '5.00'}).status_code, 422)
+
+    def test_multipart_body_can_be_fingerprinted(self):
+        fill_cart(self.user, 2)
+        self.assertEqual(self.place('order-1', format='multipart').status_code, 201)
+        self.assertEqual(self.place('order-1', format='multipart')['Idempotent-Replayed'], 'true')
+
+    def test_concurrent_duplicate_waits_for_the_original(self):
+        started, release = threading.Event(), threading.Event()
+        outcomes = {}
+
+        def slow_checkout(*args):
+            started.set()
+            release.wait(5)
+
+        def send(name):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                outcomes[name] = self.place('order-1', client=client)
+            finally:
+                connections.close_all()
+
+        with mock.patch('LittleLemonAPI.views.checkout', side_effect=slow_checkout) as checkout_mock:
+            original = threading.Thread(target=send, args=('original',))
+            original.start()
+            self.assertTrue(started.wait(5))
+            with override_settings(IDEMPOTENCY_WAIT=0.05):
+                self.assertEqual(self.place('order-1').status_code, 409)
+            duplicate = threading.Thread(target=send, args=('duplicate',))
+            duplicate.start()
+            # let the duplicate find the key still pending before the original ends
+            time.sleep(0.1)
+            release.set()
+            original.join()
+            duplicate.join()
+        self.assertEqual(checkout_mock.call_count, 1)
+        self.assertEqual((outcomes['original'].status_code, outcomes['duplicate'].status_code), (201, 201))
+        self.assertEqual(outcomes['duplicate']['Idempotent-Replayed'], 'true')
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'pool.sqlite3')
+
+    def pool(self, **options):
+        pool = ConnectionPool('test', lambda: sqlite3.connect(self.path, check_same_thread=False), lambda conn: conn.execute('SELECT 1'), **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_checkout_times_out_when_full(self):
+        pool = self.pool(max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.snapshot()['timeouts'], 1)
+
+    def test_waiter_gets_the_returned_connection(self):
+        pool = self.pool(max_size=1, timeout=5)
+        first = pool.getconn()
+        threading.Timer(0.05, pool.putconn, args=(first,)).start()
+        self.assertIs(pool.getconn(), first)
+        self.assertEqual(pool.snapshot()['waits'], 1)
+
+    def test_idle_and_old_connections_are_replaced(self):
+        for option, reason in (('max_idle', 'closed_idle'), ('max_lifetime', 'closed_lifetime')):
+            pool = self.pool(**{option: 0})
+            first = pool.getconn()
+            pool.putconn(first)
+            self.assertIsNot(pool.getconn(), first)
+            stats = pool.snapshot()
+            self.assertEqual((stats[reason], stats['created'], stats['size']), (1, 2, 1))
+
+    def test_broken_connection_is_replaced(self):
+        pool = self.pool()
+        first = pool.getconn()
+        pool.putconn(first)
+        first.close()
+        second = pool.getconn()
+        self.assertIsNot(second, first)
+        second.execute('SELECT 1')
+        self.assertEqual(pool.snapshot()['closed_broken'], 1)
+
+    def test_close_inside_atomic_rolls_back(self):
+        settings_dict = {
+            **connection.settings_dict, 'ENGINE': 'LittleLemonAPI.db.sqlite3', 'NAME': self.path, 'CONN_MAX_AGE': 0,
+            'OPTIONS': {'pool': {'max_size': 1}},
+        }
+        connections['pooled'] = load_backend('LittleLemonAPI.db.sqlite3').DatabaseWrapper(settings_dict, 'pooled')
+        pooled = connections['pooled']
+        self.addCleanup(delattr, connections._connections, 'pooled')
+        self.addCleanup(pooled.close)
+        with pooled.cursor() as cursor:
+            cursor.execute('CREATE TABLE note (text TEXT)')
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic(using='pooled'):
+                with pooled.cursor() as cursor:
+                    cursor.execute("INSERT INTO note VALUES ('lost')")
+                pooled.close()
+                raise RuntimeError
+        with pooled.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM note')
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertEqual(pooled.connection_pool.snapshot()['created'], 1)
+
+
+class CompiledSerializerTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer', email='customer@example.com', first_name='Ana')
+        self.crew = User.objects.create_user('crew')
+        checkout(self.customer, fill_cart(self.customer, 2), datetime.date(2024, 2, 29))
+        assigned = checkout(self.customer, fill_cart(self.customer, 1), datetime.date(2024, 3, 1))
+        Order.objects.filter(pk=assigned.pk).update(delivery_crew=self.crew, status=True)
+        MenuItem.objects.filter(pk=MenuItem.objects.order_by('id')[0].pk).update(price='1234.05')
+
+    def assertSameJSON(self, serializer_class, queryset):
+        compiled = compiled_serializer(serializer_class)
+        self.assertIsNotNone(compiled)
+        expected = serializer_class(queryset, many=True).data
+        self.assertEqual(JSONRenderer().render(compiled.serialize(compiled.values(queryset))), JSONRenderer().render(expected))
+
+    def test_catalog_lists_match_drf(self):
+        self.assertSameJSON(CategorySerializer, Category.objects.order_by('id'))
+        self.assertSameJSON(ReadMenuItemSerializer, MenuItem.objects.select_related('category').order_by('id'))
+
+    def test_user_list_matches_drf(self):
+        self.assertSameJSON(CustomUserSerializer, User.objects.order_by('id'))
+
+    def test_order_lists_match_drf_with_and_without_crew(self):
+        orders = Order.objects.select_related('user', 'delivery_crew').prefetch_related('order_items__menuitem__category').order_by('id')
+        self.assertEqual(sorted(orders.values_list('delivery_crew', flat=True), key=str), [self.crew.pk, None])
+        self.assertSameJSON(ReadOrderSerializer, orders)
+        Order.objects.filter(status=True).update(date=datetime.date(2000, 1, 1))
+        archive_orders(days=90)
+        self.assertSameJSON(ReadArchivedOrderSerializer, ArchivedOrder.objects.order_by('id'))
+
+    def test_order_page_takes_one_query_per_table(self):
+        compiled = compiled_serializer(ReadOrderSerializer)
+        with self.assertNumQueries(2):
+            compiled.serialize(compiled.values(Order.objects.order_by('id')))
+
+
+class RoleTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager')
+        self.group = Group.objects.create(name=MANAGER)
+        self.manager.groups.add(self.group)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % RoleRefreshToken.for_user(self.manager).access_token)
+
+    def test_token_from_before_a_group_removal_is_rejected(self):
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 200)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.manager.groups.remove(self.group)
+            # the cached state stays until the removal commits
+            self.assertIsNotNone(cache.get(ROLE_VERSION_CACHE_KEY % self.manager.pk))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 401)
+
+    def test_token_of_a_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.manager.is_active = False
+            self.manager.save()
+        self.assertEqual(self.client.get('/api/groups/manager/users').status_code, 401)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user('customer')
+        self.crew = User.objects.create_user('crew', first_name='Sam')
+        self.manager = User.objects.create_user('manager')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = checkout(self.customer, fill_cart(self.customer, 2), datetime.date.today())
+        Order.objects.filter(pk=self.order.pk).update(delivery_crew=self.crew)
+
+    def test_catalog_304_skips_the_query(self):
+        for url in ('/api/menu-items', '/api/categories'):
+            response = self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(again.status_code, 304)
+            self.assertFalse([query for query in queries if 'menuitem' in query['sql'].lower() or 'category' in query['sql'].lower()])
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_catalog_edit_changes_the_tag(self):
+        etag = self.client.get('/api/menu-items')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            MenuItem.objects.order_by('id').first().save()
+        self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_304_until_the_order_or_its_people_change(self):
+        url = '/api/orders/%d' % self.order.pk
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertFalse([query for query in queries if 'orderitem' in query['sql'].lower()])
+        User.objects.filter(pk=self.crew.pk).update(first_name='Sasha')
+        renamed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.data['delivery_crew']['first_name'], 'Sasha')
+        Order.objects.filter(pk=self.order.pk).update(delivery_crew=None)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=renamed['ETag']).status_code, 200)
+
+
+class RoleResolutionTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer')
+        self.crew = User.objects.create_user('crew')
+        self.crew.groups.add(Group.objects.create(name=DELIVERY_CREW))
+        self.manager = User.objects.create_user('manager')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.order = checkout(self.customer, fill_cart(self.customer, 1), datetime.date.today())
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def group_queries(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        return response, len([query for query in queries if 'auth_user_groups' in query['sql']])
+
+    def test_patch_loads_roles_once(self):
+        client = self.client_for(self.manager)
+        response, lookups = self.group_queries(lambda: client.patch('/api/orders/%d' % self.order.pk, {'delivery_crew_id': self.crew.pk}, format='json'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lookups, 1)
+
+    def test_token_roles_need_no_lookup(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer %s' % RoleRefreshToken.for_user(self.manager).access_token)
+        response, lookups = self.group_queries(lambda: client.get('/api/orders/%d' % self.order.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lookups, 0)
+
+    def test_roles_still_gate_each_request(self):
+        url = '/api/orders/%d' % self.order.pk
+        Order.objects.filter(pk=self.order.pk).update(delivery_crew=self.crew)
+        self.assertEqual(self.client_for(self.crew).patch(url, {'status': True, 'delivery_crew_id': self.crew.pk}, format='json').status_code, 403)
+        self.assertEqual(self.client_for(self.crew).patch(url, {'status': True}, format='json').status_code, 200)
+        self.assertEqual(self.client_for(User.objects.create_user('other')).get(url).status_code, 403)
+        self.assertEqual(self.client_for(self.customer).get('/api/groups/manager/users').status_code, 403)
+
+
+class QueryShapingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = User.objects.create_user('manager')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+
+    def queries(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_order_views_do_not_grow_with_orders_or_items(self):
+        counts = []
+        for orders, lines in ((1, 1), (4, 5)):
+            Order.objects.all().delete()
+            customer = User.objects.create_user('customer-%d' % orders)
+            for _ in range(orders):
+                checkout(customer, fill_cart(customer, lines), datetime.date.today())
+            order = Order.objects.latest('id')
+            counts.append((self.queries(self.manager, '/api/orders/'), self.queries(self.manager, '/api/orders/%d' % order.pk)))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cart_and_menu_lists_do_not_grow(self):
+        counts = []
+        for lines in (1, 5):
+            customer = User.objects.create_user('customer-%d' % lines)
+            fill_cart(customer, lines)
+            cache.clear()
+            counts.append((self.queries(customer, '/api/cart/menu-items'), self.queries(customer, '/api/menu-items')))
+        self.assertEqual(counts[0], counts[1])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user('manager')
+        self.manager.groups.add(Group.objects.create(name=MANAGER))
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+        customer = User.objects.create_user('customer')
+        start = datetime.date(2024, 1, 1)
+        # four orders per date, so every date is a tie the id has to break
+        Order.objects.bulk_create([
+            Order(user=customer, total='5.00', status=index % 3 == 0, date=start + datetime.timedelta(days=index // 4))
+            for index in range(13)
+        ])
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(order['id'] for order in response.data['results'])
+            url, pages = response.data['next'], pages + 1
+        return ids, pages
+
+    def test_pages_follow_each_ordering_without_gaps(self):
+        orders = list(Order.objects.values_list('id', 'status', 'date'))
+        expected = {
+            '': sorted(orders, key=lambda order: (order[2], order[0]), reverse=True),
+            'date': sorted(orders, key=lambda order: (order[2], order[0])),
+            'status': sorted(orders, key=lambda order: (order[1], order[2], order[0])),
+            '-status': sorted(orders, key=lambda order: (order[1], order[2], order[0]), reverse=True),
+        }
+        for ordering, rows in expected.items():
+            ids, pages = self.walk('/api/orders/?ordering=%s' % ordering if ordering else '/api/orders/')
+            self.assertEqual(ids, [row[0] for row in rows], ordering)
+            self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get('/api/orders/?ordering=date').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual([order['id'] for order in back['results']], [order['id'] for order in first['results']])
+
+    def test_deep_pages_cost_what_the_first_costs(self):
+        with CaptureQueriesContext(connection) as first:
+            page = self.client.get('/api/orders/?ordering=status').data
+        last_page = self.client.get(page['next']).data['next']
+        with CaptureQueriesContext(connection) as deeper:
+            self.client.get(last_page)
+        self.assertEqual(len(first), len(deeper))
+        self.assertFalse([query for query in first if 'COUNT(' in query['sql'].upper()])
+
+    def test_tampered_cursor_is_404(self):
+        self.assertEqual(self.client.get('/api/orders/?cursor=bm90LWpzb24').status_code, 404)
+
+
+class BatchCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('customer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(title='Mains', slug='mains')
+        self.menu = [MenuItem.objects.create(title='Dish %d' % index, price='3.00', featured=False, category=category) for index in range(15)]
+
+    def lines(self, menu):
+        return [{'menuitem_id': item.pk, 'quantity': 2, 'unit_price': '3.00', 'price': '6.00'} for item in menu]
+
+    def test_each_line_gets_its_own_outcome(self):
+        CartItem.objects.create(user=self.user, menuitem=self.menu[0], quantity=1, unit_price='3.00', price='3.00')
+        response = self.client.post('/api/cart/menu-items', [
+            *self.lines(self.menu[:2]),
+            {**self.lines(self.menu[2:3])[0], 'unit_price': '9.00', 'price': '18.00'},
+            {'menuitem_id': 0, 'quantity': 1, 'unit_price': '3.00', 'price': '3.00'},
+            *self.lines(self.menu[1:2]),
+            {'menuitem_id': self.menu[3].pk},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data], [400, 201, 400, 400, 400, 400])
+        self.assertEqual(response.data[1]['data']['id'], CartItem.objects.get(user=self.user, menuitem=self.menu[1]).pk)
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_statement_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for menu in (self.menu[:2], self.menu[2:14]):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post('/api/cart/menu-items', self.lines(menu), format='json').status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_a_batch_is_one_throttle_hit(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_PATH='%s/ratelimit.sqlite3' % directory):
+            codes = [self.client.post('/api/cart/menu-items', self.lines(self.menu), format='json').status_code]
+            codes += [self.client.post('/api/cart/menu-items', self.lines(self.menu[:1]), format='json').status_code for _ in range(10)]
+        self.assertEqual(codes, [201] + [400] * 9 + [429])
+
+
+class CrewSchedulerTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user('customer')
+        group = Group.objects.create(name=DELIVERY_CREW)
+        self.crew = [User.objects.create_user('crew%d' % index) for index in range(3)]
+        group.user_set.add(*self.crew)
+
+    def place_orders(self, count, crew=None):
+        return [
+            Order.objects.create(user=self.customer, delivery_crew=crew, total='5.00', status=False, date=datetime.date.today())
+            for _ in range(count)
+        ]
+
+    def test_open_orders_are_spread_by_load(self):
+        self.place_orders(3, crew=self.crew[0])
+        Order.objects.create(user=self.customer, delivery_crew=self.crew[1], total='5.00', status=True, date=datetime.date.today())
+        self.place_orders(6)
+        self.assertEqual(assign_delivery_crew(batch_size=4), 6)
+        self.assertEqual(crew_loads(), {member.pk: 3 for member in self.crew})
+        self.assertFalse(Order.objects.filter(delivery_crew__isnull=True).exists())
+
+    def test_statement_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for count in (3, 30):
+            self.place_orders(count)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(assign_delivery_crew(), count)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    @override_settings(ORDER_EVENTS_ENABLED=True)
+    def test_assigned_orders_are_published_after_commit(self):
+        orders = self.place_orders(4)
+        Order.objects.filter(pk=orders[0].pk).update(delivery_crew=self.crew[0])
+        with mock.patch.object(hub, 'dispatch') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.assertEqual(assign_delivery_crew(), 3)
+                self.assertFalse(dispatch.called)
+        self.assertEqual(len(callbacks), 3)
+        published = {payload['id']: payload['delivery_crew_id'] for (payload,), _ in dispatch.call_args_list}
+        self.assertEqual(published, dict(Order.objects.filter(pk__in=[order.pk for order in orders[1:]]).values_list('id', 'delivery_crew_id')))
+
+
+class MenuImportTests(TestCase):
+    def setUp(self):
+        manager = User.objects.create_user('manager')
+        manager.groups.add(Group.objects.create(name=MANAGER))
+        self.client = APIClient()
+        self.client.force_authenticate(manager)
+        self.category = Category.objects.create(title='Mains', slug='mains')
+        Category.objects.create(title='Desserts', slug='desserts')
+
+    def import_rows(self, rows):
+        return self.client.post('/api/menu-items/import', rows, format='json')
+
+    def test_each_row_gets_its_own_outcome(self):
+        soup = MenuItem.objects.create(title='Soup', price='3.00', featured=False, category=self.category)
+        bread = MenuItem.objects.create(title='Bread', price='1.00', featured=False, category=self.category)
+        response = self.import_rows([
+            {'title': 'Soup', 'price': '4.00', 'category': 'mains'},
+            {'title': 'Bread', 'price': '1.00', 'category': 'mains'},
+            {'title': 'Pie', 'price': '5.00', 'featured': True, 'category': 'desserts'},
+            {'title': 'Stew', 'price': '6.00', 'category': 'sides'},
+            {'title': 'Salad', 'price': '-1.00', 'category': 'mains'},
+            {'title': 'Pie', 'price': '7.00', 'category': 'mains'},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([(row['status'], row.get('action')) for row in response.data], [
+            (200, 'updated'), (200, 'unchanged'), (201, 'created'), (400, None), (400, None), (400, None),
+        ])
+        self.assertEqual(response.data[0]['id'], soup.pk)
+        self.assertEqual(response.data[1]['id'], bread.pk)
+        self.assertIn('category', response.data[3]['errors'])
+        self.assertIn('price', response.data[4]['errors'])
+        self.assertIn('title', response.data[5]['errors'])
+        soup.refresh_from_db()
+        self.assertEqual(soup.price, Decimal('4.00'))
+        pie = MenuItem.objects.get(title='Pie')
+        self.assertEqual((pie.pk, pie.price, pie.featured, pie.category.slug), (response.data[2]['id'], Decimal('5.00'), True, 'desserts'))
+        self.assertEqual(MenuItem.objects.count(), 3)
+
+    def test_csv_upload(self):
+        response = self.client.post('/api/menu-items/import', 'title,price,featured,category\nSoup,3.00,,mains\nPie,5.00,true,desserts\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(MenuItem.objects.values_list('title', 'featured')), [('Pie', True), ('Soup', False)])
+
+    def test_one_catalog_bump_per_import(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.import_rows([{'title': 'Dish %d' % index, 'price': '2.00', 'category': 'mains'} for index in range(20)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_catalog_version(), version + 1)
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_rows([{'title': 'Dish %d' % index, 'price': '2.00', 'category': 'mains'} for index in range(20)])
+        # nothing changed, nothing to invalidate
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_statement_count_does_not_grow_with_the_import(self):
+        counts = []
+        for size in (3, 60):
+            rows = [{'title': 'Dish %d of %d' % (index, size), 'price': '2.00', 'category': 'mains'} for index in range(size)]
+            with CaptureQueriesContext(connection) as created:
+                self.assertEqual(self.import_rows(rows).status_code, 200)
+            for row in rows:
+                row['price'] = '2.50'
+            with CaptureQueriesContext(connection) as updated:
+                response = self.import_rows(rows)
+            self.assertEqual({row['action'] for row in response.data}, {'updated'})
+            counts.append((len(created), len(updated)))
+        self.assertEqual(counts[0], counts[1])
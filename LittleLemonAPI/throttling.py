@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import throttling
+
+# float slack so that `limit` requests spaced period / limit apart always fit
+EPSILON = 1e-9
+
+
+class SQLiteRateStore:
+    # Token buckets in a SQLite file shared by every process on the host. Each key
+    # is one row holding the bucket's theoretical arrival time (GCRA): a hit
+    # pushes it period / limit into the future and is allowed while it stays
+    # within one period of now. The read-modify-write runs under BEGIN IMMEDIATE,
+    # so concurrent workers are serialized by SQLite's write lock.
+    purge_every = 1000
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+        self.hits = 0
+
+    def connection(self):
+        # per thread and per process, a forked worker must not reuse its parent's
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def hit(self, key, limit, period):
+        connection = self.connection()
+        interval = period / limit
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute('SELECT tat FROM buckets WHERE key = ?', (key,)).fetchone()
+            tat = max(row[0] if row else now, now) + interval
+            allowed = tat - now <= period + EPSILON
+            if allowed:
+                connection.execute('INSERT INTO buckets (key, tat) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET tat = excluded.tat', (key, tat))
+            self.hits += 1
+            if self.hits % self.purge_every == 0:
+                # a bucket whose arrival time has passed is full, same as no row
+                connection.execute('DELETE FROM buckets WHERE tat < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, None if allowed else tat - now - period
+
+    async def ahit(self, key, limit, period):
+        return await sync_to_async(self.hit, thread_sensitive=False)(key, limit, period)
+
+
+class CacheRateStore:
+    # Sliding-window counters in a Django cache, for several hosts behind a shared
+    # backend with atomic incr() (Redis, Memcached): the count of the current
+    # fixed window plus the previous window's count weighted by how much of it
+    # still overlaps the sliding window. Two keys per client, whatever the rate.
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def keys(self, key, period, now):
+        window = int(now // period)
+        return window, '%s:%d' % (key, window), '%s:%d' % (key, window - 1)
+
+    def count(self, key, period):
+        cache = self.cache
+        cache.add(key, 0, period * 2)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, period * 2)
+            return 1
+
+    def decide(self, key, limit, period, now, window, count, previous):
+        weight = 1 - (now - window * period) / period
+        if previous * weight + count <= limit:
+            return True, None
+        self.cache.decr(key)
+        if count > limit or not previous:
+            return False, (window + 1) * period - now
+        # the previous window's share drops to (limit - count) / previous at
+        return False, max(0.0, (window + (count - limit) / previous + 1) * period - now)
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window, current, previous = self.keys(key, period, now)
+        count = self.count(current, period)
+        return self.decide(current, limit, period, now, window, count, self.cache.get(previous, 0))
+
+    async def ahit(self, key, limit, period):
+        return await sync_to_async(self.hit, thread_sensitive=False)(key, limit, period)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def rate_store():
+    if getattr(settings, 'RATE_LIMIT_STORE', 'sqlite') == 'cache':
+        config = ('cache', getattr(settings, 'RATE_LIMIT_CACHE', 'default'))
+    else:
+        config = ('sqlite', str(getattr(settings, 'RATE_LIMIT_PATH', settings.BASE_DIR / 'ratelimit.sqlite3')))
+    with _stores_lock:
+        if config not in _stores:
+            _stores[config] = CacheRateStore(config[1]) if config[0] == 'cache' else SQLiteRateStore(config[1])
+        return _stores[config]
+
+
+class BucketThrottleMixin:
+    # SimpleRateThrottle keys and rates, with the state in rate_store() instead of
+    # a per-key timestamp list in the default cache
+    retry_after = None
+
+    def bucket_key(self, request, view):
+        if self.rate is None or not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            return None
+        self.key = self.get_cache_key(request, view)
+        return self.key
+
+    def allow_request(self, request, view):
+        key = self.bucket_key(request, view)
+        if key is None:
+            return True
+        allowed, self.retry_after = rate_store().hit(key, self.num_requests, self.duration)
+        return allowed
+
+    async def aallow_request(self, request, view):
+        key = self.bucket_key(request, view)
+        if key is None:
+            return True
+        allowed, self.retry_after = await rate_store().ahit(key, self.num_requests, self.duration)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class AnonRateThrottle(BucketThrottleMixin, throttling.AnonRateThrottle):
+    pass
+
+
+class UserRateThrottle(BucketThrottleMixin, throttling.UserRateThrottle):
+    pass
+
+
+class ScopedRateThrottle(BucketThrottleMixin, throttling.ScopedRateThrottle):
+    # a separate bucket per client for views that set throttle_scope
+    def bucket_key(self, request, view):
+        self.scope = getattr(view, self.scope_attr, None)
+        if not self.scope or not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+            return None
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().bucket_key(request, view)
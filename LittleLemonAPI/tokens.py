@@ -0,0 +1,35 @@
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .roles import load_roles, get_role_version
+
+ROLES_CLAIM = 'roles'
+ROLE_VERSION_CLAIM = 'role_version'
+USERNAME_CLAIM = 'username'
+
+
+class RoleRefreshToken(RefreshToken):
+    # roles are stamped onto every access token minted from this refresh token,
+    # so a refresh always picks up the current group membership
+    @property
+    def access_token(self):
+        access = super().access_token
+        user_id = self.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None:
+            access[ROLES_CLAIM] = sorted(load_roles(user_id))
+            access[ROLE_VERSION_CLAIM] = get_role_version(user_id)
+        return access
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[USERNAME_CLAIM] = user.get_username()
+        return token
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RoleRefreshToken
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RoleRefreshToken
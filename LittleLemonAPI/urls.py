@@ -1,19 +1,25 @@
 from django.urls import path, include
 from .views import *
+from .async_views import *
 
 urlpatterns = [
-    path('menu-items', MenuItemList.as_view(), name="menuitem"),
-    path('menu-items/<int:pk>', MenuItemDetail.as_view(), name="menuitem-detail"),
-    path('categories', CategoryList.as_view(), name="category"),
+    path('menu-items', read_view(MenuItemList, AsyncMenuItemList), name="menuitem"),
+    path('menu-items/import', MenuItemImport.as_view(), name="menuitem-import"),
+    path('menu-items/<int:pk>', read_view(MenuItemDetail, AsyncMenuItemDetail), name="menuitem-detail"),
+    path('categories', read_view(CategoryList, AsyncCategoryList), name="category"),
     path('categories/<int:pk>', CategoryDetail.as_view(), name="category-detail"),
     path('cart/menu-items', CartItemList.as_view({'get': 'list', 'post': 'create', 'delete': 'destroy'}), name="cartitem"),
     path('cart/menu-items/<int:pk>', CartItemDetail.as_view(), name="cartitem-detail"),
-    path('orders/', OrderList.as_view(), name="order"),
-    path('orders/<int:pk>', OrderDetail.as_view(), name="order-detail"),
+    path('orders/', read_view(OrderList, AsyncOrderList), name="order"),
+    path('orders/<int:pk>', read_view(OrderDetail, AsyncOrderDetail), name="order-detail"),
+    path('orders/export', OrderExport.as_view(), name="order-export"),
+    path('orders/jobs/<int:pk>', CheckoutJobDetail.as_view(), name="checkout-job"),
     path('groups/manager/users', ManagerUserList.as_view({'get': 'list', 'post': 'create'}), name="manager"),
     path('groups/manager/users/<int:pk>', RemoveManager.as_view(), name="remove-manager"),
     path('groups/delivery-crew/users', DeliveryCrewList.as_view({'get': 'list', 'post': 'create'}), name="delivery-crew"),
     path('groups/delivery-crew/users/<int:pk>', RemoveDeliveryCrew.as_view(), name="remove-delivery-crew"),
     path('users/all', UserList.as_view(), name="user"),
+    path('metrics', MetricsView.as_view(), name="metrics"),
+    path('analytics/sales', SalesAnalytics.as_view(), name="sales-analytics"),
     path('', include('djoser.urls')),
 ]
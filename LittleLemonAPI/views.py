@@ -1,37 +1,64 @@
 from django.shortcuts import render
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, DestroyAPIView, ListAPIView
+import hashlib
+from decimal import Decimal
+from itertools import chain
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from rest_framework.generics import ListCreateAPIView, RetrieveAPIView, RetrieveUpdateDestroyAPIView, DestroyAPIView, ListAPIView
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 from .serializers import *
-from .models import MenuItem, Category, CartItem
-from rest_framework.exceptions import PermissionDenied
+from .models import MenuItem, Category, CartItem, CheckoutJob
+from rest_framework.exceptions import APIException, PermissionDenied
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework import status
 from django.contrib.auth.models import Group
 from .permissions import *
-from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+from .cart_store import cache_cart, uses_cache_cart
+from .checkout_queue import enqueue_checkout, queue_requested
+from .catalog_cache import CatalogCacheMixin, get_catalog_version
+from .compiled import CompiledListMixin, compiled_serializer
+from .idempotency import IdempotencyMixin
+from .export import EXPORT_FORMATS, CSVRenderer, NDJSONRenderer, async_lines, export_chunks
+from .metrics import TimedViewMixin, render_metrics
+from .order_events import publish_order
+from .parsers import CSVParser
+from .conditional import conditional_response, set_validators
+from .pagination import OrderKeysetPagination, UserKeysetPagination
+from .querysets import ShapedQuerysetMixin, prefetch_for, shape_queryset
+from .sales import sales_report
+from .services import add_cart_lines, checkout, delete_order, import_menu_items, replace_order
+from .roles import MANAGER, DELIVERY_CREW, is_manager, is_delivery_crew
+from rest_framework.filters import OrderingFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from .search import TitleSearchFilter
+from .throttling import ScopedRateThrottle
 # Create your views here.
 
-class CategoryList(ListCreateAPIView):
+class CategoryList(TimedViewMixin, CatalogCacheMixin, CompiledListMixin, ShapedQuerysetMixin, ListCreateAPIView):
+    filter_backends = [DjangoFilterBackend, OrderingFilter, TitleSearchFilter]
     queryset = Category.objects.all()
     ordering_fields = ['title']
     search_fields = ['title']
     serializer_class = CategorySerializer
     permission_classes = [OnlyManagerCreates]
-    throttle_classes = [AnonRateThrottle, UserRateThrottle]
     
-class CategoryDetail(RetrieveUpdateDestroyAPIView):
+class CategoryDetail(TimedViewMixin, CatalogCacheMixin, ShapedQuerysetMixin, RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [OnlyManagerUpdates, OnlyManagerDestroys, OnlyManagerPatches]
-    throttle_classes = [AnonRateThrottle, UserRateThrottle]
     
-class MenuItemList(ListCreateAPIView):
+class MenuItemList(TimedViewMixin, CatalogCacheMixin, CompiledListMixin, ShapedQuerysetMixin, ListCreateAPIView):
+    filter_backends = [DjangoFilterBackend, OrderingFilter, TitleSearchFilter]
     queryset = MenuItem.objects.all()
     ordering_fields = ['title', 'featured']
     search_fields = ['title']
     filter_fields = ['category', 'featured']
     permission_classes = [OnlyManagerCreates]
-    throttle_classes = [AnonRateThrottle, UserRateThrottle]
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -40,52 +67,148 @@ class MenuItemList(ListCreateAPIView):
             return WriteMenuItemSerializer
 
     
-class MenuItemDetail(RetrieveUpdateDestroyAPIView):
+class MenuItemImport(TimedViewMixin, APIView):
+    # Upserts a whole menu, a JSON list or a CSV upload of title, price,
+    # featured and category (slug) rows keyed by title, in one transaction and
+    # one throttle hit. Every row gets its own status, the response is 200, 207
+    # or 400 overall.
+    permission_classes = [IsManager]
+    parser_classes = [JSONParser, CSVParser]
+
+    def post(self, request):
+        max_rows = getattr(settings, 'MENU_IMPORT_MAX_ROWS', 1000)
+        if not isinstance(request.data, list) or not request.data or len(request.data) > max_rows:
+            return Response({'non_field_errors': ["An import must have between 1 and %d rows" % max_rows]}, status=status.HTTP_400_BAD_REQUEST)
+        results = [None] * len(request.data)
+        valid = []
+        # one serializer validates every row, as a ListSerializer's child would,
+        # instead of copying its fields for each of them
+        serializer = ImportMenuItemSerializer()
+        for index, row in enumerate(request.data):
+            try:
+                valid.append((index, serializer.run_validation(row)))
+            except serializers.ValidationError as exc:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': exc.detail}
+        outcomes = import_menu_items([data for _, data in valid])
+        for (index, _), (menuitem_id, action, errors) in zip(valid, outcomes):
+            if errors is not None:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': errors}
+            else:
+                code = status.HTTP_201_CREATED if action == 'created' else status.HTTP_200_OK
+                results[index] = {'status': code, 'id': menuitem_id, 'action': action}
+        failed = sum(result['status'] == status.HTTP_400_BAD_REQUEST for result in results)
+        if not failed:
+            code = status.HTTP_200_OK
+        elif failed < len(results):
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=code)
+
+    
+class MenuItemDetail(TimedViewMixin, CatalogCacheMixin, ShapedQuerysetMixin, RetrieveUpdateDestroyAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = ReadMenuItemSerializer
     permission_classes = [OnlyManagerUpdates, OnlyManagerDestroys, OnlyManagerPatches]
-    throttle_classes = [AnonRateThrottle, UserRateThrottle]
     
-class CartItemList(ModelViewSet):
+class CartItemList(TimedViewMixin, IdempotencyMixin, ModelViewSet):
     queryset = CartItem.objects.all()
-    throttle_classes = [UserRateThrottle]
     
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user)
+        return shape_queryset(CartItem.objects.filter(user=self.request.user), self.get_serializer_class())
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
-            return WriteCartItemSerializer
+            return CacheCartItemSerializer if uses_cache_cart() else WriteCartItemSerializer
         return ReadCartItemSerializer
     
+    def list(self, request, *args, **kwargs):
+        if not uses_cache_cart():
+            return super().list(request, *args, **kwargs)
+        items = cache_cart.items(request.user)
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(items, many=True).data)
+    
     def create(self, request, *args, **kwargs):
+        return self.idempotent_response(request, lambda: self.create_line(request, *args, **kwargs))
+    
+    def create_line(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.create_batch(request)
         request.data['user_id'] = request.user.id
-        return super().create(request, *args, **kwargs)
+        if not uses_cache_cart():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        line_id = cache_cart.add(request.user, data['menuitem_id'], data['quantity'], data['unit_price'], data['price'])
+        serializer.instance = CartItem(id=line_id, **data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    def create_batch(self, request):
+        # a JSON list adds many lines in one request (and one throttle hit); every
+        # line gets its own status, the response is 201, 207 or 400 overall
+        max_lines = getattr(settings, 'CART_BATCH_MAX_LINES', 50)
+        if not request.data or len(request.data) > max_lines:
+            return Response({'non_field_errors': ["A batch must have between 1 and %d lines" % max_lines]}, status=status.HTTP_400_BAD_REQUEST)
+        results = [None] * len(request.data)
+        valid = []
+        for index, line in enumerate(request.data):
+            if isinstance(line, dict):
+                line = {**line, 'user_id': request.user.id}
+            serializer = BatchCartItemSerializer(data=line)
+            if serializer.is_valid():
+                valid.append((index, serializer))
+            else:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+        outcomes = add_cart_lines(request.user, [serializer.validated_data for _, serializer in valid])
+        for (index, serializer), (line_id, errors) in zip(valid, outcomes):
+            if errors is not None:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': errors}
+            else:
+                serializer.instance = CartItem(id=line_id, **serializer.validated_data)
+                results[index] = {'status': status.HTTP_201_CREATED, 'data': serializer.data}
+        created = sum(result['status'] == status.HTTP_201_CREATED for result in results)
+        if created == len(results):
+            code = status.HTTP_201_CREATED
+        elif created:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(results, status=code)
     
     def destroy(self, request, *args, **kwargs):
-        self.queryset.filter(user=self.request.user).delete()
+        if uses_cache_cart():
+            cache_cart.clear(request.user)
+        else:
+            self.queryset.filter(user=self.request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
         
     
     
-class CartItemDetail(DestroyAPIView):
+class CartItemDetail(TimedViewMixin, DestroyAPIView):
     serializer_class = ReadCartItemSerializer
     queryset = CartItem.objects.all()
-    throttle_classes = [UserRateThrottle]
     
     def destroy(self, request, *args, **kwargs):
+        if uses_cache_cart():
+            if not cache_cart.remove(request.user, int(kwargs['pk'])):
+                raise Http404
+            return Response(status=status.HTTP_204_NO_CONTENT)
         obj = self.get_object()
-        if obj.user != self.request.user:
+        if obj.user_id != self.request.user.pk:
             raise PermissionDenied("You do not have permission to perform this action", code=403)
         return super().destroy(request, *args, **kwargs)
     
-class ManagerUserList(ModelViewSet):
+class ManagerUserList(TimedViewMixin, ModelViewSet):
     queryset = User.objects.all()
+    pagination_class = UserKeysetPagination
     permission_classes = [IsManager]
-    throttle_classes = [UserRateThrottle]
 
     def get_queryset(self):
-        return User.objects.filter(groups__name='Manager')
+        return User.objects.filter(groups__name=MANAGER)
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -96,28 +219,27 @@ class ManagerUserList(ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = get_object_or_404(User, id=serializer.validated_data['user_id'])
-        group = Group.objects.get(name='Manager')
+        group = Group.objects.get(name=MANAGER)
         user.groups.add(group)
         return Response(status=status.HTTP_201_CREATED, data="Manager added")
 
-class RemoveManager(DestroyAPIView):
+class RemoveManager(TimedViewMixin, DestroyAPIView):
     queryset = User.objects.all()
     permission_classes = [IsManager]
-    throttle_classes = [UserRateThrottle]
     
     def destroy(self, request, *args, **kwargs):
         user = self.get_object()
-        group = Group.objects.get(name='Manager')
+        group = Group.objects.get(name=MANAGER)
         user.groups.remove(group)
         return Response(status=status.HTTP_200_OK, data="Manager removed")
         
-class DeliveryCrewList(ModelViewSet):
+class DeliveryCrewList(TimedViewMixin, ModelViewSet):
     queryset = User.objects.all()
+    pagination_class = UserKeysetPagination
     permission_classes = [IsManager]
-    throttle_classes = [UserRateThrottle]
     
     def get_queryset(self):
-        return User.objects.filter(groups__name='Delivery crew')
+        return User.objects.filter(groups__name=DELIVERY_CREW)
       
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -128,26 +250,91 @@ class DeliveryCrewList(ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = get_object_or_404(User, id=serializer.validated_data['user_id'])
-        group = Group.objects.get(name='Delivery crew')
+        group = Group.objects.get(name=DELIVERY_CREW)
         user.groups.add(group)
         return Response(status=status.HTTP_201_CREATED, data="Delivery crew added")
 
-class RemoveDeliveryCrew(DestroyAPIView):
+class RemoveDeliveryCrew(TimedViewMixin, DestroyAPIView):
     queryset = User.objects.all()
     permission_classes = [IsManager]
-    throttle_classes = [UserRateThrottle]
     
     def destroy(self, request, *args, **kwargs):
         user = self.get_object()
-        group = Group.objects.get(name='Delivery crew')
+        group = Group.objects.get(name=DELIVERY_CREW)
         user.groups.remove(group)
         return Response(status=status.HTTP_200_OK, data="Delivery crew removed")
 
-class OrderList(ListCreateAPIView):
+ARCHIVED_KEY = '_archived'
+
+
+class OrderArchived(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Archived orders are read-only"
+    default_code = 'order_archived'
+
+
+def visible_orders(request, model=Order):
+    if is_manager(request):
+        return model.objects.all()
+    if is_delivery_crew(request):
+        return model.objects.filter(delivery_crew=request.user)
+    return model.objects.filter(user=request.user)
+
+
+def archived_orders():
+    return shape_queryset(ArchivedOrder.objects.all(), ReadArchivedOrderSerializer, prefetch=False)
+
+
+def includes_archive(request):
+    return request.query_params.get('include_archived') in ('1', 'true')
+
+
+def list_with_archive(view):
+    # ?include_archived=1: keyset pages over live and archived orders together,
+    # each row rendered by the compiled serializer of its own table
+    sources = [(compiled_serializer(ReadOrderSerializer), Order), (compiled_serializer(ReadArchivedOrderSerializer), ArchivedOrder)]
+    querysets = [
+        compiled.values(view.filter_queryset(visible_orders(view.request, model))).annotate(**{ARCHIVED_KEY: Value(index)})
+        for index, (compiled, model) in enumerate(sources)
+    ]
+    page = view.paginator.paginate_querysets(querysets, view.request)
+    data = {}
+    for index, (compiled, _) in enumerate(sources):
+        rows = [row for row in page if row[ARCHIVED_KEY] == index]
+        data.update(zip(map(id, rows), compiled.serialize(rows)))
+    return view.get_paginated_response([data[id(row)] for row in page])
+
+
+def check_order_access(request, order):
+    manager = is_manager(request)
+    delivery_crew = is_delivery_crew(request)
+    if not manager and not delivery_crew:
+        if order.user_id != request.user.pk:
+            raise PermissionDenied("Customers only view their own orders", code=403)
+    elif delivery_crew:
+        if order.delivery_crew_id != request.user.pk:
+            raise PermissionDenied("Delivery crew only view their own orders", code=403)
+
+
+def order_etag(order, catalog_version):
+    # nested menu items are part of the payload, so catalog edits change the tag
+    # too; so do edits of the nested user and delivery crew, whose fields go into
+    # it as they have no timestamp (and orders get no Last-Modified for that)
+    people = [
+        None if user is None else [getattr(user, field) for field in CustomUserSerializer.Meta.fields]
+        for user in (order.user, order.delivery_crew)
+    ]
+    return '"order-%d-%d-%s-%s"' % (
+        order.pk, order.updated_at.timestamp() * 1000000, catalog_version, hashlib.md5(repr(people).encode()).hexdigest(),
+    )
+
+
+class OrderList(TimedViewMixin, IdempotencyMixin, CompiledListMixin, ListCreateAPIView):
+    pagination_class = OrderKeysetPagination
+    throttle_scope = 'orders'
     ordering_fields = ['date', 'status']
     search_fields = ['date', 'status']
     filter_fields = ['status']
-    throttle_classes = [UserRateThrottle]
     
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -155,32 +342,52 @@ class OrderList(ListCreateAPIView):
         return WriteOrderSerializer
     
     def get_queryset(self):
-        if self.request.user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        if self.request.user.groups.filter(name='Delivery crew').exists():
-            return Order.objects.filter(delivery_crew=self.request.user)
-        return Order.objects.filter(user=self.request.user)
+        return shape_queryset(visible_orders(self.request), self.get_serializer_class())
     
+    def list(self, request, *args, **kwargs):
+        if includes_archive(request):
+            return list_with_archive(self)
+        return super().list(request, *args, **kwargs)
     
     def create(self, request, *args, **kwargs):
+        return self.idempotent_response(request, lambda: self.place_order(request))
+    
+    def place_order(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        items = CartItem.objects.filter(user=self.request.user)
-        total = sum([item.price for item in items])
-        if total != serializer.validated_data['total']:
-            raise serializers.ValidationError("Total does not match cart total")
-        order = Order.objects.create(user=self.request.user, total=total, status=False, date=serializer.validated_data['date'])
-        order.save()
-        for item in items:
-            OrderItem.objects.create(order=order, menuitem=item.menuitem, quantity=item.quantity, unit_price=item.unit_price, price=item.price)
-        items.delete()
+        if queue_requested(request):
+            job = enqueue_checkout(self.request.user, serializer.validated_data['total'], serializer.validated_data['date'])
+            return Response({'job': job.pk, 'status': job.status}, status=status.HTTP_202_ACCEPTED, headers={
+                'Location': reverse('checkout-job', args=[job.pk], request=request), 'Preference-Applied': 'respond-async',
+            })
+        checkout(self.request.user, serializer.validated_data['total'], serializer.validated_data['date'])
         return Response(status=status.HTTP_201_CREATED, data="Order created")
     
 
-class OrderDetail(RetrieveUpdateDestroyAPIView):
+class CheckoutJobDetail(TimedViewMixin, RetrieveAPIView):
+    # outcome of a POST /api/orders/ sent with Prefer: respond-async; clients
+    # poll it, so it has its own throttle scope instead of the user rate
+    serializer_class = CheckoutJobSerializer
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'checkout_jobs'
+
+    def get_queryset(self):
+        if is_manager(self.request):
+            return CheckoutJob.objects.all()
+        return CheckoutJob.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if response.data['status'] in (CheckoutJob.QUEUED, CheckoutJob.RUNNING):
+            response['Retry-After'] = '1'
+        return response
+
+
+class OrderDetail(TimedViewMixin, IdempotencyMixin, ShapedQuerysetMixin, RetrieveUpdateDestroyAPIView):
     queryset = Order.objects.all()
+    defer_prefetch = True
+    throttle_scope = 'orders'
     permission_classes = [OnlyCustomerUpdates, DeliveryCrewOnlyPatchesStatus, ManagerUserOnlyPatchesStatusAndCrew, OnlyManagerDestroys]
-    throttle_classes = [UserRateThrottle]
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -188,33 +395,45 @@ class OrderDetail(RetrieveUpdateDestroyAPIView):
         elif self.request.method == 'PATCH':
             return PatchOrderSerializer
         return WriteOrderSerializer
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method == 'GET':
+                raise
+            # 409 rather than 404, to those allowed to see the archived order
+            order = get_object_or_404(ArchivedOrder.objects.all(), pk=self.kwargs['pk'])
+            self.check_object_permissions(self.request, order)
+            check_order_access(self.request, order)
+            raise OrderArchived()
     
     def retrieve(self, request, *args, **kwargs):
-        is_manager = self.request.user.groups.filter(name='Manager').exists()
-        is_delivery_crew = self.request.user.groups.filter(name='Delivery crew').exists()
-        if not is_manager and not is_delivery_crew:
-            if self.get_object().user != self.request.user:
-                raise PermissionDenied("Customers only view their own orders", code=403)
-        elif is_delivery_crew:
-            if self.get_object().delivery_crew != self.request.user:
-                raise PermissionDenied("Delivery crew only view their own orders", code=403)
-        return super().retrieve(request, *args, **kwargs)
+        serializer_class = ReadOrderSerializer
+        try:
+            order = self.get_object()
+        except Http404:
+            # delivered orders move to the archive after ORDER_ARCHIVE_AFTER_DAYS
+            order = get_object_or_404(archived_orders(), pk=kwargs['pk'])
+            self.check_object_permissions(request, order)
+            serializer_class = ReadArchivedOrderSerializer
+        check_order_access(self.request, order)
+        etag = order_etag(order, get_catalog_version())
+        response = conditional_response(request, etag)
+        if response is not None:
+            return response
+        prefetch_for([order], serializer_class)
+        serializer = serializer_class(order, context=self.get_serializer_context())
+        return set_validators(Response(serializer.data), etag)
 
     def update(self, request, *args, **kwargs):
+        return self.idempotent_response(request, lambda: self.replace(request))
+    
+    def replace(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        items = CartItem.objects.filter(user=self.request.user)
-        total = sum([item.price for item in items])
-        if total != serializer.validated_data['total']:
-            raise serializers.ValidationError("Total does not match cart total")
-        order = self.get_object()
-        order.total = total
-        order.date = serializer.validated_data['date']
-        order.save()
-        OrderItem.objects.filter(order=order).delete()
-        for item in items:
-            OrderItem.objects.create(order=order, menuitem=item.menuitem, quantity=item.quantity, unit_price=item.unit_price, price=item.price)
-        items.delete()
+        order = replace_order(self.get_object(), self.request.user, serializer.validated_data['total'], serializer.validated_data['date'])
+        publish_order(order)
         return Response(status=status.HTTP_200_OK, data="Order updated")
     
     def partial_update(self, request, *args, **kwargs):
@@ -226,10 +445,79 @@ class OrderDetail(RetrieveUpdateDestroyAPIView):
         if 'delivery_crew_id' in serializer.validated_data:
             order.delivery_crew = User.objects.get(id=serializer.validated_data['delivery_crew_id'])
         order.save()
+        publish_order(order)
         return Response(status=status.HTTP_200_OK, data="Order updated")
+    
+    def perform_destroy(self, instance):
+        delete_order(instance)
         
-class UserList(ListAPIView):
+class UserList(TimedViewMixin, CompiledListMixin, ShapedQuerysetMixin, ListAPIView):
     queryset = User.objects.all()
+    pagination_class = UserKeysetPagination
     serializer_class = CustomUserSerializer
     permission_classes = [IsManager]
-    throttle_classes = [UserRateThrottle]
+
+
+class MetricsView(TimedViewMixin, APIView):
+    # Prometheus text exposition of MetricsMiddleware's histograms; unthrottled
+    # so a scraper is never locked out
+    permission_classes = [IsManager]
+    throttle_classes = []
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SalesAnalytics(TimedViewMixin, APIView):
+    # date-range sales totals read from the daily rollups, so the cost does not
+    # grow with the number of orders
+    permission_classes = [IsManager]
+
+    def get(self, request):
+        query = SalesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        results = sales_report(**params)
+        quantity = sum(row['quantity'] for row in results)
+        revenue = sum((row['revenue'] for row in results), Decimal('0.00'))
+        for row in results:
+            row['revenue'] = str(row['revenue'].quantize(Decimal('0.01')))
+        return Response({
+            'start': params['start'], 'end': params['end'], 'group_by': params['group_by'],
+            'results': results,
+            'total': {'quantity': quantity, 'revenue': str(revenue.quantize(Decimal('0.01')))},
+        })
+
+
+class OrderExport(TimedViewMixin, APIView):
+    # Streams every order matching ?start=, ?end= and ?status= as NDJSON (one
+    # ReadOrderSerializer object per line) or CSV (one line per order item),
+    # chosen by the Accept header or ?format=ndjson|csv. Archived orders come
+    # first with ?include_archived=1.
+    permission_classes = [IsManager]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    throttle_scope = 'orders'
+
+    def get(self, request):
+        query = OrderExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        sources = [(Order, ReadOrderSerializer)]
+        if includes_archive(request):
+            sources.insert(0, (ArchivedOrder, ReadArchivedOrderSerializer))
+        filters = {}
+        if 'start' in params:
+            filters['date__gte'] = params['start']
+        if 'end' in params:
+            filters['date__lte'] = params['end']
+        if params.get('status') is not None:
+            filters['status'] = params['status']
+        # lazy: each table's rows are only queried once the client has read the previous ones
+        chunks = chain.from_iterable(export_chunks(model.objects.filter(**filters), serializer_class) for model, serializer_class in sources)
+        renderer = request.accepted_renderer
+        lines = EXPORT_FORMATS[renderer.format](chunks)
+        if isinstance(request._request, ASGIRequest):
+            lines = async_lines(lines)
+        response = StreamingHttpResponse(lines, content_type='%s; charset=utf-8' % renderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="orders.%s"' % renderer.format
+        return response